@@ -1,82 +1,455 @@
-import argparse, json, time
+import argparse, itertools, json, sys, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from ultralytics import YOLO
+import numpy as np
 import torch
+from postprocess import summarize_masks
+from infer_seg import expand_sources, find_packs, iter_pack_chunks
+from PatchPack import PatchPack
+from result_cache import ResultCache, bytes_digest, file_digest
+from instrument import recorder
+from export_seg import BACKENDS, exported_path, load_model
 
-def main():
+def build_record(path, orig_shape, masks, confs, clss, names, conf_thr, min_area_frac, coverage_at="mask", store_masks=None):
+    h, w = orig_shape
+    img_area = float(h * w)
+    kept = []
+    coverage = {}
+    if masks is not None:
+        instances, cov = summarize_masks(masks, confs, clss, (h, w), conf_thr, min_area_frac, coverage_at, store_masks)
+        for cls_id, conf, area_pix, *mask in instances:
+            seg = {
+                "class_id": cls_id,
+                "class_name": names.get(cls_id, str(cls_id)),
+                "conf": conf,
+                "area_pixels": area_pix,
+                "area_frac": area_pix / img_area
+            }
+            if mask:
+                seg["mask"] = mask[0]
+            kept.append(seg)
+        coverage = {names.get(c, str(c)): frac for c, frac in cov.items()}
+    return {"image": path, "height": h, "width": w, "segments_kept": kept, "coverage": coverage}
+
+def record_from_result(res, names, conf_thr, min_area_frac, coverage_at="mask", store_masks=None):
+    recorder.add_speed(res.speed)
+    with recorder.stage("mask_postprocess", image=res.path):
+        if res.masks is not None and res.boxes is not None:
+            return build_record(res.path, res.orig_shape, res.masks.data, res.boxes.conf, res.boxes.cls,
+                                names, conf_thr, min_area_frac, coverage_at, store_masks)
+        return build_record(res.path, res.orig_shape, None, None, None, names, conf_thr, min_area_frac)
+
+def analyze_results(results, names, conf_thr, min_area_frac, coverage_at="mask", store_masks=None):
+    # "model" is the wait on ultralytics: its own decoding (default route), preprocess, forward and NMS.
+    for res in recorder.timed_iter(results, "model"):
+        yield record_from_result(res, names, conf_thr, min_area_frac, coverage_at, store_masks)
+
+def prefetch_batches(files, batch, workers):
+    """Yield lists of (path, BGR image) while upcoming images decode on a thread pool.
+
+    A batch holds up to ``batch`` consecutive images of one shape, so ultralytics
+    letterboxes them exactly as it would one at a time.
+    """
+    from ultralytics.utils.patches import imread
+    it = iter(files)
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        pending = deque((f, pool.submit(recorder.timed_call, "decode", imread, f))
+                        for _, f in zip(range(max(2 * batch, 2 * workers, 2)), it))
+        cur = []
+        while pending:
+            if recorder.enabled:
+                recorder.gauge("prefetch_ready", sum(fut.done() for _, fut in pending))
+            path, fut = pending.popleft()
+            nxt = next(it, None)
+            if nxt is not None:
+                pending.append((nxt, pool.submit(recorder.timed_call, "decode", imread, nxt)))
+            with recorder.stage("decode_wait"):
+                im = fut.result()
+            if im is None:
+                print(f"Skipped unreadable image: {path}")
+                continue
+            if cur and (len(cur) == batch or im.shape != cur[0][1].shape):
+                yield cur
+                cur = []
+            cur.append((path, im))
+        if cur:
+            yield cur
+
+def analyze_batched(model, files, names, args):
+    for chunk in prefetch_batches(files, args.batch, args.prefetch_workers):
+        results = model([im for _, im in chunk], conf=args.conf, stream=True, imgsz=args.imgsz, verbose=False)
+        for (path, _), rec in zip(chunk, analyze_results(results, names, args.conf, args.min_area_frac, args.coverage_res, args.store_masks)):
+            rec["image"] = path
+            yield rec
+
+def analyze_packs(model, packs, names, args, skip=()):
+    for pack_path in packs:
+        for chunk in recorder.timed_iter(iter_pack_chunks(pack_path, chunk=max(args.batch, 1)), "decode"):
+            chunk = [c for c in chunk if c[0] not in skip]
+            if not chunk:
+                continue
+            results = model([im for _, im in chunk], conf=args.conf, stream=True, imgsz=args.imgsz, verbose=False)
+            for (vpath, _), rec in zip(chunk, analyze_results(results, names, args.conf, args.min_area_frac, args.coverage_res, args.store_masks)):
+                rec["image"] = vpath
+                yield rec
+
+def analyze_tiled_sources(model, sources, names, args):
+    from tiled_analysis import analyze_tiled
+    tile_size = (args.tile_width, args.tile_height or args.tile_width)
+    stride = (tile_size[0] - args.tile_overlap, tile_size[1] - args.tile_overlap)
+    for src in sources:
+        with recorder.stage("tiled_analysis", image=src):
+            out = analyze_tiled(model, src, names, tile_size, stride=stride, conf=args.conf,
+                                min_area_frac=args.min_area_frac, imgsz=args.imgsz, merge_iou=args.merge_iou)
+        yield {"image": src, **out}
+
+def pack_items(packs, index, skip=()):
+    """(virtual_path, digest) for every tile; ``index`` maps virtual paths back to (pack, tile)."""
+    for pack_path in packs:
+        with PatchPack(pack_path) as pack:
+            for i in range(len(pack)):
+                vpath = str(Path(pack_path) / pack.name(i))
+                if vpath in skip:
+                    continue
+                index[vpath] = (pack_path, i)
+                yield vpath, bytes_digest(pack.read_bytes(i))
+
+def pack_batches(paths, index, batch):
+    opened = {}
+    chunk = []
+    for vpath in paths:
+        pack_path, i = index[vpath]
+        if pack_path not in opened:
+            opened[pack_path] = PatchPack(pack_path)
+        with recorder.stage("decode"):
+            chunk.append((vpath, opened[pack_path].open(i).convert("RGB")))
+        if len(chunk) == batch:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+    for pack in opened.values():
+        pack.close()
+
+def analyze_cached(model, items, names, args, cache, prefetch):
+    """Serve cached images straight from ``cache`` and run the model on the rest.
+
+    ``items`` yields (path, digest); ``prefetch(paths)`` yields batches of (path, image)
+    for the misses. The model runs at ``cache.model_conf`` and the raw instances are
+    stored before --conf / --min-area-frac are applied.
+    """
+    pending = {}
+    for path, digest in recorder.timed_iter(items, "hash"):
+        key = cache.key(digest)
+        with recorder.stage("cache_read"):
+            entry = cache.get(key)
+        if entry is None:
+            pending[path] = key
+            continue
+        masks, confs, clss, orig_shape = (torch.from_numpy(a) if isinstance(a, np.ndarray) else a for a in entry)
+        with recorder.stage("mask_postprocess", image=path):
+            rec = build_record(path, orig_shape, masks, confs, clss, names, args.conf, args.min_area_frac, args.coverage_res, args.store_masks)
+        yield rec
+    for chunk in prefetch(list(pending)):
+        results = model([im for _, im in chunk], conf=cache.model_conf, stream=True, imgsz=args.imgsz, verbose=False)
+        for (path, _), res in zip(chunk, recorder.timed_iter(results, "model")):
+            with recorder.stage("cache_write", image=path):
+                if res.masks is not None and res.boxes is not None:
+                    masks = res.masks.data
+                    masks = masks if masks.dtype == torch.bool else masks > 0.5
+                    cache.put(pending[path], masks.cpu().numpy(), res.boxes.conf.cpu().numpy(), res.boxes.cls.cpu().numpy(), res.orig_shape)
+                else:
+                    cache.put(pending[path], np.zeros((0, 0, 0), bool), [], [], res.orig_shape)
+            rec = record_from_result(res, names, args.conf, args.min_area_frac, args.coverage_res, args.store_masks)
+            rec["image"] = path
+            yield rec
+
+def prefilter_validation(screens, missed, total, outdir):
+    """Vegetation predicted on tiles the pre-screen would skip, against ``total`` predicted vegetation pixels.
+
+    The per-class pixels list every class, but the share only counts the vegetation classes
+    the screen is meant to find. Written to <outdir>/prefilter_validation.json.
+    """
+    from prefilter import VEGETATION_CLASSES
+    missed_px = {}
+    for _, coverage, area in missed:
+        for name, frac in coverage.items():
+            missed_px[name] = missed_px.get(name, 0.0) + frac * area
+    with_cov = [img for img, coverage, _ in missed if any(coverage.get(c, 0) > 0 for c in VEGETATION_CLASSES)]
+    report = {
+        "screened": len(screens),
+        "would_skip": sum(i["would_skip"] for i in screens.values()),
+        "vegetation_classes": list(VEGETATION_CLASSES),
+        "would_skip_with_vegetation": len(with_cov),
+        "missed_pixels_per_class": dict(sorted(missed_px.items())),
+        "missed_share_of_vegetation": sum(missed_px.get(c, 0.0) for c in VEGETATION_CLASSES) / total if total > 0 else 0.0,
+        "images_with_missed_vegetation": with_cov,
+    }
+    with open(outdir / "prefilter_validation.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+def build_parser():
     ap = argparse.ArgumentParser()
     ap.add_argument("--weights", required=True)
+    ap.add_argument("--backend", choices=list(BACKENDS), default="torch",
+                    help="Run the .pt file (torch) or its export made by export_seg.py")
     ap.add_argument("--source", required=True)
     ap.add_argument("--conf", type=float, default=0.5)
     ap.add_argument("--min-area-frac", type=float, default=0.01)
     ap.add_argument("--imgsz", type=int, default=1280)
     ap.add_argument("--outdir", default=None)
-    args = ap.parse_args()
+    ap.add_argument("--coverage-res", choices=["mask", "orig"], default="mask",
+                    help="Resolution of the per-class union coverage: model mask grid or original image size")
+    ap.add_argument("--store-masks", choices=["rle", "poly"], default=None,
+                    help="Keep each kept instance's mask in the results: run-length encoded on the mask grid (exact) or as simplified polygons in image pixels")
+    ap.add_argument("--batch", type=int, default=1, help="Images per forward pass")
+    ap.add_argument("--prefetch-workers", type=int, default=0, help="Threads decoding upcoming images while the model runs")
+    ap.add_argument("--tile-width", type=int, default=None, help="Tile each (large) image in memory and stitch the results into one JSON")
+    ap.add_argument("--tile-height", type=int, default=None, help="Defaults to --tile-width")
+    ap.add_argument("--tile-overlap", type=int, default=0, help="Pixels shared by neighbouring tiles; needed to merge border segments")
+    ap.add_argument("--merge-iou", type=float, default=0.5, help="Mask IoU inside the overlap above which border segments are merged")
+    ap.add_argument("--sink", choices=["json", "store"], default="json",
+                    help="json: one file per image under <outdir>/json; store: append to the result store <outdir>/store (resumable)")
+    ap.add_argument("--store-batch", type=int, default=1000, help="Images per committed batch of the result store")
+    ap.add_argument("--metrics-dir", default=None,
+                    help="Record per-stage wall/CPU time and queue depths; writes metrics.json and metrics.prom here")
+    ap.add_argument("--trace", action="store_true", help="With --metrics-dir, also write per-image trace events (trace.json)")
+    ap.add_argument("--cache-dir", default=None,
+                    help="Keep raw model output in this persistent cache, keyed on image and weights content (off by default)")
+    ap.add_argument("--cache-max-mb", type=float, default=2048, help="Evict least recently used cache entries beyond this size")
+    ap.add_argument("--cache-conf", type=float, default=0.25,
+                    help="Confidence the model runs at when filling the cache; any --conf at or above it is served from cached results")
+    ap.add_argument("--no-cache", action="store_true", help="Ignore --cache-dir: always run the model and leave the cache untouched")
+    ap.add_argument("--prefilter", action="store_true",
+                    help="Screen every tile at low resolution first; tiles without vegetation or mostly blank skip the model")
+    ap.add_argument("--prefilter-min-green", type=float, default=0.005, help="Skip tiles with a smaller share of green pixels")
+    ap.add_argument("--prefilter-max-blank", type=float, default=0.98, help="Skip tiles with at least this share of black padding")
+    ap.add_argument("--prefilter-workers", type=int, default=4, help="Threads decoding tiles for the pre-screen")
+    ap.add_argument("--prefilter-validate", action="store_true",
+                    help="Run every tile anyway and report how much predicted coverage the pre-screen would have skipped")
+    ap.add_argument("--dedup", action="store_true",
+                    help="Group near-identical images by perceptual hash, run the model once per group and copy its result to the rest")
+    ap.add_argument("--dedup-threshold", type=int, default=10, help="Largest Hamming distance (of 64 bits) between grouped images")
+    ap.add_argument("--dedup-index", default="cache/phash_index.json", help="Persistent perceptual hash index, reused across runs")
+    ap.add_argument("--server", default=None, help="Submit the run to inference_server.py at this URL instead of loading the model here")
+    return ap
+
+def run(args, model=None, cancel=None, progress=None):
+    """One analysis run; the inference server passes its warm ``model``, a ``cancel`` event and a ``progress(images)`` callback."""
+    with recorder.run_scope():  # metrics of this run only, even on a shared server thread
+        return _run(args, model, cancel, progress)
 
+def _run(args, model, cancel, progress):
+    if args.tile_width and args.tile_overlap >= min(args.tile_width, args.tile_height or args.tile_width):
+        print(f"Invalid --tile-overlap {args.tile_overlap}: it must be smaller than --tile-width and --tile-height.")
+        sys.exit(2)
     ts = time.strftime("%Y-%m-%d_%H-%M-%S")
     outdir = Path(args.outdir or f"reports/{ts}")
-    json_dir = outdir / "json"
-    json_dir.mkdir(parents=True, exist_ok=True)
+    store = None
+    done = set()
+    if args.sink == "store":
+        from result_store import ResultStoreWriter
+        result_dir = outdir / "store"
+        store = ResultStoreWriter(result_dir, batch=args.store_batch)
+        done = store.done
+    else:
+        result_dir = outdir / "json"
+        result_dir.mkdir(parents=True, exist_ok=True)
 
     print("Analysis start")
-    print(f"- weights:        {args.weights}")
+    print(f"- weights:        {args.weights} ({args.backend})")
     print(f"- source:         {args.source}")
     print(f"- conf:           {args.conf}")
     print(f"- min_area_frac:  {args.min_area_frac}")
     print(f"- imgsz:          {args.imgsz}")
+    if args.batch > 1 or args.prefetch_workers:
+        print(f"- batch:          {args.batch} (prefetch workers: {args.prefetch_workers})")
+    if args.tile_width:
+        print(f"- tiles:          {args.tile_width}x{args.tile_height or args.tile_width} overlap={args.tile_overlap}")
+    if args.store_masks:
+        print(f"- store masks:    {args.store_masks}" + (" (not for tiled runs)" if args.tile_width else ""))
+    if args.prefilter or args.prefilter_validate:
+        print(f"- prefilter:      green < {args.prefilter_min_green:g} or blank >= {args.prefilter_max_blank:g}"
+              + (" (validation, nothing skipped)" if args.prefilter_validate else ""))
+    if args.dedup:
+        print(f"- dedup:          hamming <= {args.dedup_threshold} ({args.dedup_index})")
+    if done:
+        print(f"- resuming:       {len(done)} image(s) already in {result_dir}")
 
-    model = YOLO(args.weights)
-    names = model.model.names if hasattr(model.model, "names") else {}
+    if args.metrics_dir:
+        recorder.enable("analyze_masks", trace=args.trace)
+    if model is None:
+        with recorder.stage("model_load"):
+            model = load_model(args.weights, args.backend)
+    names = model.names
 
-    results = model(args.source, conf=args.conf, stream=True, imgsz=args.imgsz, verbose=False)
+    with recorder.stage("listing"):
+        packs = find_packs(args.source)
+    screens, skipped = {}, {}
+    groups = None
+    skip = done
+    files = []
+    # Tiled runs work on whole images, not the tiles they are cut into, so neither dedup nor the pre-screen applies.
+    if (args.dedup or args.prefilter or args.prefilter_validate) and not args.tile_width and not packs:
+        from ultralytics.data.loaders import LoadImagesAndVideos
+        loader = LoadImagesAndVideos(args.source)
+        files = loader.files[:loader.ni]
+    if args.dedup and not args.tile_width:
+        from dedup import DedupIndex, group_sources
+        dedup_index = DedupIndex(args.dedup_index)
+        t_hash = time.perf_counter()
+        with recorder.stage("dedup"):
+            groups = group_sources(files, packs, dedup_index, args.dedup_threshold, done, args.prefilter_workers)
+        dedup_index.save()
+        skip = set(done) | set(groups.dup_of)
+        print(f"- dedup:          {len(groups.shapes)} image(s) in {len(groups.shapes) - len(groups)} group(s), "
+              f"{len(groups)} duplicate(s); {groups.hashed} hashed in {time.perf_counter() - t_hash:.2f}s")
+    if (args.prefilter or args.prefilter_validate) and not args.tile_width:
+        from prefilter import VEGETATION_CLASSES, screen_sources, would_skip
+        t_screen = time.perf_counter()
+        with recorder.stage("prefilter"):
+            screens = screen_sources(files, packs, skip, args.prefilter_workers)
+        t_screen = time.perf_counter() - t_screen
+        for path, info in screens.items():
+            info["would_skip"] = would_skip(info, args.prefilter_min_green, args.prefilter_max_blank)
+        if not args.prefilter_validate:
+            skipped = {p: info for p, info in screens.items() if info["would_skip"]}
+            skip = set(skip) | set(skipped)
+        print(f"- prefilter:      screened {len(screens)} image(s) in {t_screen:.2f}s, "
+              f"{sum(i['would_skip'] for i in screens.values())} without vegetation")
+    cache = None
+    # Tiled runs stitch instances across tiles and are not cached.
+    if args.cache_dir and not args.no_cache and not args.tile_width and (packs or Path(args.source).exists() or "*" in args.source):
+        cache = ResultCache(args.cache_dir, exported_path(args.weights, args.backend), args.imgsz, min(args.conf, args.cache_conf), int(args.cache_max_mb * 1024 * 1024))
+        print(f"- cache:          {args.cache_dir} (model conf {cache.model_conf}, max {args.cache_max_mb:g} MB)")
+    if args.tile_width:
+        records = analyze_tiled_sources(model, [s for s in expand_sources([args.source]) if s not in skip], names, args)
+    elif cache is not None and packs:
+        index = {}
+        records = analyze_cached(model, pack_items(packs, index, skip), names, args, cache,
+                                 lambda paths: pack_batches(paths, index, max(args.batch, 1)))
+    elif cache is not None:
+        from ultralytics.data.loaders import LoadImagesAndVideos
+        with recorder.stage("listing"):
+            loader = LoadImagesAndVideos(args.source)
+        records = analyze_cached(model, ((f, file_digest(f)) for f in loader.files[:loader.ni] if f not in skip), names, args, cache,
+                                 lambda paths: prefetch_batches(paths, args.batch, args.prefetch_workers))
+    elif packs:
+        records = analyze_packs(model, packs, names, args, skip)
+    elif args.batch > 1 or args.prefetch_workers or skip:
+        from ultralytics.data.loaders import LoadImagesAndVideos
+        with recorder.stage("listing"):
+            loader = LoadImagesAndVideos(args.source)
+        records = analyze_batched(model, [f for f in loader.files[:loader.ni] if f not in skip], names, args)
+    else:
+        results = model(args.source, conf=args.conf, stream=True, imgsz=args.imgsz, verbose=False)
+        records = analyze_results(results, names, args.conf, args.min_area_frac, args.coverage_res, args.store_masks)
+    if skipped:
+        from prefilter import skipped_record
+        records = itertools.chain(records, (skipped_record(p, info) for p, info in skipped.items()))
+    if groups:
+        from dedup import with_duplicates
+        records = with_duplicates(records, groups)
     num_imgs = 0
     kept_total = 0
+    model_imgs = 0
+    model_seconds = 0.0
+    reused = 0
+    missed = []
+    covered_px = 0.0
+    t0 = time.perf_counter()
+    t_model = t0
 
-    for res in results:
+    for rec in records:
+        if cancel is not None and cancel.is_set():
+            print("Cancelled")
+            break
         num_imgs += 1
-        h, w = res.orig_shape
-        img_area = float(h * w)
-        kept = []
-        if res.masks is not None and res.boxes is not None:
-            masks = res.masks.data
-            confs = res.boxes.conf.cpu().tolist()
-            clss = res.boxes.cls.cpu().tolist()
-            for i in range(masks.shape[0]):
-                conf = float(confs[i])
-                cls_id = int(clss[i])
-                mask = masks[i]
-                if mask.dtype != torch.bool:
-                    mask = mask > 0.5
-                area_pix = int(mask.sum().item())
-                area_frac = area_pix / img_area
-                if conf >= args.conf and area_frac >= args.min_area_frac:
-                    kept.append({
-                        "class_id": cls_id,
-                        "class_name": names.get(cls_id, str(cls_id)),
-                        "conf": conf,
-                        "area_pixels": area_pix,
-                        "area_frac": area_frac
-                    })
-        stem = Path(res.path).stem
-        with open(json_dir / f"{stem}.json", "w", encoding="utf-8") as f:
-            json.dump({
-                "image": res.path,
-                "height": h,
-                "width": w,
-                "segments_kept": kept,
-                "params": {
-                    "conf_threshold": args.conf,
-                    "min_area_frac": args.min_area_frac
-                }
-            }, f, ensure_ascii=False, indent=2)
+        if "dedup" in rec:
+            reused += 1
+        elif rec["image"] not in skipped:
+            model_imgs += 1
+            model_seconds += time.perf_counter() - t_model
+        kept = rec["segments_kept"]
+        stem = Path(rec["image"]).stem
+        rec = {
+            **rec,
+            "params": {
+                "conf_threshold": args.conf,
+                "min_area_frac": args.min_area_frac
+            }
+        }
+        info = screens.get(rec["image"])
+        if info is not None:
+            rec["prefilter"] = {"skipped": rec["image"] in skipped, "would_skip": info["would_skip"],
+                                "green_frac": info["green_frac"], "blank_frac": info["blank_frac"]}
+            covered_px += sum(rec["coverage"].get(c, 0.0) for c in VEGETATION_CLASSES) * rec["height"] * rec["width"]
+            if info["would_skip"] and args.prefilter_validate:
+                missed.append((rec["image"], rec["coverage"], rec["height"] * rec["width"]))
+        with recorder.stage("write", image=rec["image"]):
+            if store is not None:
+                store.add(rec)
+            else:
+                with open(result_dir / f"{stem}.json", "w", encoding="utf-8") as f:
+                    json.dump(rec, f, ensure_ascii=False, indent=2)
+        recorder.count("images")
+        recorder.count("segments_kept", len(kept))
         kept_total += len(kept)
         print(f"Processed: {stem} kept_segments={len(kept)}")
+        if progress is not None:
+            progress(num_imgs)
+        t_model = time.perf_counter()
 
+    if store is not None:
+        with recorder.stage("write"):
+            store.close()
+    elapsed = time.perf_counter() - t0
     print("Analysis done")
     print(f"- images:     {num_imgs}")
+    print(f"- images/sec: {num_imgs / elapsed if elapsed > 0 else 0.0:.2f}")
     print(f"- kept total: {kept_total}")
+    if skipped:
+        per_image = model_seconds / model_imgs if model_imgs else 0.0
+        print(f"- prefilter:  {len(skipped)} image(s) skipped, ~{per_image * len(skipped):.1f}s of model time saved "
+              f"({per_image * 1000.0:.0f} ms/image), screening took {t_screen:.1f}s")
+        print(f"  warning: their JSON has zero coverage for every class; only {', '.join(VEGETATION_CLASSES)} were screened, "
+              f"other classes on those tiles are not measured")
+        recorder.count("prefilter_skipped", len(skipped))
+    if groups is not None:
+        per_image = model_seconds / model_imgs if model_imgs else 0.0
+        dedup_index.saved["images"] += reused
+        dedup_index.saved["seconds"] += per_image * reused
+        dedup_index.save()
+        print(f"- dedup:      {reused} duplicate(s) reused, ~{per_image * reused:.1f}s of model time saved "
+              f"(index total: {dedup_index.saved['images']} image(s), ~{dedup_index.saved['seconds']:.0f}s)")
+        recorder.count("dedup_reused", reused)
+    if args.prefilter_validate and screens:
+        report = prefilter_validation(screens, missed, covered_px, outdir)
+        print(f"- prefilter:  would skip {report['would_skip']} of {report['screened']} image(s); "
+              f"{report['would_skip_with_vegetation']} of those have predicted vegetation, "
+              f"{report['missed_share_of_vegetation'] * 100.0:.2f}% of all predicted vegetation would be missed")
+    if cache is not None:
+        kept_bytes = cache.evict()
+        lookups = cache.hits + cache.misses
+        print(f"- cache:      {cache.hits} hit(s), {cache.misses} miss(es) ({100.0 * cache.hits / lookups if lookups else 0.0:.1f}% hit rate), "
+              f"{cache.evicted} evicted, {kept_bytes / 1048576:.2f} MB on disk")
+        recorder.count("cache_hits", cache.hits)
+        recorder.count("cache_misses", cache.misses)
+        recorder.count("cache_evicted", cache.evicted)
+    for path in recorder.write(args.metrics_dir) if args.metrics_dir else []:
+        print(f"- metrics:    {path}")
     print(f"- output dir: {outdir}")
-    print(f"Next: python .\\src\\generate_report.py --indir {json_dir}")
+    print(f"Next: python .\\src\\generate_report.py --indir {result_dir}")
+    return num_imgs
+
+def main():
+    args = build_parser().parse_args()
+    if args.server:
+        from inference_client import submit_and_wait
+        sys.exit(submit_and_wait(args.server, "analyze", sys.argv[1:]))
+    run(args)
 
 if __name__ == "__main__":
     main()
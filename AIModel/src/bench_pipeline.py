@@ -0,0 +1,208 @@
+import argparse, contextlib, io, json, multiprocessing, os, platform, shutil, sys, tempfile, time
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "CreatingImages"))
+from bench_memory import peak_rss_mb
+
+# Data sizes per preset: raster side (px), patch side (px), result JSON files,
+# masks per postprocessed image, images through the tiny model and its input size.
+PRESETS = {
+    "small": {"raster": 2048, "patch": 512, "json_files": 2000, "masks": 50, "infer_images": 8, "imgsz": 320},
+    "medium": {"raster": 8192, "patch": 1024, "json_files": 20000, "masks": 200, "infer_images": 32, "imgsz": 640},
+    "large": {"raster": 16384, "patch": 1024, "json_files": 100000, "masks": 500, "infer_images": 64, "imgsz": 640},
+}
+STAGES = ["split", "merge", "merge_streaming", "postprocess", "inference", "report"]
+# Higher is better for throughput, lower for the rest.
+COMPARED = {"throughput": 1, "p50_ms": -1, "peak_rss_mb": -1}
+
+def make_raster(path, side, seed=0):
+    """Write a side x side RGB TIFF of smooth colour fields plus noise, a few rows at a time."""
+    from CreatingBigImage import StripTiffWriter
+    rng = np.random.default_rng(seed)
+    xs = np.linspace(0, 6 * np.pi, side, dtype=np.float32)
+    phase = rng.random(3).astype(np.float32) * 6
+    w = StripTiffWriter(path, side, side)
+    for top in range(0, side, 256):
+        ys = xs[top:top + 256, None]
+        base = np.stack([np.sin(xs[None] * (c + 1) + ys * (3 - c) + phase[c]) for c in range(3)], axis=-1)
+        noise = rng.integers(0, 24, size=base.shape, dtype=np.uint8)
+        w.write_rows((base * 100 + 128).astype(np.uint8) + noise)
+    w.close()
+
+def prepare(preset, workdir):
+    """Generate the synthetic inputs for a preset once; later runs reuse them."""
+    cfg = PRESETS[preset]
+    root = Path(workdir) / preset
+    raster = root / "raster.tif"
+    patches = root / "patches"
+    json_dir = root / "results" / "json"
+    if not raster.exists():
+        root.mkdir(parents=True, exist_ok=True)
+        make_raster(raster, cfg["raster"])
+    if not patches.exists():
+        from CreatingPatches import split_image_into_patches
+        with contextlib.redirect_stdout(io.StringIO()):
+            split_image_into_patches(raster, (cfg["patch"], cfg["patch"]), patches, "patch", "png")
+    if not json_dir.exists():
+        from bench_report import write_synthetic
+        write_synthetic(json_dir, 0, cfg["json_files"])
+    return root
+
+def run_split(cfg, root, scratch, repeat):
+    from CreatingPatches import split_image_into_patches
+    lat, items = [], 0
+    for i in range(repeat):
+        out = scratch / f"split{i}"
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            items += split_image_into_patches(root / "raster.tif", (cfg["patch"], cfg["patch"]), out, "patch", "png")
+        lat.append(time.perf_counter() - t0)
+        shutil.rmtree(out, ignore_errors=True)
+    return items, lat
+
+def _run_merge(root, scratch, repeat, streaming):
+    from CreatingBigImage import merge_patches, merge_patches_streaming
+    lat = []
+    for i in range(repeat):
+        out = scratch / f"merged{i}.tif"
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            if streaming:
+                merge_patches_streaming(root / "patches", out, workers=1)
+            else:
+                merge_patches(root / "patches", out)
+        lat.append(time.perf_counter() - t0)
+        out.unlink(missing_ok=True)
+    return repeat * len(list((root / "patches").glob("patch_*.png"))), lat
+
+def run_merge(cfg, root, scratch, repeat):
+    return _run_merge(root, scratch, repeat, streaming=False)
+
+def run_merge_streaming(cfg, root, scratch, repeat):
+    return _run_merge(root, scratch, repeat, streaming=True)
+
+def run_postprocess(cfg, root, scratch, repeat):
+    from bench_postprocess import synthetic
+    from postprocess import summarize_masks
+    masks, confs, clss = synthetic(cfg["masks"], 384, 640, 5, "cpu")
+    lat = []
+    for _ in range(repeat * 10):
+        t0 = time.perf_counter()
+        summarize_masks(masks, confs, clss, (1152, 1920), 0.25, 0.0)
+        lat.append(time.perf_counter() - t0)
+    return len(lat), lat
+
+def run_inference(cfg, root, scratch, repeat):
+    os.environ.setdefault("YOLO_CONFIG_DIR", str(scratch / "ultralytics"))
+    from ultralytics import YOLO
+    from ultralytics.utils.patches import imread
+    from analyze_masks import analyze_results
+    model = YOLO("yolov8n-seg.yaml")  # random weights, nothing to download
+    names = model.model.names
+    files = sorted((root / "patches").glob("patch_*.png"))[:cfg["infer_images"]]
+    images = [imread(str(f)) for f in files]
+    model(images[:1], imgsz=cfg["imgsz"], verbose=False)  # warm-up
+    lat = []
+    for _ in range(repeat):
+        for im in images:
+            t0 = time.perf_counter()
+            results = model(im, conf=0.0, imgsz=cfg["imgsz"], stream=True, verbose=False)
+            for _ in analyze_results(results, names, 0.0, 0.0):
+                pass
+            lat.append(time.perf_counter() - t0)
+    return len(lat), lat
+
+def run_report(cfg, root, scratch, repeat):
+    from report_aggregate import update_aggregate
+    lat = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        agg, _ = update_aggregate(root / "results" / "json", scratch / "state.json", rebuild=True)
+        lat.append(time.perf_counter() - t0)
+    return repeat * agg.images, lat
+
+def run_case(stage, preset, workdir, repeat):
+    """One stage at one size, in a fresh process so peak RSS belongs to this case alone."""
+    cfg = PRESETS[preset]
+    root = Path(workdir) / preset
+    scratch = Path(tempfile.mkdtemp(prefix=f"{stage}_", dir=workdir))
+    try:
+        items, lat = globals()[f"run_{stage}"](cfg, root, scratch, repeat)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    ms = np.array(lat) * 1000.0
+    return {
+        "stage": stage,
+        "preset": preset,
+        "items": items,
+        "seconds": float(sum(lat)),
+        "throughput": items / sum(lat) if sum(lat) else 0.0,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def compare(results, baseline, tolerance):
+    """Cases whose throughput, median latency or peak RSS got worse than the baseline by more than ``tolerance``."""
+    base = {(r["stage"], r["preset"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        b = base.get((r["stage"], r["preset"]))
+        if b is None:
+            continue
+        for metric, sign in COMPARED.items():
+            old, new = b.get(metric), r.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * sign
+            if change < -tolerance:
+                regressions.append(f"{r['stage']}/{r['preset']}: {metric} {old:.2f} -> {new:.2f} ({-change * 100:.0f}% worse)")
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser(description="Time every pipeline stage on synthetic data (CPU, offline).")
+    ap.add_argument("--presets", nargs="+", choices=list(PRESETS), default=["small"])
+    ap.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--workdir", default="bench_data", help="Synthetic inputs are generated here once and reused")
+    ap.add_argument("--out", default="bench_results.json", help="Machine-readable results")
+    ap.add_argument("--baseline", default=None, help="Results file of an earlier run to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.15, help="Relative slack before a change counts as a regression")
+    args = ap.parse_args()
+
+    workdir = Path(args.workdir)
+    for preset in args.presets:
+        t0 = time.perf_counter()
+        prepare(preset, workdir)
+        print(f"Prepared {preset} data in {time.perf_counter() - t0:.1f}s")
+
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    print("| Stage | Preset | Items | Items/s | p50 (ms) | p90 (ms) | p99 (ms) | Peak RSS (MB) |\n|---|---|---:|---:|---:|---:|---:|---:|")
+    for preset in args.presets:
+        for stage in args.stages:
+            with ctx.Pool(1) as pool:
+                r = pool.apply(run_case, (stage, preset, str(workdir), args.repeat))
+            results.append(r)
+            rss = f"{r['peak_rss_mb']:.0f}" if r["peak_rss_mb"] is not None else "-"
+            print(f"| {stage} | {preset} | {r['items']} | {r['throughput']:.1f} | {r['p50_ms']:.1f} | {r['p90_ms']:.1f} | {r['p99_ms']:.1f} | {rss} |")
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"), "machine": platform.platform(),
+                   "cpus": os.cpu_count(), "repeat": args.repeat, "results": results}, f, indent=2)
+    print(f"Results saved: {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"Regressions against {args.baseline} (tolerance {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"- {line}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse, json, random, shutil, tempfile, time
+from collections import defaultdict
+from pathlib import Path
+from report_aggregate import update_aggregate
+
+# The classes of data/MainDataSet.v6i.yolov8/data.yaml, in its order.
+CLASSES = ["bare-soil", "building", "grass", "tree", "water"]
+
+def legacy_means(json_dir):
+    # generate_report's original aggregation, kept as the reference.
+    per_image = []
+    class_set = set()
+    for jf in sorted(Path(json_dir).glob("*.json")):
+        with open(jf, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        img_area = float(data["height"] * data["width"])
+        d = defaultdict(float)
+        for seg in data.get("segments_kept", []):
+            cname = seg.get("class_name", str(seg.get("class_id", "?")))
+            d[cname] += float(seg["area_pixels"]) / img_area
+            class_set.add(cname)
+        per_image.append(d)
+    nimg = len(per_image)
+    return {c: sum(d.get(c, 0.0) for d in per_image) / nimg * 100.0 for c in sorted(class_set)}
+
+def write_synthetic(json_dir, start, count, seed=0):
+    rng = random.Random(seed + start)
+    json_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(start, start + count):
+        h, w = 640, 640
+        segs = []
+        for _ in range(rng.randint(0, 12)):
+            cls_id = rng.randrange(len(CLASSES))
+            area = rng.randint(50, 40000)
+            segs.append({"class_id": cls_id, "class_name": CLASSES[cls_id], "conf": rng.random(),
+                         "area_pixels": area, "area_frac": area / (h * w)})
+        rec = {"image": f"patch_{i}.png", "height": h, "width": w, "segments_kept": segs, "coverage": {},
+               "params": {"conf_threshold": 0.5, "min_area_frac": 0.01}}
+        with open(json_dir / f"patch_{i}.json", "w", encoding="utf-8") as f:
+            json.dump(rec, f, indent=2)
+
+def timed(fn):
+    t0 = time.perf_counter()
+    out = fn()
+    return out, time.perf_counter() - t0
+
+def main():
+    ap = argparse.ArgumentParser(description="Time generate_report's aggregation on synthetic analyzer JSON files.")
+    ap.add_argument("--files", type=int, nargs="+", default=[100000])
+    ap.add_argument("--add-frac", type=float, default=0.01, help="Share of new files for the incremental run")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--workdir", default=None, help="Where to write the synthetic files (default: a temp folder)")
+    ap.add_argument("--skip-legacy", action="store_true", help="Do not time the original serial loop")
+    args = ap.parse_args()
+
+    root = Path(args.workdir or tempfile.mkdtemp(prefix="bench_report_"))
+    print("| Files | Legacy (s) | Engine cold (s) | Speedup | New files | Incremental (s) |\n|---:|---:|---:|---:|---:|---:|")
+    try:
+        for n in args.files:
+            json_dir = root / f"n{n}" / "json"
+            state = json_dir.parent / "state.json"
+            write_synthetic(json_dir, 0, n)
+            (agg, _), t_cold = timed(lambda: update_aggregate(json_dir, state, workers=args.workers, rebuild=True))
+            t_legacy = None
+            if not args.skip_legacy:
+                ref, t_legacy = timed(lambda: legacy_means(json_dir))
+                if any(abs(ref[c] - agg.mean(c) * 100.0) > 1e-9 for c in ref):
+                    print(f"Mismatch at {n} files")
+            added = max(int(n * args.add_frac), 1)
+            write_synthetic(json_dir, n, added)
+            (_, processed), t_inc = timed(lambda: update_aggregate(json_dir, state, workers=args.workers))
+            legacy = f"{t_legacy:.2f} | {t_cold:.2f} | {t_legacy / t_cold:.1f}x" if t_legacy else f"- | {t_cold:.2f} | -"
+            print(f"| {n} | {legacy} | {processed} | {t_inc:.2f} |")
+    finally:
+        if not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import math, re
+from pathlib import Path
+import numpy as np
+
+# Per-image area fraction histogram: HIST_BINS equal bins over [0, 1) plus one overflow bin.
+HIST_BINS = 10
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9, 0.99)
+
+def hist_labels():
+    step = 100 // HIST_BINS
+    return [f"{i * step}-{(i + 1) * step}%" for i in range(HIST_BINS)] + [">=100%"]
+
+def hist_bin(v):
+    return min(int(v * HIST_BINS), HIST_BINS)
+
+def hist_bins(values):
+    return np.minimum((np.asarray(values, dtype=np.float64) * HIST_BINS).astype(np.int64), HIST_BINS)
+
+def region_of(image, pattern=None):
+    """Region an image belongs to: the first group of ``pattern`` in its path, else its parent folder name."""
+    if pattern:
+        m = re.search(pattern, str(image))
+        return m.group(1) if m and m.groups() else (m.group(0) if m else "?")
+    return Path(str(image)).parent.name or "."
+
+class QuantileSketch:
+    """Log-bucket quantile sketch with relative accuracy ``alpha`` (the DDSketch scheme).
+
+    Values below ``min_value`` count as zero. Memory is one counter per occupied
+    bucket, about log(max / min_value) / log(gamma), whatever the number of values,
+    and two sketches merge by adding their counters.
+    """
+
+    def __init__(self, alpha=0.01, min_value=1e-6):
+        self.alpha = alpha
+        self.min_value = min_value
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zeros = 0
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, v):
+        self.count += 1
+        self.max = max(self.max, v)
+        if v < self.min_value:
+            self.zeros += 1
+        else:
+            k = math.ceil(math.log(v) / self.log_gamma)
+            self.bins[k] = self.bins.get(k, 0) + 1
+
+    def add_many(self, values):
+        v = np.asarray(values, dtype=np.float64)
+        if not len(v):
+            return
+        self.count += len(v)
+        self.max = max(self.max, float(v.max()))
+        small = v < self.min_value
+        self.zeros += int(small.sum())
+        keys, counts = np.unique(np.ceil(np.log(v[~small]) / self.log_gamma).astype(np.int64), return_counts=True)
+        for k, n in zip(keys.tolist(), counts.tolist()):
+            self.bins[k] = self.bins.get(k, 0) + n
+
+    def merge(self, other):
+        if other.alpha != self.alpha or other.min_value != self.min_value:
+            raise ValueError("cannot merge quantile sketches with different accuracy settings")
+        for k, n in other.bins.items():
+            self.bins[k] = self.bins.get(k, 0) + n
+        self.zeros += other.zeros
+        self.count += other.count
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q, extra_zeros=0):
+        """q-quantile, counting ``extra_zeros`` more zero values than were added."""
+        total = self.count + extra_zeros
+        if not total:
+            return 0.0
+        rank = q * (total - 1)
+        seen = self.zeros + extra_zeros
+        if rank < seen:
+            return 0.0
+        for k in sorted(self.bins):
+            seen += self.bins[k]
+            if seen > rank:
+                return min(2 * self.gamma ** k / (self.gamma + 1), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {"alpha": self.alpha, "min_value": self.min_value, "zeros": self.zeros, "count": self.count,
+                "max": self.max, "bins": {str(k): n for k, n in self.bins.items()}}
+
+    @classmethod
+    def from_dict(cls, d):
+        sk = cls(d["alpha"], d["min_value"])
+        sk.zeros, sk.count, sk.max = d["zeros"], d["count"], d["max"]
+        sk.bins = {int(k): n for k, n in d["bins"].items()}
+        return sk
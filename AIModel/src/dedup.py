@@ -0,0 +1,263 @@
+import io, json, os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import cv2
+import numpy as np
+from PIL import Image
+from PatchPack import PatchPack
+
+# Bump when the hash or the stored entry changes; older indexes are then rebuilt.
+INDEX_VERSION = 2
+HASH_SIDE = 32
+# Share of each side hashed, around the centre: augmented copies are slightly rotated or
+# cropped, which fills the corners with black padding or cuts the edges differently.
+HASH_CROP = 0.8
+# Near-uniform tiles (bare soil, water, padding) all hash alike, so a group also needs
+# mean colours within this many levels per channel. The mean over the channels is taken
+# off first, so brightness shifts (as in Roboflow augmentations) do not split a group.
+MAX_COLOUR_DIFF = 12.0
+# The 8 flips and rotations of a tile, by index t: bit 4 transposes, then bit 2 flips
+# vertically and bit 1 horizontally.
+DIHEDRAL = ("identity", "flip-x", "flip-y", "rotate-180", "transpose", "rotate-90-cw", "rotate-90-ccw", "transverse")
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    m = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m.astype(np.float32)
+
+DCT = _dct_matrix(HASH_SIDE)
+
+def phash(thumbs):
+    """(n, 8) 64-bit DCT perceptual hashes (uint64) of a stack of HASH_SIDE x HASH_SIDE grayscale thumbnails.
+
+    Column t hashes the thumbnail as transformed by DIHEDRAL[t], derived from one DCT: a
+    flip negates the coefficients of odd frequency along its axis, a transpose transposes them.
+    """
+    coef = np.einsum("ij,njk,lk->nil", DCT, thumbs.astype(np.float32), DCT)[:, :8, :8]
+    odd = np.where(np.arange(8) % 2, -1.0, 1.0).astype(np.float32)
+    variants = []
+    for t in range(8):
+        c = np.swapaxes(coef, 1, 2) if t & 4 else coef
+        variants.append(c * (odd[:, None] if t & 2 else 1.0) * (odd[None, :] if t & 1 else 1.0))
+    coef = np.stack(variants, axis=1).reshape(len(thumbs), 8, 64)
+    med = np.median(coef[:, :, 1:], axis=2, keepdims=True)  # the DC term only says how bright the tile is
+    bits = np.packbits(coef > med, axis=2)
+    return bits.view(">u8")[..., 0].astype(np.uint64)
+
+def transform_array(a, t):
+    """``a`` (..., h, w) as transformed by DIHEDRAL[t]."""
+    if t & 4:
+        a = np.swapaxes(a, -1, -2)
+    if t & 2:
+        a = a[..., ::-1, :]
+    if t & 1:
+        a = a[..., ::-1]
+    return a
+
+def transform_points(x, y, size, t):
+    """Pixel-edge coordinates of an image of ``size`` (w, h) after DIHEDRAL[t]; returns (x, y, new size)."""
+    w, h = size
+    if t & 4:
+        x, y, w, h = y, x, h, w
+    if t & 2:
+        y = h - y
+    if t & 1:
+        x = w - x
+    return x, y, (w, h)
+
+def popcount(x):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x)
+    return np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+def thumbnail(data):
+    """(grayscale HASH_SIDE thumbnail of the central HASH_CROP, mean BGR, (h, w)) of an encoded image.
+
+    JPEGs decode straight to 1/4 size (DCT scaling averages like INTER_AREA); OpenCV's reduced
+    decode of other formats subsamples, which aliases fine texture, so those decode in full.
+    None when the bytes do not decode.
+    """
+    flag = cv2.IMREAD_REDUCED_COLOR_4 if data[:2] == b"\xff\xd8" else cv2.IMREAD_COLOR
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    if img is None:
+        return None
+    try:
+        w, h = Image.open(io.BytesIO(data)).size  # header only
+    except OSError:
+        return None
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gh, gw = gray.shape
+    m = int(round(min(gh, gw) * (1.0 - HASH_CROP) / 2))  # the same margin on both axes keeps transposes exact
+    gray = gray[m:gh - m, m:gw - m]
+    return cv2.resize(gray, (HASH_SIDE, HASH_SIDE), interpolation=cv2.INTER_AREA), img.reshape(-1, 3).mean(axis=0), (h, w)
+
+class DedupIndex:
+    """Perceptual hashes of every image seen so far, persisted as JSON and keyed on path + size + mtime."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        self.saved = {"images": 0, "seconds": 0.0}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION:
+                self.entries = data["entries"]
+                self.saved = data.get("saved", self.saved)
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "saved": self.saved, "entries": self.entries}, f)
+        os.replace(tmp, self.path)
+
+class Groups:
+    """Result of group_sources: representatives and the duplicates that reuse their results."""
+
+    def __init__(self):
+        self.dups_of = {}   # representative -> [(duplicate, hamming distance)]
+        self.dup_of = {}    # duplicate -> (representative, hamming distance)
+        self.transform = {} # duplicate -> DIHEDRAL index taking the representative onto it
+        self.shapes = {}    # path -> (h, w) of the original image
+        self.where = {}     # packed tile path -> (pack path, tile index)
+        self.hashed = 0     # images hashed this run (the rest came from the index)
+
+    def __len__(self):
+        return len(self.dup_of)
+
+    def drop(self, path):
+        """Let duplicate ``path`` run through the model after all."""
+        rep, _ = self.dup_of.pop(path)
+        self.transform.pop(path, None)
+        self.dups_of[rep] = [d for d in self.dups_of[rep] if d[0] != path]
+
+def group_sources(files, packs, index, threshold, skip=(), workers=4):
+    """Hash loose ``files`` and the tiles of ``packs`` (reusing ``index``) and group near-duplicates.
+
+    Images are visited in path order and each joins the closest earlier representative within
+    ``threshold`` bits (and MAX_COLOUR_DIFF) or becomes one itself, so groups are stable
+    across runs. The distance to a representative is the smallest over its 8 flips and
+    rotations, so flipped or rotated copies group too. Candidates come from exact matches on
+    ``threshold + 1`` bands of the hash: every variant of a representative is bucketed, and
+    two hashes that close always agree on at least one band.
+    """
+    groups = Groups()
+    items = []  # (path, stamp, reader)
+    for f in files:
+        if f not in skip:
+            st = os.stat(f)
+            items.append((f, [st.st_size, st.st_mtime_ns], lambda f=f: Path(f).read_bytes()))
+    opened = []
+    for pack_path in packs:
+        pack = PatchPack(pack_path)
+        opened.append(pack)
+        st = os.stat(pack_path)
+        for i in range(len(pack)):
+            vpath = str(Path(pack_path) / pack.name(i))
+            if vpath not in skip:
+                groups.where[vpath] = (pack_path, i)
+                items.append((vpath, [st.st_size, st.st_mtime_ns, i], lambda pack=pack, i=i: pack.read_bytes(i)))
+    items.sort(key=lambda it: it[0])
+
+    def one(item):
+        path, stamp, read = item
+        key = str(Path(path).resolve())
+        e = index.entries.get(key)
+        if e is not None and e["stamp"] == stamp:
+            return e, False
+        thumbed = thumbnail(read())
+        if thumbed is None:
+            return None, False
+        thumb, colour, (h, w) = thumbed
+        return {"stamp": stamp, "thumb": thumb, "colour": [float(c) for c in colour], "shape": [h, w]}, True
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:  # cv2 decoding releases the GIL
+            entries = list(pool.map(one, items))
+    finally:
+        for pack in opened:
+            pack.close()
+    # Unreadable images stay out of the groups (and the index) and run through the model like any other.
+    for (path, _, _), (e, _) in zip(items, entries):
+        if e is None:
+            print(f"Dedup: unreadable image, not grouped: {path}")
+    items = [it for it, (e, _) in zip(items, entries) if e is not None]
+    entries = [en for en in entries if en[0] is not None]
+    fresh = [k for k, (_, new) in enumerate(entries) if new]
+    if fresh:  # one vectorised DCT over every new thumbnail
+        hashes = phash(np.stack([entries[k][0].pop("thumb") for k in fresh]))
+        for k, hs in zip(fresh, hashes):
+            entries[k][0]["hashes"] = [f"{int(h):016x}" for h in hs]
+    for (path, _, _), (e, _) in zip(items, entries):
+        index.entries[str(Path(path).resolve())] = e
+    groups.hashed = len(fresh)
+
+    paths = [it[0] for it in items]
+    hashes = np.array([[int(h, 16) for h in e["hashes"]] for e, _ in entries], dtype=np.uint64).reshape(-1, 8)
+    colours = np.array([e["colour"] for e, _ in entries], dtype=np.float32).reshape(-1, 3)
+    colours -= colours.mean(axis=1, keepdims=True)
+    for path, (e, _) in zip(paths, entries):
+        groups.shapes[path] = tuple(e["shape"])
+    bands = np.array_split(np.arange(64), min(threshold + 1, 64))
+    band_keys = [((hashes >> np.uint64(64 - b[-1] - 1)) & np.uint64((1 << len(b)) - 1)) for b in bands]
+    buckets = [{} for _ in bands]  # band key -> [8 * representative + variant]
+    for n, path in enumerate(paths):
+        cand = set()
+        for b, keys in enumerate(band_keys):
+            cand.update(buckets[b].get(int(keys[n, 0]), ()))
+        best = None
+        if cand:
+            cand = np.array(sorted(cand), dtype=np.int64)
+            reps, t = cand // 8, cand % 8
+            dist = popcount(hashes[reps, t] ^ hashes[n, 0]).astype(np.int64)
+            close = (dist <= threshold) & (np.abs(colours[reps] - colours[n]).max(axis=1) <= MAX_COLOUR_DIFF)
+            if close.any():
+                k = np.flatnonzero(close)[np.argmin(dist[close])]
+                best = (paths[reps[k]], int(dist[k]))
+                groups.transform[path] = int(t[k])
+        if best is None:
+            for b, keys in enumerate(band_keys):
+                for t in range(8):
+                    buckets[b].setdefault(int(keys[n, t]), []).append(8 * n + t)
+        else:
+            groups.dup_of[path] = best
+            groups.dups_of.setdefault(best[0], []).append((path, best[1]))
+    return groups
+
+def _transform_mask(mask, t, size, scale):
+    """A stored mask of a (w, h) = ``size`` image, flipped or rotated by DIHEDRAL[t] and scaled by (sx, sy)."""
+    if "rle" in mask:  # on the mask grid, which rescales on decoding
+        if not t:
+            return mask
+        from MaskCodec import decode_rle, encode_rle
+        grid = np.ascontiguousarray(transform_array(decode_rle(mask["rle"], tuple(mask["size"])), t))
+        return {"rle": encode_rle(grid[None])[0], "size": list(grid.shape)}
+    sx, sy = scale
+    rings = []
+    for ring in mask["poly"]:  # polygons are in image pixels
+        x, y, _ = transform_points(np.asarray(ring[0::2]), np.asarray(ring[1::2]), size, t)
+        rings.append(np.round(np.stack([x * sx, y * sy], axis=1), 1).ravel().tolist())
+    return {"poly": rings}
+
+def duplicate_record(rec, path, dist, shape, t=0):
+    """analyze_masks record of duplicate ``path`` built from its representative's record, flipped or rotated by DIHEDRAL[t]."""
+    h, w = shape
+    scale = (h * w) / float(rec["height"] * rec["width"])
+    kept = [{**s, "area_pixels": int(round(s["area_pixels"] * scale))} for s in rec["segments_kept"]]
+    _, _, (tw, th) = transform_points(0, 0, (rec["width"], rec["height"]), t)
+    for s in kept:
+        if "mask" in s:
+            s["mask"] = _transform_mask(s["mask"], t, (rec["width"], rec["height"]), (w / float(tw), h / float(th)))
+    dedup = {"source": rec["image"], "hamming": dist}
+    if t:
+        dedup["transform"] = DIHEDRAL[t]
+    return {**rec, "image": path, "height": h, "width": w, "segments_kept": kept, "dedup": dedup}
+
+def with_duplicates(records, groups):
+    """Yield every record, each followed by copies for its duplicates."""
+    for rec in records:
+        yield rec
+        for path, dist in groups.dups_of.get(rec["image"], ()):
+            yield duplicate_record(rec, path, dist, groups.shapes[path], groups.transform.get(path, 0))
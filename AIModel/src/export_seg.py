@@ -0,0 +1,149 @@
+import argparse, json, sys, time
+from pathlib import Path
+import numpy as np
+
+# Backend -> (ultralytics export format, int8). "torch" runs the .pt file as is.
+BACKENDS = {"torch": None, "onnx": ("onnx", False), "openvino": ("openvino", False), "openvino-int8": ("openvino", True)}
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
+
+def exported_path(weights, backend):
+    """Where ultralytics puts the export of ``weights`` for ``backend`` (next to the .pt file)."""
+    w = Path(weights)
+    if backend == "torch":
+        return w
+    if backend == "onnx":
+        return w.with_suffix(".onnx")
+    return w.parent / f"{w.stem}{'_int8' if BACKENDS[backend][1] else ''}_openvino_model"
+
+def export_weights(weights, backend, imgsz, data=None, fraction=1.0):
+    """Export ``weights`` for ``backend``; INT8 is calibrated on the val split of ``data``."""
+    from ultralytics import YOLO
+    fmt, int8 = BACKENDS[backend]
+    if int8 and not data:
+        raise ValueError(f"{backend} needs --data: INT8 calibration runs on the dataset's val split")
+    out = YOLO(str(weights)).export(format=fmt, imgsz=imgsz, dynamic=not int8, int8=int8,
+                                    data=str(data) if int8 else None, fraction=fraction)
+    return Path(out)
+
+def load_model(weights, backend="torch"):
+    """YOLO model for ``backend``; the exported files must already sit next to ``weights``."""
+    from ultralytics import YOLO
+    path = exported_path(weights, backend)
+    if not path.exists():
+        print(f"No {backend} export of {weights} (expected {path}). Run: python .\\src\\export_seg.py --weights {weights} --backend {backend}")
+        sys.exit(2)
+    return YOLO(str(path), task="segment")
+
+def val_images(data):
+    from ultralytics.data.utils import check_det_dataset
+    val = check_det_dataset(str(data))["val"]
+    paths = []
+    for v in val if isinstance(val, list) else [val]:
+        p = Path(v)
+        paths += sorted(str(q) for q in p.rglob("*") if q.suffix.lower() in IMG_EXTS) if p.is_dir() else [str(p)]
+    return paths
+
+def run_backend(model, images, args):
+    """Per-image records and images/sec (decode excluded) for one backend."""
+    from analyze_masks import analyze_results
+    names = model.names
+    model(images[:1], conf=args.conf, imgsz=args.imgsz, verbose=False)  # warm-up
+    records = []
+    t0 = time.perf_counter()
+    for start in range(0, len(images), args.batch):
+        results = model(images[start:start + args.batch], conf=args.conf, stream=True, imgsz=args.imgsz, verbose=False)
+        records += analyze_results(results, names, args.conf, args.min_area_frac)
+    elapsed = time.perf_counter() - t0
+    return records, len(images) / elapsed if elapsed > 0 else 0.0
+
+def agreement(ref, other):
+    """Mask area agreement of ``other`` with the reference records, in percentage points of image area."""
+    deltas = {}
+    counts = []
+    for a, b in zip(ref, other):
+        for c in set(a["coverage"]) | set(b["coverage"]):
+            deltas.setdefault(c, []).append(abs(a["coverage"].get(c, 0.0) - b["coverage"].get(c, 0.0)) * 100.0)
+        counts.append(len(b["segments_kept"]) - len(a["segments_kept"]))
+    every = np.concatenate([np.array(v) for v in deltas.values()]) if deltas else np.zeros(1)
+    return {
+        "mean_abs_delta_pp": float(every.mean()),
+        "p95_abs_delta_pp": float(np.percentile(every, 95)),
+        "max_abs_delta_pp": float(every.max()),
+        "mean_segment_count_delta": float(np.mean(counts)) if counts else 0.0,
+        "per_class_mean_abs_delta_pp": {c: float(np.mean(v)) for c, v in sorted(deltas.items())},
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Export trained weights for CPU runtimes and check them against PyTorch.")
+    ap.add_argument("--weights", required=True, help="Trained .pt file (e.g. runs/<run>/weights/best.pt)")
+    ap.add_argument("--backend", nargs="+", choices=[b for b in BACKENDS if b != "torch"], default=["openvino"])
+    ap.add_argument("--imgsz", type=int, default=640, help="Input size; INT8 exports are fixed to it")
+    ap.add_argument("--data", default=None, help="Dataset YAML; INT8 calibration uses its val split")
+    ap.add_argument("--fraction", type=float, default=1.0, help="Share of the val split used for INT8 calibration")
+    ap.add_argument("--skip-export", action="store_true", help="Only compare existing exports")
+    ap.add_argument("--compare", action="store_true", help="Compare mask areas and throughput against the .pt model")
+    ap.add_argument("--source", default=None, help="Images for --compare (default: the val split of --data)")
+    ap.add_argument("--max-images", type=int, default=200)
+    ap.add_argument("--conf", type=float, default=0.5)
+    ap.add_argument("--min-area-frac", type=float, default=0.0)
+    ap.add_argument("--batch", type=int, default=1)
+    ap.add_argument("--max-delta", type=float, default=1.0,
+                    help="Fail when a backend's mean absolute coverage delta exceeds this many percentage points")
+    ap.add_argument("--out", default=None, help="Write the comparison as JSON")
+    args = ap.parse_args()
+
+    if not Path(args.weights).is_file():
+        print(f"Weights not found: {args.weights}")
+        sys.exit(2)
+    if not args.skip_export:
+        for backend in args.backend:
+            try:
+                path = export_weights(args.weights, backend, args.imgsz, args.data, args.fraction)
+            except ValueError as e:
+                print(e)
+                sys.exit(2)
+            print(f"Exported {backend}: {path}")
+    if not args.compare:
+        return
+
+    from infer_seg import expand_sources
+    from ultralytics.utils.patches import imread
+    if args.source:
+        files = expand_sources([args.source])
+    elif args.data:
+        files = val_images(args.data)
+    else:
+        print("--compare needs --source or --data")
+        sys.exit(2)
+    files = files[:args.max_images]
+    if not files:
+        print("No images to compare on")
+        sys.exit(2)
+    images = [imread(f) for f in files]
+    print(f"Comparing on {len(images)} image(s) at imgsz={args.imgsz}, conf={args.conf}")
+
+    ref, ref_ips = run_backend(load_model(args.weights), images, args)
+    report = {"images": len(images), "imgsz": args.imgsz, "conf": args.conf,
+              "backends": {"torch": {"images_per_second": ref_ips}}}
+    failed = []
+    print("| Backend | Images/s | Speedup | Mean abs Δ (pp) | p95 abs Δ (pp) | Max abs Δ (pp) | Δ segments/image |\n|---|---:|---:|---:|---:|---:|---:|")
+    print(f"| torch | {ref_ips:.1f} | 1.00x | - | - | - | - |")
+    for backend in args.backend:
+        recs, ips = run_backend(load_model(args.weights, backend), images, args)
+        agree = agreement(ref, recs)
+        report["backends"][backend] = {"images_per_second": ips, "speedup": ips / ref_ips if ref_ips else 0.0, **agree}
+        print(f"| {backend} | {ips:.1f} | {ips / ref_ips if ref_ips else 0.0:.2f}x | {agree['mean_abs_delta_pp']:.3f} | "
+              f"{agree['p95_abs_delta_pp']:.3f} | {agree['max_abs_delta_pp']:.3f} | {agree['mean_segment_count_delta']:+.2f} |")
+        if agree["mean_abs_delta_pp"] > args.max_delta:
+            failed.append(backend)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Comparison saved: {args.out}")
+    if failed:
+        print(f"Mean coverage delta above {args.max_delta} pp for: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"All backends within {args.max_delta} pp of PyTorch")
+
+if __name__ == "__main__":
+    main()
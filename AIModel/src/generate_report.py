@@ -1,7 +1,11 @@
-import argparse, json, csv, datetime, io, base64
-from collections import defaultdict, Counter
+import argparse, json, csv, datetime, io, base64, itertools, sys, time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import matplotlib.pyplot as plt
+import numpy as np
+from result_store import ResultStore, is_store
+from report_aggregate import STATE_FILE, load_state_aggregate, update_aggregate
+from coverage_stats import QUANTILES, hist_labels
 
 def make_bar_chart(class_names, percents, title="Coverage Summary", ylabel="Mean area (%)"):
     fig, ax = plt.subplots(figsize=(8, 4.5))
@@ -18,55 +22,147 @@ def make_bar_chart(class_names, percents, title="Coverage Summary", ylabel="Mean
     buf.seek(0)
     return "data:image/png;base64," + base64.b64encode(buf.read()).decode("utf-8")
 
+def make_histogram_chart(hists, labels, title="Coverage Distribution", ylabel="Images (%)"):
+    fig, ax = plt.subplots(figsize=(8, 4.5))
+    for c, h in hists.items():
+        total = sum(h) or 1
+        ax.plot(labels, [100.0 * n / total for n in h], marker="o", label=c)
+    ax.set_ylabel(ylabel)
+    ax.set_xlabel("Area per image")
+    ax.set_title(title)
+    ax.grid(axis="y", linestyle="--", alpha=0.4)
+    ax.legend(fontsize=8)
+    plt.xticks(rotation=30, ha="right")
+    buf = io.BytesIO()
+    plt.tight_layout()
+    fig.savefig(buf, format="png", dpi=150)
+    plt.close(fig)
+    buf.seek(0)
+    return "data:image/png;base64," + base64.b64encode(buf.read()).decode("utf-8")
+
+def iter_records(indir):
+    if is_store(indir):
+        yield from ResultStore(indir).records()
+        return
+    for jf in sorted(indir.glob("*.json")):
+        with open(jf, "r", encoding="utf-8") as f:
+            yield json.load(f)
+
+def write_rasters(indir, raster_dir, workers=None):
+    """Full-resolution coverage map per image from the masks stored by analyze_masks --store-masks.
+
+    Writes <stem>.png (palette PNG, 0 = nothing kept, 1 + class_id elsewhere) and returns rows
+    of (image, class, covered pixels, fraction) measured on those maps.
+    """
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "CreatingImages"))
+    from PIL import Image
+    from MaskCodec import label_raster, palette
+    raster_dir.mkdir(parents=True, exist_ok=True)
+    pal = palette().ravel().tolist()
+
+    def one(rec):
+        labels = label_raster(rec)
+        im = Image.fromarray(labels, mode="P")
+        im.putpalette(pal)
+        im.save(raster_dir / f"{Path(rec['image']).stem}.png")
+        counts = np.bincount(labels.ravel(), minlength=256)
+        names = {seg["class_id"]: seg["class_name"] for seg in rec["segments_kept"]}
+        return [(rec["image"], names[c], int(counts[c + 1]), counts[c + 1] / labels.size) for c in sorted(names) if counts[c + 1]]
+
+    out = []
+    records = iter_records(indir)
+    with ThreadPoolExecutor(max_workers=workers) as pool:  # decoding and PNG compression release the GIL
+        while chunk := list(itertools.islice(records, 256)):
+            out += [row for rows in pool.map(one, chunk) for row in rows]
+    return out
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--indir", required=True)
+    ap.add_argument("--indir", required=True, help="Analyzer json/ folder or result store/ folder")
     ap.add_argument("--model-name", default="YOLOv8-seg (best.pt)")
     ap.add_argument("--metrics", default=None, help="Optional path to results.json with YOLO metrics")
+    ap.add_argument("--workers", type=int, default=None, help="Processes parsing JSON files (default: all cores)")
+    ap.add_argument("--state", default=None, help=f"Saved aggregate, so later runs only read new results (default: <indir>/../{STATE_FILE})")
+    ap.add_argument("--rebuild", action="store_true", help="Ignore the saved aggregate and read every result again")
+    ap.add_argument("--region-pattern", default=None,
+                    help="Regex whose first group names an image's region (default: the image's parent folder)")
+    ap.add_argument("--merge-state", nargs="+", default=[],
+                    help="report_state.json files of other runs (over other images) to fold into this report")
+    ap.add_argument("--rasters", default=None, metavar="DIR",
+                    help="Also write a full-resolution coverage map per image here, from masks stored with analyze_masks --store-masks")
     args = ap.parse_args()
 
     indir = Path(args.indir)
     if not indir.exists():
-        print(f"JSON folder not found: {indir}")
+        print(f"JSON folder or result store not found: {indir}")
         return
 
-    json_files = sorted(indir.glob("*.json"))
-    if not json_files:
+    if not is_store(indir) and not any(indir.glob("*.json")):
         print("No JSON files found")
         return
+    t0 = time.perf_counter()
+    agg, processed = update_aggregate(indir, args.state, workers=args.workers, rebuild=args.rebuild,
+                                      region_pattern=args.region_pattern)
+    print(f"Aggregated {processed} new image(s) in {time.perf_counter() - t0:.2f}s ({agg.images} total)")
+    for sp in args.merge_state:
+        other = load_state_aggregate(sp)
+        agg.merge(other)
+        print(f"Merged {other.images} image(s) from {sp}")
+    nimg = agg.images
+    if not nimg:
+        print("No images in result store")
+        return
 
-    per_image = []
-    class_set = set()
-    counts = Counter()
-    for jf in json_files:
-        with open(jf, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        h, w = data["height"], data["width"]
-        img_area = float(h * w)
-        d = defaultdict(float)
-        for seg in data.get("segments_kept", []):
-            cname = seg.get("class_name", str(seg.get("class_id", "?")))
-            d[cname] += float(seg["area_pixels"]) / img_area
-            class_set.add(cname)
-            counts[cname] += 1
-        per_image.append(d)
-
-    class_list = sorted(class_set)
-    nimg = len(per_image)
-    mean_fracs = {}
-    for c in class_list:
-        s = sum(d.get(c, 0.0) for d in per_image)
-        mean_fracs[c] = (s / nimg) * 100.0
+    mean_fracs = {c: agg.mean(c) * 100.0 for c in sorted(agg.classes)}
     mean_fracs = dict(sorted(mean_fracs.items(), key=lambda kv: kv[1], reverse=True))
+    std_fracs = {c: agg.std(c) * 100.0 for c in mean_fracs}
+    counts = {c: agg.instances(c) for c in mean_fracs}
+    # Per-image area % at each of QUANTILES, from the sketches (about 1% relative error).
+    pct = {c: [agg.quantile(c, q) * 100.0 for q in QUANTILES] for c in mean_fracs}
+    pct_names = [f"p{round(q * 100)}" for q in QUANTILES]
+    hists = {c: agg.histogram(c) for c in mean_fracs}
+    bin_labels = hist_labels()
+    regions = sorted(agg.regions)
 
     # === Save CSV ===
     outdir = indir.parent
     csv_path = outdir / "coverage_summary.csv"
     with open(csv_path, "w", newline="", encoding="utf-8") as f:
         w = csv.writer(f)
-        w.writerow(["class", "mean_area_percent", "instances"])
+        w.writerow(["class", "mean_area_percent", "instances", "std_area_percent"] + [f"{n}_area_percent" for n in pct_names])
         for c, v in mean_fracs.items():
-            w.writerow([c, f"{v:.2f}", counts[c]])
+            w.writerow([c, f"{v:.2f}", counts[c], f"{std_fracs[c]:.2f}"] + [f"{x:.2f}" for x in pct[c]])
+    hist_csv_path = outdir / "coverage_histogram.csv"
+    with open(hist_csv_path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["class"] + bin_labels)
+        for c in mean_fracs:
+            w.writerow([c] + hists[c])
+    region_csv_path = outdir / "coverage_by_region.csv"
+    with open(region_csv_path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["region", "images", "class", "mean_area_percent", "instances"])
+        for r in regions:
+            ra = agg.regions[r]
+            for c in mean_fracs:
+                if c in ra.classes:
+                    w.writerow([r, ra.images, c, f"{ra.mean(c) * 100.0:.2f}", ra.instances(c)])
+
+    raster_csv_path = None
+    if args.rasters:
+        t0 = time.perf_counter()
+        try:
+            rows = write_rasters(indir, Path(args.rasters), args.workers)
+        except ValueError as e:
+            print(f"Skipped coverage rasters: {e}")
+        else:
+            raster_csv_path = outdir / "coverage_rasters.csv"
+            with open(raster_csv_path, "w", newline="", encoding="utf-8") as f:
+                w = csv.writer(f)
+                w.writerow(["image", "class", "covered_pixels", "area_percent"])
+                for image, c, px, frac in rows:
+                    w.writerow([image, c, px, f"{frac * 100.0:.4f}"])
+            print(f"Coverage rasters saved: {args.rasters} ({time.perf_counter() - t0:.2f}s)")
 
     # === Load YOLO metrics if available ===
     metrics_data = None
@@ -85,9 +181,25 @@ def main():
         f.write("- Filters: confidence and min_area_frac applied in analysis\n\n")
 
         f.write("## Coverage Summary (mean area % per class)\n\n")
-        f.write("| Class | Mean area | Instances |\n|---|---:|---:|\n")
+        f.write("| Class | Mean area | Std dev | Instances |\n|---|---:|---:|---:|\n")
         for c, v in mean_fracs.items():
-            f.write(f"| {c} | {v:.2f}% | {counts[c]} |\n")
+            f.write(f"| {c} | {v:.2f}% | {std_fracs[c]:.2f}% | {counts[c]} |\n")
+
+        f.write("\n## Coverage Distribution (area % per image)\n\n")
+        f.write("| Class | " + " | ".join(pct_names) + " |\n|---|" + "---:|" * len(pct_names) + "\n")
+        for c in mean_fracs:
+            f.write(f"| {c} | " + " | ".join(f"{x:.2f}%" for x in pct[c]) + " |\n")
+        f.write("\n| Class | " + " | ".join(bin_labels) + " |\n|---|" + "---:|" * len(bin_labels) + "\n")
+        for c in mean_fracs:
+            f.write(f"| {c} | " + " | ".join(str(n) for n in hists[c]) + " |\n")
+
+        if regions:
+            f.write("\n## Coverage by Region (mean area % per class)\n\n")
+            f.write("| Region | Images | " + " | ".join(mean_fracs) + " |\n|---|---:|" + "---:|" * len(mean_fracs) + "\n")
+            for r in regions:
+                ra = agg.regions[r]
+                cells = [f"{ra.mean(c) * 100.0:.2f}%" if c in ra.classes else "-" for c in mean_fracs]
+                f.write(f"| {r} | {ra.images} | " + " | ".join(cells) + " |\n")
 
         if metrics_data:
             f.write("\n## YOLO Metrics (validation set)\n\n")
@@ -131,13 +243,30 @@ h2 {{ margin-top: 28px; }}
 <div class="chart"><img src="{chart_uri}" alt="Coverage Summary"></div>
 <h2>Coverage Summary</h2>
 <table>
-<thead><tr><th>Class</th><th class="num">Mean area (%)</th><th class="num">Instances</th></tr></thead>
+<thead><tr><th>Class</th><th class="num">Mean area (%)</th><th class="num">Std dev (%)</th><th class="num">Instances</th></tr></thead>
 <tbody>
 """
     for c, v in mean_fracs.items():
-        html += f"<tr><td>{c}</td><td class=\"num\">{v:.2f}</td><td class=\"num\">{counts[c]}</td></tr>\n"
+        html += f"<tr><td>{c}</td><td class=\"num\">{v:.2f}</td><td class=\"num\">{std_fracs[c]:.2f}</td><td class=\"num\">{counts[c]}</td></tr>\n"
     html += "</tbody></table>"
 
+    html += "<h2>Coverage Distribution</h2>"
+    html += f"<div class=\"chart\"><img src=\"{make_histogram_chart(hists, bin_labels)}\" alt=\"Coverage Distribution\"></div>"
+    html += "<table><thead><tr><th>Class</th>" + "".join(f"<th class='num'>{n} (%)</th>" for n in pct_names) + "</tr></thead><tbody>"
+    for c in mean_fracs:
+        html += f"<tr><td>{c}</td>" + "".join(f"<td class='num'>{x:.2f}</td>" for x in pct[c]) + "</tr>\n"
+    html += "</tbody></table>"
+
+    if regions:
+        html += "<h2>Coverage by Region (mean area %)</h2><table><thead><tr><th>Region</th><th class='num'>Images</th>"
+        html += "".join(f"<th class='num'>{c}</th>" for c in mean_fracs) + "</tr></thead><tbody>"
+        for r in regions:
+            ra = agg.regions[r]
+            html += f"<tr><td>{r}</td><td class='num'>{ra.images}</td>"
+            html += "".join(f"<td class='num'>{ra.mean(c) * 100.0:.2f}</td>" if c in ra.classes else "<td class='num'>-</td>" for c in mean_fracs)
+            html += "</tr>\n"
+        html += "</tbody></table>"
+
     if metrics_data:
         html += "<h2>YOLO Metrics (validation set)</h2><table><thead><tr>"
         html += "<th>Class</th><th class='num'>Box(P)</th><th class='num'>Box(R)</th><th class='num'>Box mAP50</th>"
@@ -161,7 +290,7 @@ h2 {{ margin-top: 28px; }}
         f.write(html)
 
     print(f"Report saved: {md_path}")
-    print(f"CSV saved: {csv_path}")
+    print(f"CSV saved: {csv_path}, {hist_csv_path.name}, {region_csv_path.name}" + (f", {raster_csv_path.name}" if raster_csv_path else ""))
     print(f"HTML saved: {html_path}")
 
 if __name__ == "__main__":
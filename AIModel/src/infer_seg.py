@@ -1,56 +1,311 @@
-import argparse, time
+import argparse, os, sys, time
+import cv2
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from ultralytics import YOLO
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "CreatingImages"))
+from PatchPack import PACK_EXT, PatchPack
+from instrument import recorder
+from export_seg import BACKENDS, load_model
 
 IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
+PACK_CHUNK = 32
 
-def expand_sources(srcs):
+def expand_sources(srcs, packs=None):
+    """Image paths under the given files/folders/.txt lists; packed containers go to ``packs`` if given."""
     paths = []
     for s in srcs:
         p = Path(s)
-        if p.is_dir():
+        if p.suffix.lower() == ".txt" and p.is_file():
+            paths += expand_sources(read_list(p), packs)
+        elif p.is_dir():
             for q in sorted(p.rglob("*")):
                 if q.suffix.lower() in IMG_EXTS:
                     paths.append(str(q))
+                elif packs is not None and q.suffix.lower() == PACK_EXT:
+                    packs.append(str(q))
+        elif p.exists() and p.suffix.lower() == PACK_EXT:
+            if packs is not None:
+                packs.append(str(p))
         elif p.exists():
             paths.append(str(p))
     return paths
 
-def main():
+def read_list(path):
+    # One path per line, relative ones against the list's folder (as ultralytics reads .txt sources).
+    lines = [l.strip() for l in Path(path).read_text(encoding="utf-8").splitlines() if l.strip()]
+    return [str(Path(path).parent / l) for l in lines]
+
+def find_packs(source):
+    # Cheap check for analyze_masks, which hands folders to ultralytics instead of expanding them.
+    p = Path(source)
+    if p.suffix.lower() == ".txt" and p.is_file():
+        return [q for q in read_list(p) if Path(q).suffix.lower() == PACK_EXT]
+    if p.suffix.lower() == PACK_EXT and p.is_file():
+        return [str(p)]
+    return sorted(str(q) for q in p.glob(f"*{PACK_EXT}")) if p.is_dir() else []
+
+def iter_pack_chunks(pack_path, chunk=PACK_CHUNK):
+    """Yield lists of (virtual_path, image) from a container, ``chunk`` tiles at a time.
+
+    The virtual path is ``<pack>/<patch name>`` so JSON and overlay names match loose patches.
+    """
+    with PatchPack(pack_path) as pack:
+        for start in range(0, len(pack), chunk):
+            yield [(str(Path(pack_path) / pack.name(i)), pack.open(i).convert("RGB"))
+                   for i in range(start, min(start + chunk, len(pack)))]
+
+def overlay_path(out, src):
+    # Same name ultralytics' save=True used: loose images become <stem>.jpg.
+    return out / f"{Path(src).stem}.jpg"
+
+def pack_tiles_done(pack_path, out):
+    """(tiles of the pack, tiles whose overlay already exists under <out>/<pack stem>)."""
+    pack_out = out / Path(pack_path).stem
+    with PatchPack(pack_path) as pack:
+        names = [pack.name(i) for i in range(len(pack))]
+    return len(names), sum((pack_out / n).exists() for n in names) if pack_out.is_dir() else 0
+
+class OverlayWriter:
+    """Render and save overlays on a thread pool while the model keeps running.
+
+    At most ``depth`` results wait for a writer; ``submit`` blocks past that, so
+    memory stays flat however many images go through. Files are written under a
+    temporary name and renamed, so a half-written overlay never counts as done.
+    """
+
+    def __init__(self, workers=2, depth=8):
+        self.pool = ThreadPoolExecutor(max_workers=max(workers, 1))
+        self.depth = max(depth, 1)
+        self.pending = deque()
+
+    def submit(self, result, filename):
+        while len(self.pending) >= self.depth:
+            self.pending.popleft().result()
+        recorder.gauge("writer_queue", len(self.pending))
+        self.pending.append(self.pool.submit(recorder.timed_call, "save", self._save, result, Path(filename)))
+
+    @staticmethod
+    def _save(result, filename):
+        tmp = filename.with_name(f"{filename.stem}.partial{filename.suffix}")
+        result.save(filename=str(tmp))
+        os.replace(tmp, filename)
+
+    def close(self):
+        while self.pending:
+            self.pending.popleft().result()
+        self.pool.shutdown()
+
+def dedup_overlay_path(out, path, groups):
+    if path in groups.where:
+        pack_out = out / Path(groups.where[path][0]).stem
+        pack_out.mkdir(parents=True, exist_ok=True)
+        return pack_out / Path(path).name
+    return overlay_path(out, path)
+
+def iter_duplicates(r, src, out, groups, opened):
+    """``r``'s predictions drawn on each near-duplicate of ``src`` (--dedup); only the overlay image is decoded."""
+    import torch
+    from ultralytics.engine.results import Results
+    from dedup import DIHEDRAL, transform_points
+    for path, dist in groups.dups_of.get(src, ()) if groups else ():
+        with recorder.stage("decode"):
+            if path in groups.where:
+                pack_path, i = groups.where[path]
+                if pack_path not in opened:
+                    opened[pack_path] = PatchPack(pack_path)
+                img = cv2.imdecode(np.frombuffer(opened[pack_path].read_bytes(i), np.uint8), cv2.IMREAD_COLOR)
+            else:
+                img = cv2.imread(path, cv2.IMREAD_COLOR)
+        t = groups.transform.get(path, 0)
+        boxes = masks = None
+        if r.boxes is not None:
+            boxes = r.boxes.data.clone()
+            size = (r.orig_shape[1], r.orig_shape[0])
+            x0, y0, _ = transform_points(boxes[:, 0], boxes[:, 1], size, t)
+            x1, y1, (tw, _) = transform_points(boxes[:, 2], boxes[:, 3], size, t)
+            boxes[:, :4] = torch.stack([torch.minimum(x0, x1), torch.minimum(y0, y1), torch.maximum(x0, x1), torch.maximum(y0, y1)], 1)
+            boxes[:, :4] *= img.shape[1] / tw  # same aspect ratio, so the mask grid still lines up
+        if r.masks is not None:
+            masks = r.masks.data
+            if t & 4:
+                masks = masks.transpose(-1, -2)
+            if t & 2:
+                masks = masks.flip(-2)
+            if t & 1:
+                masks = masks.flip(-1)
+        d = Results(orig_img=img, path=path, names=r.names, boxes=boxes, masks=masks, speed={})
+        d.dedup = {"source": src, "hamming": dist}
+        how = f", {DIHEDRAL[t]}" if t else ""
+        yield d, dedup_overlay_path(out, path, groups), f"{Path(path).name} (duplicate of {Path(src).name}, hamming {dist}{how})"
+
+def iter_predictions(model, src_list, packs, out, args, groups=None):
+    """Yield (result, overlay path, display name); with --resume, pack tiles whose overlay exists come back with result None."""
+    opened = {}
+    # ultralytics opens every image of a list source up front, so hand it bounded chunks and stream each.
+    for start in range(0, len(src_list), PACK_CHUNK):
+        results = model.predict(source=src_list[start:start + PACK_CHUNK], conf=args.conf, imgsz=args.imgsz,
+                                device=args.device, stream=True, verbose=False)
+        for r in recorder.timed_iter(results, "model"):
+            yield r, overlay_path(out, r.path), Path(r.path).name
+            yield from iter_duplicates(r, r.path, out, groups, opened)
+    for pack_path in packs:
+        pack_out = out / Path(pack_path).stem
+        pack_out.mkdir(parents=True, exist_ok=True)
+        for chunk in recorder.timed_iter(iter_pack_chunks(pack_path), "decode"):
+            if args.resume:
+                for vpath, _ in chunk:
+                    if (pack_out / Path(vpath).name).exists():
+                        yield None, pack_out / Path(vpath).name, Path(vpath).name
+                chunk = [c for c in chunk if not (pack_out / Path(c[0]).name).exists()]
+            if groups:
+                chunk = [c for c in chunk if c[0] not in groups.dup_of]
+            if not chunk:
+                continue
+            results = model.predict(source=[im for _, im in chunk], conf=args.conf, imgsz=args.imgsz,
+                                    device=args.device, stream=True, verbose=False)
+            for (vpath, _), r in zip(chunk, recorder.timed_iter(results, "model")):
+                yield r, pack_out / Path(vpath).name, Path(vpath).name
+                yield from iter_duplicates(r, vpath, out, groups, opened)
+    for pack in opened.values():
+        pack.close()
+
+def build_parser():
     ap = argparse.ArgumentParser()
     ap.add_argument("--weights", required=True)
+    ap.add_argument("--backend", choices=list(BACKENDS), default="torch",
+                    help="Run the .pt file (torch) or its export made by export_seg.py")
     ap.add_argument("--source", nargs="+", required=True)
     ap.add_argument("--conf", type=float, default=0.5)
     ap.add_argument("--imgsz", type=int, default=1280)
     ap.add_argument("--device", default="")
     ap.add_argument("--project", default="runs_local")
     ap.add_argument("--name", default=None)
-    args = ap.parse_args()
+    ap.add_argument("--writers", type=int, default=2, help="Threads rendering and saving overlays")
+    ap.add_argument("--queue", type=int, default=16, help="Results allowed to wait for a writer before inference pauses")
+    ap.add_argument("--resume", action="store_true", help="Skip images whose overlay already exists in <project>/<name>")
+    ap.add_argument("--metrics-dir", default=None,
+                    help="Record per-stage wall/CPU time; writes metrics.json and metrics.prom here")
+    ap.add_argument("--trace", action="store_true", help="With --metrics-dir, also write per-image trace events (trace.json)")
+    ap.add_argument("--dedup", action="store_true",
+                    help="Group near-identical images by perceptual hash and draw one prediction per group on all of them")
+    ap.add_argument("--dedup-threshold", type=int, default=10, help="Largest Hamming distance (of 64 bits) between grouped images")
+    ap.add_argument("--dedup-index", default="cache/phash_index.json", help="Persistent perceptual hash index, reused across runs")
+    ap.add_argument("--server", default=None, help="Submit the run to inference_server.py at this URL instead of loading the model here")
+    return ap
+
+def run(args, model=None, cancel=None, progress=None):
+    """One inference run; the inference server passes its warm ``model``, a ``cancel`` event and a ``progress(images)`` callback."""
+    with recorder.run_scope():  # metrics of this run only, even on a shared server thread
+        return _run(args, model, cancel, progress)
 
+def _run(args, model, cancel, progress):
+    if args.metrics_dir:
+        recorder.enable("infer_seg", trace=args.trace)
+    if args.resume and not args.name:
+        print("--resume needs the --name of the run to continue")
+        sys.exit(2)
     ts = time.strftime("%Y%m%d_%H%M%S")
     name = args.name or f"predict_{ts}"
-    src_list = expand_sources(args.source)
-    if not src_list:
+    out = Path(args.project) / name
+    packs = []
+    with recorder.stage("listing"):
+        src_list = expand_sources(args.source, packs)
+    if not src_list and not packs:
         print("No valid images found in --source")
-        return
-
-    print(f"Inference start: images={len(src_list)}, weights={args.weights}, conf={args.conf}")
-    model = YOLO(args.weights)
-    results = model.predict(
-        source=src_list,
-        conf=args.conf,
-        imgsz=args.imgsz,
-        device=args.device,
-        save=True,
-        project=args.project,
-        name=name,
-        verbose=False
-    )
-    for r in results:
-        masks = 0 if r.masks is None else r.masks.data.shape[0]
-        print(f"Image: {Path(r.path).name} masks={masks}")
-    out = Path(model.predictor.save_dir) if hasattr(model, "predictor") else Path(args.project) / name
+        return 0
+    skipped = 0
+    if args.resume:
+        todo = [s for s in src_list if not overlay_path(out, s).exists()]
+        skipped = len(src_list) - len(todo)
+        src_list = todo
+        # Packs without a tile left are dropped here; the rest skip their finished tiles as they stream.
+        left = []
+        for pack_path in packs:
+            total, finished = pack_tiles_done(pack_path, out)
+            if finished < total:
+                left.append(pack_path)
+            else:
+                skipped += finished
+        packs = left
+        if not src_list and not packs:
+            print(f"Nothing left to resume: all {skipped} image(s) already have an overlay in {out}")
+            return 0
+
+    groups = None
+    if args.dedup:
+        from dedup import DedupIndex, group_sources
+        dedup_index = DedupIndex(args.dedup_index)
+        resumed = set()
+        for pack_path in packs if args.resume else []:
+            pack_out = out / Path(pack_path).stem
+            resumed |= {str(Path(pack_path) / f.name) for f in pack_out.iterdir()} if pack_out.is_dir() else set()
+        with recorder.stage("dedup"):
+            groups = group_sources(src_list, packs, dedup_index, args.dedup_threshold, resumed)
+        dedup_index.save()
+        for path, (src, _) in list(groups.dup_of.items()):
+            (h, w), (sh, sw) = groups.shapes[path], groups.shapes[src]
+            if groups.transform.get(path, 0) & 4:  # transposed copies swap the representative's sides
+                sh, sw = sw, sh
+            if h * sw != sh * w:  # the source's mask grid only fits images of the same aspect ratio
+                groups.drop(path)
+        src_list = [s for s in src_list if s not in groups.dup_of]
+        print(f"Dedup: {len(groups)} near-duplicate(s) will reuse a prediction ({groups.hashed} image(s) hashed)")
+    print(f"Inference start: images={len(src_list)}, packs={len(packs)}, weights={args.weights} ({args.backend}), conf={args.conf}")
+    if model is None:
+        with recorder.stage("model_load"):
+            model = load_model(args.weights, args.backend)
+    out.mkdir(parents=True, exist_ok=True)
+    writer = OverlayWriter(args.writers, args.queue)
+    done = 0
+    reused = 0
+    model_ms = []
+    try:
+        for r, filename, shown in iter_predictions(model, src_list, packs, out, args, groups):
+            if cancel is not None and cancel.is_set():
+                print("Cancelled")
+                break
+            if r is None:
+                skipped += 1
+                continue
+            recorder.add_speed(r.speed)
+            if hasattr(r, "dedup"):
+                reused += 1
+            else:
+                model_ms.append(sum(v for v in r.speed.values() if v is not None))
+            writer.submit(r, filename)
+            recorder.count("images")
+            done += 1
+            masks = 0 if r.masks is None else r.masks.data.shape[0]
+            print(f"Image: {shown} masks={masks}")
+            if progress is not None:
+                progress(done)
+    finally:
+        with recorder.stage("writer_drain"):
+            writer.close()
+    if skipped:
+        print(f"Skipped {skipped} image(s) with an existing overlay")
+    if groups is not None:
+        saved = reused * (sum(model_ms) / len(model_ms) / 1000.0 if model_ms else 0.0)
+        dedup_index.saved["images"] += reused
+        dedup_index.saved["seconds"] += saved
+        dedup_index.save()
+        print(f"Dedup: {reused} overlay(s) drawn from a duplicate's prediction, ~{saved:.1f}s of model time saved "
+              f"(index total: {dedup_index.saved['images']} image(s), ~{dedup_index.saved['seconds']:.0f}s)")
+        recorder.count("dedup_reused", reused)
     print(f"Inference done. Output: {out}")
+    for path in recorder.write(args.metrics_dir) if args.metrics_dir else []:
+        print(f"Metrics: {path}")
+    return done
+
+def main():
+    args = build_parser().parse_args()
+    if args.server:
+        from inference_client import submit_and_wait
+        sys.exit(submit_and_wait(args.server, "infer", sys.argv[1:]))
+    run(args)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,97 @@
+import argparse, json, os, sys, time
+from urllib import error, request
+
+DEFAULT_URL = "http://127.0.0.1:8765"
+FINAL_STATES = {"done", "failed", "cancelled"}
+
+def call(url, path, body=None, timeout=30):
+    """(HTTP status, JSON reply) of a GET, or of a POST when ``body`` is given."""
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = request.Request(url.rstrip("/") + path, data=data, method="POST" if data is not None else "GET",
+                          headers={"Content-Type": "application/json"})
+    try:
+        with request.urlopen(req, timeout=timeout) as r:
+            return r.status, json.loads(r.read() or b"{}")
+    except error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"{}")
+
+def strip_server(argv):
+    out, skip = [], False
+    for a in argv:
+        if skip:
+            skip = False
+        elif a == "--server":
+            skip = True
+        elif not a.startswith("--server="):
+            out.append(a)
+    return out
+
+def submit_and_wait(url, task, argv, wait=True, poll=1.0):
+    """Submit one job and (with ``wait``) stream its log until it ends; returns a process exit code."""
+    try:
+        code, job = call(url, "/jobs", {"task": task, "args": strip_server(argv), "cwd": os.getcwd()})
+    except error.URLError as e:
+        print(f"Inference server not reachable at {url}: {e.reason}")
+        return 2
+    if code != 202:
+        print(f"Rejected: {job.get('error', code)}")
+        return 2
+    print(f"Submitted job {job['id']} to {url}")
+    if not wait:
+        return 0
+    since = 0
+    try:
+        while True:
+            _, log = call(url, f"/jobs/{job['id']}/log?since={since}")
+            for line in log.get("lines", []):
+                print(line)
+            since = log.get("next", since)
+            if log.get("state") in FINAL_STATES:
+                break
+            time.sleep(poll)
+    except KeyboardInterrupt:
+        call(url, f"/jobs/{job['id']}/cancel", {})
+        print(f"Cancelled job {job['id']}")
+        return 130
+    _, job = call(url, f"/jobs/{job['id']}")
+    print(f"Job {job['id']} {job['state']}" + (f": {job['error']}" if job.get("error") else ""))
+    return 0 if job["state"] == "done" else 1
+
+def main():
+    ap = argparse.ArgumentParser(description="Submit to and control inference_server.py.")
+    ap.add_argument("--url", default=DEFAULT_URL)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sp = sub.add_parser("submit", help="Run analyze_masks (analyze) or infer_seg (infer) arguments on the server")
+    sp.add_argument("--no-wait", action="store_true", help="Print the job id and return at once (put it before the task)")
+    sp.add_argument("task", choices=["analyze", "infer"])
+    sp.add_argument("args", nargs=argparse.REMAINDER, help="Script arguments, after --")
+    st = sub.add_parser("status", help="Server status, all jobs, or one job")
+    st.add_argument("job", nargs="?")
+    cp = sub.add_parser("cancel")
+    cp.add_argument("job")
+    sd = sub.add_parser("shutdown", help="Stop taking jobs, cancel queued ones and exit once running jobs finish")
+    sd.add_argument("--cancel-running", action="store_true")
+    args = ap.parse_args()
+
+    try:
+        if args.cmd == "submit":
+            argv = args.args[1:] if args.args[:1] == ["--"] else args.args
+            sys.exit(submit_and_wait(args.url, args.task, argv, wait=not args.no_wait))
+        if args.cmd == "status" and args.job:
+            code, reply = call(args.url, f"/jobs/{args.job}")
+        elif args.cmd == "status":
+            _, health = call(args.url, "/health")
+            code, reply = call(args.url, "/jobs")
+            reply = {**health, **reply}
+        elif args.cmd == "cancel":
+            code, reply = call(args.url, f"/jobs/{args.job}/cancel", {})
+        else:
+            code, reply = call(args.url, "/shutdown", {"cancel_running": args.cancel_running})
+    except error.URLError as e:
+        print(f"Inference server not reachable at {args.url}: {e.reason}")
+        sys.exit(2)
+    print(json.dumps(reply, indent=2))
+    sys.exit(0 if code < 400 else 1)
+
+if __name__ == "__main__":
+    main()
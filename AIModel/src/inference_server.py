@@ -0,0 +1,318 @@
+import argparse, io, json, queue, signal, sys, threading, time, traceback, uuid
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import analyze_masks, infer_seg
+from export_seg import exported_path, load_model
+
+TASKS = {"analyze": analyze_masks, "infer": infer_seg}
+# Job arguments naming files or folders; relative ones are resolved against the submitting client's cwd.
+PATH_ARGS = ("weights", "source", "outdir", "cache_dir", "metrics_dir", "project", "dedup_index")
+LOG_TAIL = 20
+
+class Job:
+    def __init__(self, task, argv, args, log_path):
+        self.id = uuid.uuid4().hex[:12]
+        self.task = task
+        self.argv = argv
+        self.args = args
+        self.state = "queued"
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.images = 0
+        self.error = None
+        self.cancel = threading.Event()
+        self.log_path = log_path
+        self.tail = deque(maxlen=LOG_TAIL)
+        self.log_f = None
+        self._partial = ""
+
+    def write(self, s):
+        if self.log_f is None:
+            self.log_f = open(self.log_path, "a", encoding="utf-8")
+        self.log_f.write(s)
+        lines = (self._partial + s).split("\n")
+        self._partial = lines.pop()
+        self.tail.extend(lines)
+
+    def close_log(self):
+        if self.log_f is not None:
+            self.log_f.close()
+            self.log_f = None
+
+    def to_dict(self, tail=False):
+        d = {"id": self.id, "task": self.task, "state": self.state, "argv": self.argv, "images": self.images,
+             "created": self.created, "started": self.started, "finished": self.finished, "error": self.error,
+             "log": str(self.log_path)}
+        if tail:
+            d["tail"] = list(self.tail)
+        return d
+
+class ThreadOutput(io.TextIOBase):
+    """sys.stdout stand-in: prints from a worker thread go to its job's log, everything else to the console."""
+
+    def __init__(self, console):
+        self.console = console
+        self.local = threading.local()
+
+    def write(self, s):
+        job = getattr(self.local, "job", None)
+        (job.write if job is not None else self.console.write)(s)
+        return len(s)
+
+    def flush(self):
+        job = getattr(self.local, "job", None)
+        if job is not None and job.log_f is not None:
+            job.log_f.flush()
+        self.console.flush()
+
+class InferenceServer:
+    def __init__(self, workers, max_queue, max_models, log_dir, keep_jobs):
+        self.workers = max(workers, 1)
+        self.queue = queue.Queue()
+        self.max_queue = max_queue
+        self.max_models = max(max_models, 1)
+        self.log_dir = Path(log_dir)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.keep_jobs = keep_jobs
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.accepting = True
+        self.models = {}  # worker slot -> OrderedDict of loaded models
+        self.output = ThreadOutput(sys.stdout)
+        self.threads = [threading.Thread(target=self.worker, args=(i,), name=f"worker-{i}", daemon=True)
+                        for i in range(self.workers)]
+
+    def start(self):
+        sys.stdout = self.output
+        for t in self.threads:
+            t.start()
+
+    def submit(self, task, argv, cwd):
+        if task not in TASKS:
+            raise ValueError(f"unknown task {task!r}; use one of {', '.join(TASKS)}")
+        args = parse_job_args(task, argv, cwd)
+        with self.lock:
+            if not self.accepting:
+                raise RuntimeError("server is shutting down")
+            if self.queue.qsize() >= self.max_queue:
+                raise RuntimeError(f"queue is full ({self.max_queue} jobs)")
+            job = Job(task, argv, args, None)
+            job.log_path = self.log_dir / f"{job.id}.log"
+            self.jobs[job.id] = job
+            self._forget_old()
+        print(f"[{time.strftime('%H:%M:%S')}] queued {job.id}: {task} {' '.join(argv)}")
+        self.queue.put(job)
+        return job
+
+    def _forget_old(self):
+        finished = [j for j in self.jobs.values() if j.finished is not None]
+        for j in finished[:max(len(finished) - self.keep_jobs, 0)]:
+            del self.jobs[j.id]
+
+    def cancel(self, job_id):
+        job = self.jobs[job_id]
+        job.cancel.set()
+        return job
+
+    def model_for(self, slot, args):
+        """Warm model of this worker for the job's weights/backend; reloaded when the file changes."""
+        path = exported_path(args.weights, args.backend)
+        key = (str(Path(path).resolve()), args.backend, path.stat().st_mtime_ns if path.exists() else None)
+        models = self.models.setdefault(slot, OrderedDict())
+        if key in models:
+            models.move_to_end(key)
+            return models[key]
+        print(f"Loading {args.weights} ({args.backend})")
+        model = load_model(args.weights, args.backend)
+        models[key] = model
+        while len(models) > self.max_models:
+            models.popitem(last=False)
+        return model
+
+    def worker(self, slot):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            if job.cancel.is_set():
+                job.state, job.finished = "cancelled", time.time()
+                continue
+            job.state, job.started = "running", time.time()
+            self.output.local.job = job
+            try:
+                model = self.model_for(slot, job.args)
+                TASKS[job.task].run(job.args, model=model, cancel=job.cancel,
+                                    progress=lambda n, job=job: setattr(job, "images", n))
+                job.state = "cancelled" if job.cancel.is_set() else "done"
+            except SystemExit as e:  # the scripts exit on bad input
+                job.state, job.error = "failed", f"exited with code {e.code}"
+            except Exception as e:
+                job.state, job.error = "failed", f"{type(e).__name__}: {e}"
+                traceback.print_exc(file=self.output)
+            finally:
+                self.output.local.job = None
+                job.finished = time.time()
+                job.close_log()
+            print(f"[{time.strftime('%H:%M:%S')}] {job.state} {job.id} ({job.images} image(s), {job.finished - job.started:.1f}s)")
+
+    def status(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return {"accepting": self.accepting, "workers": self.workers,
+                "queued": sum(j.state == "queued" for j in jobs), "running": [j.id for j in jobs if j.state == "running"],
+                "models": [f"{k[0]} ({k[1]})" for m in self.models.values() for k in m]}
+
+    def shutdown(self, cancel_running=False):
+        """Stop taking jobs, cancel the queued ones, let running jobs finish (or cancel them too) and stop the workers."""
+        with self.lock:
+            if not self.accepting:
+                return
+            self.accepting = False
+            jobs = list(self.jobs.values())
+        for j in jobs:
+            if j.state == "queued" or (cancel_running and j.state == "running"):
+                j.cancel.set()
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        sys.stdout = self.output.console
+        print("Workers stopped")
+
+def parse_job_args(task, argv, cwd):
+    ap = TASKS[task].build_parser()
+
+    def error(message):
+        raise ValueError(message)
+
+    ap.error = error
+    try:
+        args = ap.parse_args(argv)
+    except SystemExit:  # --help and friends
+        raise ValueError("invalid arguments")
+    if task == "analyze" and args.outdir is None:
+        args.outdir = f"reports/{time.strftime('%Y-%m-%d_%H-%M-%S')}"
+    for name in PATH_ARGS:
+        v = getattr(args, name, None)
+        if isinstance(v, list):
+            setattr(args, name, [str(Path(cwd) / p) for p in v])
+        elif v is not None:
+            setattr(args, name, str(Path(cwd) / v))
+    args.server = None
+    return args
+
+def make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, code, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def body(self):
+            n = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(n) or b"{}")
+
+        def job(self, job_id):
+            job = server.jobs.get(job_id)
+            if job is None:
+                self.reply(404, {"error": f"no job {job_id}"})
+            return job
+
+        def do_GET(self):
+            path, _, query = self.path.partition("?")
+            parts = [p for p in path.split("/") if p]
+            if parts == ["health"]:
+                self.reply(200, server.status())
+            elif parts == ["jobs"]:
+                self.reply(200, {"jobs": [j.to_dict() for j in list(server.jobs.values())]})
+            elif len(parts) == 2 and parts[0] == "jobs":
+                job = self.job(parts[1])
+                if job:
+                    self.reply(200, job.to_dict(tail=True))
+            elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "log":
+                job = self.job(parts[1])
+                if job:
+                    since = int(dict(q.split("=", 1) for q in query.split("&") if "=" in q).get("since", 0))
+                    lines = job.log_path.read_text(encoding="utf-8").splitlines() if job.log_path.exists() else []
+                    self.reply(200, {"state": job.state, "next": len(lines), "lines": lines[since:]})
+            else:
+                self.reply(404, {"error": f"unknown path {path}"})
+
+        def do_POST(self):
+            parts = [p for p in self.path.split("?")[0].split("/") if p]
+            try:
+                body = self.body()
+            except json.JSONDecodeError as e:
+                self.reply(400, {"error": f"bad JSON: {e}"})
+                return
+            if parts == ["jobs"]:
+                try:
+                    job = server.submit(body.get("task"), list(body.get("args", [])), body.get("cwd", "."))
+                except ValueError as e:
+                    self.reply(400, {"error": str(e)})
+                except RuntimeError as e:
+                    self.reply(503, {"error": str(e)})
+                else:
+                    self.reply(202, job.to_dict())
+            elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "cancel":
+                if self.job(parts[1]):
+                    self.reply(200, server.cancel(parts[1]).to_dict())
+            elif parts == ["shutdown"]:
+                self.reply(202, {"stopping": True})
+                threading.Thread(target=stop, args=(server, self.server, bool(body.get("cancel_running"))), daemon=True).start()
+            else:
+                self.reply(404, {"error": f"unknown path {self.path}"})
+
+        def log_message(self, fmt, *args):  # keep the console for job events
+            pass
+
+    return Handler
+
+def stop(server, httpd, cancel_running=False):
+    server.shutdown(cancel_running)
+    httpd.shutdown()
+
+def main():
+    ap = argparse.ArgumentParser(description="Keep models loaded and run analyze_masks / infer_seg jobs submitted over local HTTP.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--workers", type=int, default=1, help="Jobs running at the same time (each worker keeps its own models)")
+    ap.add_argument("--max-queue", type=int, default=100, help="Queued jobs beyond this are refused")
+    ap.add_argument("--max-models", type=int, default=2, help="Models kept loaded per worker")
+    ap.add_argument("--log-dir", default="logs/inference_server", help="One log file per job")
+    ap.add_argument("--keep-jobs", type=int, default=1000, help="Finished jobs remembered for status queries")
+    ap.add_argument("--preload", nargs="*", default=[], metavar="WEIGHTS[:BACKEND]", help="Load these models before taking jobs")
+    args = ap.parse_args()
+
+    server = InferenceServer(args.workers, args.max_queue, args.max_models, args.log_dir, args.keep_jobs)
+    for spec in args.preload:
+        weights, _, backend = spec.partition(":")
+        for slot in range(server.workers):
+            server.model_for(slot, argparse.Namespace(weights=str(Path(weights).resolve()), backend=backend or "torch"))
+    httpd = ThreadingHTTPServer((args.host, args.port), make_handler(server))
+    server.start()
+
+    def on_signal(signum, frame):
+        if not server.accepting:
+            print("Cancelling running jobs")
+            for j in list(server.jobs.values()):
+                j.cancel.set()
+            return
+        print("Shutting down: waiting for running jobs (send again to cancel them)")
+        threading.Thread(target=stop, args=(server, httpd), daemon=True).start()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+    print(f"Inference server on http://{args.host}:{args.port} ({server.workers} worker(s), logs in {args.log_dir})")
+    httpd.serve_forever()
+    httpd.server_close()
+    print("Server stopped")
+
+if __name__ == "__main__":
+    main()
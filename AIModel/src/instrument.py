@@ -0,0 +1,201 @@
+import json, os, threading, time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+_NULL = nullcontext()
+# ultralytics reports these per image, in milliseconds, in Results.speed.
+SPEED_STAGES = {"preprocess": "preprocess", "inference": "forward", "postprocess": "nms"}
+
+class Recorder:
+    """Per-stage wall/CPU time, counters and queue depths for one script run.
+
+    Disabled by default: ``stage`` then returns a shared null context, ``timed_iter``
+    hands back the iterable untouched and the other calls return at once, so leaving
+    the hooks in the hot loops costs about one attribute check each.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace = False
+
+    def enable(self, script, trace=False, trace_limit=200000):
+        self.enabled = True
+        self.trace = trace
+        self.trace_limit = trace_limit
+        self.script = script
+        self.stages = {}  # name -> [calls, wall seconds, cpu seconds]
+        self.counters = {}
+        self.gauges = {}  # name -> [samples, sum, max, last]
+        self.events = []
+        self.dropped_events = 0
+        self.lock = threading.Lock()
+        self.t0 = time.perf_counter()
+        self.pid = os.getpid()
+
+    def add(self, name, wall, cpu=0.0, calls=1, start=None, **info):
+        if not self.enabled:
+            return
+        with self.lock:
+            st = self.stages.setdefault(name, [0, 0.0, 0.0])
+            st[0] += calls
+            st[1] += wall
+            st[2] += cpu
+            if self.trace and start is not None:
+                if len(self.events) < self.trace_limit:
+                    self.events.append({"name": name, "ph": "X", "pid": self.pid, "tid": threading.get_ident(),
+                                        "ts": (start - self.t0) * 1e6, "dur": wall * 1e6, "args": info})
+                else:
+                    self.dropped_events += 1
+
+    @contextmanager
+    def _stage(self, name, info):
+        # process_time is process-wide: with worker threads busy it overstates this stage's CPU.
+        t0, c0 = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0, time.process_time() - c0, start=t0, **info)
+
+    def stage(self, name, **info):
+        return self._stage(name, info) if self.enabled else _NULL
+
+    def timed_iter(self, iterable, name):
+        """Yield from ``iterable``, timing each step as ``name`` (the time spent waiting on it)."""
+        if not self.enabled:
+            return iterable
+        return self._timed_iter(iterable, name)
+
+    def _timed_iter(self, iterable, name):
+        it = iter(iterable)
+        while True:
+            t0, c0 = time.perf_counter(), time.process_time()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            self.add(name, time.perf_counter() - t0, time.process_time() - c0, start=t0)
+            yield item
+
+    def timed_call(self, name, fn, *a):
+        """``fn(*a)`` timed as ``name``; for work submitted to thread pools."""
+        if not self.enabled:
+            return fn(*a)
+        t0, c0 = time.perf_counter(), time.thread_time()
+        try:
+            return fn(*a)
+        finally:
+            self.add(name, time.perf_counter() - t0, time.thread_time() - c0, start=t0)
+
+    def add_speed(self, speed):
+        """Fold one ultralytics Results.speed dict (ms per image) into the matching stages."""
+        if not self.enabled or not speed:
+            return
+        for key, name in SPEED_STAGES.items():
+            if speed.get(key) is not None:
+                self.add(name, speed[key] / 1000.0)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            g = self.gauges.setdefault(name, [0, 0.0, value, value])
+            g[0] += 1
+            g[1] += value
+            g[2] = max(g[2], value)
+            g[3] = value
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.t0
+        images = self.counters.get("images", 0)
+        return {
+            "script": self.script,
+            "elapsed_seconds": elapsed,
+            "images": images,
+            "images_per_second": images / elapsed if elapsed > 0 else 0.0,
+            "stages": {name: {"calls": n, "wall_seconds": wall, "cpu_seconds": cpu, "mean_ms": wall / n * 1000.0 if n else 0.0}
+                       for name, (n, wall, cpu) in sorted(self.stages.items())},
+            "counters": dict(sorted(self.counters.items())),
+            "queues": {name: {"samples": n, "mean": s / n if n else 0.0, "max": mx, "last": last}
+                       for name, (n, s, mx, last) in sorted(self.gauges.items())},
+        }
+
+    def prometheus(self, summary):
+        labels = f'script="{self.script}"'
+        lines = [
+            "# HELP greenspace_stage_seconds_total Wall time spent per pipeline stage.",
+            "# TYPE greenspace_stage_seconds_total counter",
+        ]
+        lines += [f'greenspace_stage_seconds_total{{{labels},stage="{k}"}} {v["wall_seconds"]:.6f}' for k, v in summary["stages"].items()]
+        lines += ["# HELP greenspace_stage_cpu_seconds_total Process CPU time per pipeline stage.",
+                  "# TYPE greenspace_stage_cpu_seconds_total counter"]
+        lines += [f'greenspace_stage_cpu_seconds_total{{{labels},stage="{k}"}} {v["cpu_seconds"]:.6f}' for k, v in summary["stages"].items()]
+        lines += ["# HELP greenspace_stage_calls_total Timed calls per pipeline stage.",
+                  "# TYPE greenspace_stage_calls_total counter"]
+        lines += [f'greenspace_stage_calls_total{{{labels},stage="{k}"}} {v["calls"]}' for k, v in summary["stages"].items()]
+        lines += ["# HELP greenspace_events_total Run counters (images, cache hits, ...).",
+                  "# TYPE greenspace_events_total counter"]
+        lines += [f'greenspace_events_total{{{labels},event="{k}"}} {v}' for k, v in summary["counters"].items()]
+        lines += ["# HELP greenspace_queue_depth_max Largest sampled queue depth.",
+                  "# TYPE greenspace_queue_depth_max gauge"]
+        lines += [f'greenspace_queue_depth_max{{{labels},queue="{k}"}} {v["max"]}' for k, v in summary["queues"].items()]
+        lines += ["# HELP greenspace_images_per_second Images per second over the whole run.",
+                  "# TYPE greenspace_images_per_second gauge",
+                  f"greenspace_images_per_second{{{labels}}} {summary['images_per_second']:.6f}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, outdir):
+        """Write metrics.json, metrics.prom and (with tracing) trace.json; returns the written paths."""
+        if not self.enabled:
+            return []
+        outdir = Path(outdir)
+        outdir.mkdir(parents=True, exist_ok=True)
+        summary = self.summary()
+        files = {"metrics.json": json.dumps(summary, indent=2), "metrics.prom": self.prometheus(summary)}
+        if self.trace:
+            files["trace.json"] = json.dumps({"traceEvents": self.events, "displayTimeUnit": "ms",
+                                              "otherData": {"dropped_events": self.dropped_events}})
+        written = []
+        for name, text in files.items():
+            tmp = outdir / f".{name}.tmp"
+            tmp.write_text(text, encoding="utf-8")
+            os.replace(tmp, outdir / name)  # textfile collectors must never read a partial file
+            written.append(outdir / name)
+        return written
+
+class RunRecorder:
+    """The Recorder of the run on the calling thread.
+
+    Scripts call the module-level ``recorder``; ``run_scope`` gives each run a fresh
+    Recorder and disables it when the run ends, so inference server jobs (one per worker
+    thread) and consecutive in-process runs never mix metrics. Outside a run it resolves to
+    a disabled Recorder. Thread pools get ``recorder.timed_call`` bound on the submitting
+    thread, so their work lands in the right run.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.idle = Recorder()
+
+    def current(self):
+        return getattr(self.local, "recorder", self.idle)
+
+    @contextmanager
+    def run_scope(self):
+        outer = self.current()
+        rec = self.local.recorder = Recorder()
+        try:
+            yield rec
+        finally:
+            rec.enabled = False
+            self.local.recorder = outer
+
+    def __getattr__(self, name):
+        return getattr(self.current(), name)
+
+recorder = RunRecorder()
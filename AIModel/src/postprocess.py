@@ -0,0 +1,81 @@
+import warnings
+import torch
+
+# Mask elements thresholded per chunk on CPU (one 512x512 mask; larger chunks fall out of cache).
+CHUNK_ELEMS = 1 << 18
+
+def letterbox_window(mask_shape, orig_shape):
+    """(top, bottom, left, right) of the mask rows/cols that cover the image, as ultralytics pads them."""
+    mh, mw = mask_shape
+    h, w = orig_shape
+    gain = min(mh / h, mw / w)
+    pad_h, pad_w = (mh - round(h * gain)) / 2, (mw - round(w * gain)) / 2
+    top, left = int(round(pad_h - 0.1)), int(round(pad_w - 0.1))
+    bottom, right = mh - int(round(pad_h + 0.1)), mw - int(round(pad_w + 0.1))
+    return top, bottom, left, right
+
+def summarize_masks(masks, confs, clss, orig_shape, conf_thr, min_area_frac, coverage_at="mask", store_masks=None):
+    """Filter instances and measure per-class union coverage without a per-instance host sync.
+
+    Returns (kept, coverage): ``kept`` lists (class_id, conf, area_pixels) in detection
+    order with areas counted at mask resolution, exactly as the per-instance loop did;
+    ``coverage`` maps class_id to the fraction of the image covered by the union of its
+    kept masks, measured inside the letterbox window of the mask ("mask") or after
+    rescaling the per-class unions to ``orig_shape`` ("orig"). With ``store_masks`` ("rle" or
+    "poly") each kept tuple gets a fourth element, the instance mask encoded by MaskCodec.
+    """
+    h, w = orig_shape
+    img_area = float(h * w)
+    n = len(masks)
+    # On CPU one pass over the whole stack is memory bound; chunks that stay in cache are several times faster.
+    step = max(1, CHUNK_ELEMS // max(1, masks[0].numel())) if n and masks.device.type == "cpu" else max(n, 1)
+    binary = masks if masks.dtype == torch.bool else torch.empty(masks.shape, dtype=torch.bool, device=masks.device)
+    areas = torch.empty(n, dtype=torch.int32, device=masks.device)
+    for s in range(0, n, step):
+        if binary is not masks:
+            torch.gt(masks[s:s + step], 0.5, out=binary[s:s + step])
+        torch.sum(binary[s:s + step].flatten(1), 1, dtype=torch.int32, out=areas[s:s + step])
+    # Compare in float64 like the Python loop did, so borderline instances keep the same verdict.
+    keep = (confs.double() >= conf_thr) & (areas.double() / img_area >= min_area_frac)
+    idx = keep.nonzero().flatten()
+
+    coverage = {}
+    if len(idx):
+        classes, slot = clss.long().unique(return_inverse=True)
+        # Dropped instances reduce into a spare last row instead of copying out the kept masks.
+        slot = torch.where(keep, slot, len(classes))
+        unions = torch.zeros((len(classes) + 1, binary[0].numel()), dtype=torch.uint8, device=masks.device)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)  # index_reduce_ is flagged beta
+            unions.index_reduce_(0, slot, binary.flatten(1).view(torch.uint8), "amax")
+        present = torch.zeros(len(classes) + 1, dtype=torch.bool, device=masks.device)
+        present[slot[idx]] = True
+        present = present[:-1]
+        classes = classes[present]
+        stacked = unions[:-1][present].view(len(classes), *binary.shape[1:])
+        if coverage_at == "orig":
+            from ultralytics.utils.ops import scale_masks
+            stacked = scale_masks(stacked[None].float(), (h, w))[0] > 0.5
+            fracs = stacked.flatten(1).sum(1).double() / img_area
+        else:
+            top, bottom, left, right = letterbox_window(masks.shape[1:], (h, w))
+            window = stacked[:, top:bottom, left:right]
+            fracs = window.flatten(1).sum(1, dtype=torch.int64).double() / float(window.shape[1] * window.shape[2])
+        coverage = dict(zip(classes.tolist(), fracs.tolist()))
+
+    encoded = None
+    if store_masks and len(idx):
+        from MaskCodec import encode_polygons, encode_rle
+        top, bottom, left, right = letterbox_window(masks.shape[1:], (h, w))
+        window = binary[idx, top:bottom, left:right].cpu().numpy()
+        if store_masks == "rle":
+            encoded = [{"rle": r, "size": list(window.shape[1:])} for r in encode_rle(window)]
+        else:
+            encoded = [{"poly": rings} for rings in encode_polygons(window, (h, w))]
+
+    idx = idx.tolist()
+    area_l, conf_l, cls_l = areas[idx].tolist(), confs[idx].tolist(), clss[idx].tolist()
+    kept = [(int(c), float(p), int(a)) for c, p, a in zip(cls_l, conf_l, area_l)]
+    if encoded is not None:
+        kept = [k + (m,) for k, m in zip(kept, encoded)]
+    return kept, coverage
@@ -0,0 +1,82 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import cv2
+import numpy as np
+from PIL import Image
+from PatchPack import PatchPack
+
+# Pixels whose brightest channel is at or below this count as blank (black padding, nodata).
+BLANK_MAX = 8
+# Excess green (2g - r - b on chromatic coordinates) above which a pixel counts as vegetation.
+EXG_MIN = 0.05
+# The classes the screen stands in for; skipping a tile says nothing about the other classes.
+VEGETATION_CLASSES = ("grass", "tree")
+
+def screen(img):
+    """(green_frac, blank_frac) of a BGR uint8 image."""
+    px = img.reshape(-1, 3).astype(np.float32)
+    blank = px.max(axis=1) <= BLANK_MAX
+    total = px.sum(axis=1)
+    exg = (2.0 * px[:, 1] - px[:, 0] - px[:, 2]) / np.maximum(total, 1.0)
+    green = (exg > EXG_MIN) & ~blank
+    return float(green.mean()), float(blank.mean())
+
+def screen_bytes(data):
+    """Screen an encoded image at 1/4 resolution (JPEG decodes straight to it); also returns its full (h, w).
+
+    None when the bytes do not decode; such an image is left unscreened.
+    """
+    buf = np.frombuffer(data, np.uint8)
+    img = cv2.imdecode(buf, cv2.IMREAD_REDUCED_COLOR_4)
+    if img is None:
+        return None
+    try:
+        w, h = Image.open(io.BytesIO(data)).size  # header only
+    except OSError:
+        return None
+    return screen(img) + ((h, w),)
+
+def screen_sources(files, packs, skip=(), workers=4):
+    """{path: {"green_frac", "blank_frac", "height", "width"}} for loose files and every tile of ``packs``.
+
+    Unreadable images are left out, so they reach the model (which reports them) instead of being skipped.
+    """
+    def one(item):
+        path, read = item
+        screened = screen_bytes(read())
+        if screened is None:
+            return path, None
+        green, blank, (h, w) = screened
+        return path, {"green_frac": green, "blank_frac": blank, "height": h, "width": w}
+
+    items = [(f, lambda f=f: Path(f).read_bytes()) for f in files if f not in skip]
+    opened = [PatchPack(p) for p in packs]
+    for pack_path, pack in zip(packs, opened):
+        for i in range(len(pack)):
+            vpath = str(Path(pack_path) / pack.name(i))
+            if vpath not in skip:
+                items.append((vpath, lambda pack=pack, i=i: pack.read_bytes(i)))
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:  # cv2 decoding releases the GIL
+            screens = {}
+            for path, info in pool.map(one, items):
+                if info is None:
+                    print(f"Prefilter: unreadable image, not screened: {path}")
+                else:
+                    screens[path] = info
+            return screens
+    finally:
+        for pack in opened:
+            pack.close()
+
+def would_skip(info, min_green, max_blank):
+    return info["blank_frac"] >= max_blank or info["green_frac"] < min_green
+
+def skipped_record(path, info):
+    """Zero-coverage record for a tile the pre-screen kept away from the model.
+
+    Only the vegetation classes are known to be (nearly) absent; building, water or bare
+    soil on the tile is not measured and counts as zero too.
+    """
+    return {"image": path, "height": info["height"], "width": info["width"], "segments_kept": [], "coverage": {}}
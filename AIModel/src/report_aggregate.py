@@ -0,0 +1,249 @@
+import json, math, os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+from functools import partial
+from coverage_stats import HIST_BINS, QuantileSketch, hist_bin, hist_bins, region_of
+from result_store import ResultStore, is_store
+
+STATE_FILE = "report_state.json"
+STATE_VERSION = 2
+CHUNK_FILES = 2000
+
+class Aggregate:
+    """Mergeable per-class coverage statistics over a set of images.
+
+    For every class it keeps the sum and sum of squares of the per-image area
+    fraction (images without the class contribute 0), the instance count and the
+    number of images the class appears in. With ``detail`` it also keeps a quantile
+    sketch and a fixed-bin histogram of the per-image fractions, plus one plain
+    aggregate per region. Only images that contain a class enter its sketch and
+    histogram; the zeros of the other images are added back when reading them.
+    Two aggregates over disjoint image sets merge into the aggregate of their union.
+    """
+
+    def __init__(self, detail=True):
+        self.images = 0
+        self.classes = {}  # name -> [sum, sum of squares, instances, images present]
+        self.detail = detail
+        self.sketches = {}
+        self.hist = {}
+        self.regions = {}
+
+    def _class(self, cname):
+        if cname not in self.classes:
+            self.classes[cname] = [0.0, 0.0, 0, 0]
+            if self.detail:
+                self.sketches[cname] = QuantileSketch()
+                self.hist[cname] = [0] * (HIST_BINS + 1)
+        return self.classes[cname]
+
+    def region(self, name):
+        if name not in self.regions:
+            self.regions[name] = Aggregate(detail=False)
+        return self.regions[name]
+
+    def add_image(self, fracs, instances, region=None):
+        self.images += 1
+        for cname, v in fracs.items():
+            st = self._class(cname)
+            st[0] += v
+            st[1] += v * v
+            st[2] += instances[cname]
+            st[3] += 1
+            if self.detail:
+                self.sketches[cname].add(v)
+                self.hist[cname][hist_bin(v)] += 1
+        if self.detail and region is not None:
+            self.region(region).add_image(fracs, instances)
+
+    def add_columns(self, names, pair_slot, per_pair, inst_slot):
+        """Fold column data: per (image, class) pair its class slot and area fraction, per segment its class slot."""
+        k = len(names)
+        sums = np.bincount(pair_slot, weights=per_pair, minlength=k)
+        sumsq = np.bincount(pair_slot, weights=per_pair * per_pair, minlength=k)
+        present = np.bincount(pair_slot, minlength=k)
+        instances = np.bincount(inst_slot, minlength=k)
+        for i, cname in enumerate(names):
+            if not present[i]:
+                continue
+            st = self._class(cname)
+            for j, v in enumerate((float(sums[i]), float(sumsq[i]), int(instances[i]), int(present[i]))):
+                st[j] += v
+            if self.detail:
+                vals = per_pair[pair_slot == i]
+                self.sketches[cname].add_many(vals)
+                for b, n in enumerate(np.bincount(hist_bins(vals), minlength=HIST_BINS + 1).tolist()):
+                    self.hist[cname][b] += n
+
+    def merge(self, other):
+        self.images += other.images
+        for cname, o in other.classes.items():
+            st = self._class(cname)
+            for i in range(4):
+                st[i] += o[i]
+            if self.detail and other.detail:
+                self.sketches[cname].merge(other.sketches[cname])
+                self.hist[cname] = [a + b for a, b in zip(self.hist[cname], other.hist[cname])]
+        if self.detail:
+            for name, r in other.regions.items():
+                self.region(name).merge(r)
+        return self
+
+    def mean(self, cname):
+        return self.classes[cname][0] / self.images if self.images else 0.0
+
+    def std(self, cname):
+        if not self.images:
+            return 0.0
+        m = self.mean(cname)
+        return math.sqrt(max(self.classes[cname][1] / self.images - m * m, 0.0))
+
+    def instances(self, cname):
+        return self.classes[cname][2]
+
+    def quantile(self, cname, q):
+        return self.sketches[cname].quantile(q, extra_zeros=self.images - self.classes[cname][3])
+
+    def histogram(self, cname):
+        h = list(self.hist[cname])
+        h[0] += self.images - self.classes[cname][3]
+        return h
+
+    def to_dict(self):
+        d = {"images": self.images, "classes": self.classes}
+        if self.detail:
+            d["sketches"] = {c: sk.to_dict() for c, sk in self.sketches.items()}
+            d["hist"] = self.hist
+            d["regions"] = {name: r.to_dict() for name, r in self.regions.items()}
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        agg = cls(detail="sketches" in d)
+        agg.images = d["images"]
+        agg.classes = {k: list(v) for k, v in d["classes"].items()}
+        if agg.detail:
+            agg.sketches = {c: QuantileSketch.from_dict(sk) for c, sk in d["sketches"].items()}
+            agg.hist = {c: list(h) for c, h in d["hist"].items()}
+            agg.regions = {name: cls.from_dict(r) for name, r in d["regions"].items()}
+        return agg
+
+def fold_json_files(paths, region_pattern=None):
+    """Aggregate of a list of analyzer JSON files; runs inside the worker processes."""
+    agg = Aggregate()
+    for p in paths:
+        with open(p, "rb") as f:
+            data = json.loads(f.read())
+        img_area = float(data["height"] * data["width"])
+        fracs = {}
+        instances = {}
+        for seg in data.get("segments_kept", []):
+            cname = seg.get("class_name", str(seg.get("class_id", "?")))
+            fracs[cname] = fracs.get(cname, 0.0) + float(seg["area_pixels"]) / img_area
+            instances[cname] = instances.get(cname, 0) + 1
+        agg.add_image(fracs, instances, region_of(data.get("image", p), region_pattern))
+    return agg
+
+def fold_store(store, start=0, region_pattern=None):
+    """Aggregate of the store images from index ``start`` on, computed per column."""
+    agg = Aggregate()
+    lines = list(store.images(start))
+    agg.images = len(lines)
+    img_area = np.array([line["height"] * line["width"] for line in lines], dtype=np.float64)
+    region_names = sorted({region_of(line["image"], region_pattern) for line in lines})
+    slot_of = {name: i for i, name in enumerate(region_names)}
+    img_region = np.array([slot_of[region_of(line["image"], region_pattern)] for line in lines], dtype=np.int64)
+    for r, n in zip(region_names, np.bincount(img_region, minlength=len(region_names)).tolist()):
+        agg.region(r).images += n
+    seg = store.segments
+    seg = seg[np.searchsorted(seg["image"], start):]
+    if not len(seg):
+        return agg
+    image = seg["image"].astype(np.int64) - start
+    class_ids, slot = np.unique(seg["class_id"], return_inverse=True)
+    names = [store.classes.get(c, str(c)) for c in class_ids.tolist()]
+    fracs = seg["area_pixels"] / img_area[image]
+    # One bucket per (image, class) pair holds that image's area fraction of the class.
+    pair = image * len(class_ids) + slot
+    pairs, inverse = np.unique(pair, return_inverse=True)
+    per_pair = np.bincount(inverse, weights=fracs)
+    pair_slot = pairs % len(class_ids)
+    agg.add_columns(names, pair_slot, per_pair, slot)
+    pair_region = img_region[pairs // len(class_ids)]
+    seg_region = img_region[image]
+    for r, name in enumerate(region_names):
+        sel = pair_region == r
+        agg.region(name).add_columns(names, pair_slot[sel], per_pair[sel], slot[seg_region == r])
+    return agg
+
+def aggregate_files(paths, workers=None, chunk=CHUNK_FILES, region_pattern=None):
+    """Fold ``paths`` in chunks on a process pool and merge the partial aggregates."""
+    agg = Aggregate()
+    chunks = [paths[i:i + chunk] for i in range(0, len(paths), chunk)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(chunks) <= 1:
+        for c in chunks:
+            agg.merge(fold_json_files(c, region_pattern))
+        return agg
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+        # map keeps chunk order, so the merged floats do not depend on scheduling.
+        for part in pool.map(partial(fold_json_files, region_pattern=region_pattern), chunks):
+            agg.merge(part)
+    return agg
+
+def _signature(st):
+    return [st.st_size, st.st_mtime_ns]
+
+def update_aggregate(indir, state_path=None, workers=None, rebuild=False, region_pattern=None):
+    """Aggregate for a json/ folder or result store, reusing the saved state where possible.
+
+    Returns (aggregate, images processed in this call). Only files that are not in
+    the saved state are parsed; if a known file changed or disappeared the state is
+    rebuilt from scratch. For a result store only images past the saved count are read.
+    """
+    indir = Path(indir)
+    state_path = Path(state_path or indir.parent / STATE_FILE)
+    state = None
+    if not rebuild and state_path.exists():
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if (state.get("version") != STATE_VERSION or state.get("indir") != str(indir.resolve())
+                or state.get("region_pattern") != region_pattern):
+            state = None
+
+    if is_store(indir):
+        store = ResultStore(indir)
+        start = state["store_images"] if state and state.get("store_images", 0) <= len(store) else 0
+        agg = Aggregate.from_dict(state["aggregate"]) if start else Aggregate()
+        agg.merge(fold_store(store, start, region_pattern))
+        new_state = {"store_images": len(store)}
+        processed = len(store) - start
+    else:
+        files = {}
+        with os.scandir(indir) as it:
+            for e in it:
+                if e.name.endswith(".json") and e.is_file():
+                    files[e.name] = _signature(e.stat())
+        known = state["files"] if state else {}
+        if any(files.get(name) != sig for name, sig in known.items()):
+            known = {}
+        agg = Aggregate.from_dict(state["aggregate"]) if known else Aggregate()
+        new = sorted(name for name in files if name not in known)
+        agg.merge(aggregate_files([str(indir / name) for name in new], workers, region_pattern=region_pattern))
+        new_state = {"files": files}
+        processed = len(new)
+
+    tmp = state_path.with_name(state_path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": STATE_VERSION, "indir": str(indir.resolve()), "region_pattern": region_pattern, "aggregate": agg.to_dict(), **new_state}, f)
+    os.replace(tmp, state_path)
+    return agg, processed
+
+def load_state_aggregate(state_path):
+    """The aggregate saved by another report run, for merging into this one."""
+    with open(state_path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if state.get("version") != STATE_VERSION:
+        raise ValueError(f"{state_path}: report state version {state.get('version')}, expected {STATE_VERSION}")
+    return Aggregate.from_dict(state["aggregate"])
@@ -0,0 +1,104 @@
+import hashlib, io, json, os, threading
+from pathlib import Path
+import numpy as np
+
+# Bump when the entry layout or the way raw results are produced changes.
+CACHE_VERSION = 1
+ENTRY_EXT = ".npz"
+
+def file_digest(path, chunk=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def tree_digest(path):
+    """file_digest of a file, or of every file under a folder (exported OpenVINO models are folders)."""
+    p = Path(path)
+    if p.is_file():
+        return file_digest(p)
+    h = hashlib.sha256()
+    for f in sorted(q for q in p.rglob("*") if q.is_file()):
+        h.update(f"{f.relative_to(p).as_posix()}:{file_digest(f)}\n".encode())
+    return h.hexdigest()
+
+def bytes_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+class ResultCache:
+    """On-disk cache of raw per-image model output, addressed by content.
+
+    The key covers the image bytes, the weights file, ``imgsz`` and the confidence
+    the model itself ran at, so --conf / --min-area-frac above that confidence only
+    re-filter cached instances. Entries are .npz files holding class ids, scores,
+    bit-packed masks and the original image shape. Least recently used entries are
+    evicted once the folder outgrows ``max_bytes``.
+    """
+
+    def __init__(self, root, weights, imgsz, model_conf, max_bytes):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.model_conf = model_conf
+        self.prefix = json.dumps({"version": CACHE_VERSION, "weights": tree_digest(weights),
+                                  "imgsz": imgsz, "model_conf": model_conf}, sort_keys=True)
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def key(self, image_digest):
+        return bytes_digest(f"{self.prefix}:{image_digest}".encode("utf-8"))
+
+    def _path(self, key):
+        return self.root / key[:2] / f"{key}{ENTRY_EXT}"
+
+    def get(self, key):
+        """(masks, confs, clss, orig_shape) as numpy arrays, or None on a miss."""
+        p = self._path(key)
+        try:
+            with np.load(p) as z:
+                n, mh, mw = (int(v) for v in z["mask_shape"])
+                bits = np.unpackbits(z["bits"], axis=1, count=mh * mw) if n else np.zeros((0, mh * mw), np.uint8)
+                entry = (bits.reshape(n, mh, mw).astype(bool), z["conf"], z["cls"], tuple(int(v) for v in z["orig_shape"]))
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(p)  # mtime doubles as the LRU clock
+        self.hits += 1
+        return entry
+
+    def put(self, key, masks, confs, clss, orig_shape):
+        masks = np.asarray(masks, dtype=bool)
+        n = len(masks)
+        buf = io.BytesIO()
+        np.savez_compressed(buf, mask_shape=np.array(masks.shape if n else (0, 0, 0), dtype=np.int64),
+                            bits=np.packbits(masks.reshape(n, -1), axis=1) if n else np.zeros((0, 0), np.uint8),
+                            conf=np.asarray(confs, dtype=np.float32), cls=np.asarray(clss, dtype=np.float32),
+                            orig_shape=np.array(orig_shape, dtype=np.int64))
+        p = self._path(key)
+        p.parent.mkdir(exist_ok=True)
+        tmp = p.with_name(f"{p.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(buf.getvalue())
+        os.replace(tmp, p)  # readers never see a half-written entry
+
+    def size(self):
+        return sum(p.stat().st_size for p in self.root.glob(f"*/*{ENTRY_EXT}"))
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in ``max_bytes``; returns bytes kept."""
+        entries = []
+        for p in self.root.glob(f"*/*{ENTRY_EXT}"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:  # evicted by a concurrent run
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        total = sum(e[1] for e in entries)
+        for _, size, p in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            p.unlink(missing_ok=True)
+            total -= size
+            self.evicted += 1
+        return total
@@ -0,0 +1,194 @@
+import argparse, json, os, sys
+from pathlib import Path
+import numpy as np
+
+MANIFEST = "manifest.json"
+IMAGES = "images.jsonl"
+SEGMENTS = "segments.bin"
+VERSION = 1
+# tiles is -1 for segments that did not come from a tiled run.
+SEGMENT_DTYPE = np.dtype([("image", "<u8"), ("class_id", "<i4"), ("tiles", "<i4"), ("conf", "<f8"),
+                          ("area_pixels", "<i8"), ("area_frac", "<f8")])
+
+# Store layout: images.jsonl holds one line per image with every analyzer key except the
+# segments, which live as fixed-size SEGMENT_DTYPE rows in segments.bin ("segments_kept"
+# in the line is [first row, row count]). manifest.json names the committed length of both
+# files; anything past it is an interrupted batch and is cut off when the store reopens.
+# Masks stored with analyze_masks --store-masks do not fit a fixed-size row; they stay in the
+# line as "masks", one per segment in row order.
+
+def is_store(path):
+    return (Path(path) / MANIFEST).is_file()
+
+def _read_manifest(root):
+    p = root / MANIFEST
+    if not p.exists():
+        return {"version": VERSION, "images": 0, "images_bytes": 0, "segments": 0, "classes": {}}
+    with open(p, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != VERSION:
+        raise ValueError(f"{root}: unsupported result store version {manifest.get('version')}")
+    return manifest
+
+class ResultStoreWriter:
+    """Append analyzer records to a store, committing every ``batch`` images.
+
+    Reopening an existing store resumes it: uncommitted bytes are dropped and
+    ``done`` holds the images already stored, so callers can skip them.
+    """
+
+    def __init__(self, root, batch=1000):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.batch = max(batch, 1)
+        self.manifest = _read_manifest(self.root)
+        self.done = set()
+        with open(self.root / IMAGES, "ab+") as f:
+            f.truncate(self.manifest["images_bytes"])
+            f.seek(0)
+            for line in f:
+                self.done.add(json.loads(line)["image"])
+        with open(self.root / SEGMENTS, "ab") as f:
+            f.truncate(self.manifest["segments"] * SEGMENT_DTYPE.itemsize)
+        self.images_f = open(self.root / IMAGES, "ab")
+        self.segments_f = open(self.root / SEGMENTS, "ab")
+        self.pending = []
+
+    def add(self, rec):
+        self.pending.append(rec)
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        m = self.manifest
+        lines = []
+        rows = []
+        for rec in self.pending:
+            segs = rec.get("segments_kept", [])
+            line = {k: ([m["segments"] + len(rows), len(segs)] if k == "segments_kept" else v) for k, v in rec.items()}
+            if any("mask" in seg for seg in segs):
+                line["masks"] = [seg.get("mask") for seg in segs]
+            for seg in segs:
+                m["classes"].setdefault(str(seg["class_id"]), seg.get("class_name", str(seg["class_id"])))
+                rows.append((m["images"] + len(lines), seg["class_id"], seg.get("tiles", -1), seg["conf"],
+                             seg["area_pixels"], seg["area_frac"]))
+            lines.append(json.dumps(line, ensure_ascii=False) + "\n")
+        blob = "".join(lines).encode("utf-8")
+        self.images_f.write(blob)
+        self.segments_f.write(np.array(rows, dtype=SEGMENT_DTYPE).tobytes())
+        for f in (self.images_f, self.segments_f):
+            f.flush()
+            os.fsync(f.fileno())
+        m["images"] += len(lines)
+        m["images_bytes"] += len(blob)
+        m["segments"] += len(rows)
+        tmp = self.root / f"{MANIFEST}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(m, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.root / MANIFEST)  # the commit point
+        self.done.update(rec["image"] for rec in self.pending)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.images_f.close()
+        self.segments_f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ResultStore:
+    """Read the committed part of a store."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.manifest = _read_manifest(self.root)
+        self.classes = {int(k): v for k, v in self.manifest["classes"].items()}
+        n = self.manifest["segments"]
+        self.segments = (np.memmap(self.root / SEGMENTS, dtype=SEGMENT_DTYPE, mode="r", shape=(n,)) if n
+                         else np.zeros(0, dtype=SEGMENT_DTYPE))
+
+    def __len__(self):
+        return self.manifest["images"]
+
+    def images(self, start=0):
+        """Per-image lines from index ``start`` on; ``segments_kept`` is the [first row, row count] range in ``segments``."""
+        with open(self.root / IMAGES, "rb") as f:
+            data = f.read(self.manifest["images_bytes"])
+        for line in data.splitlines()[start:]:
+            yield json.loads(line)
+
+    def records(self):
+        """Records in the same shape analyze_masks writes to json/."""
+        for line in self.images():
+            start, count = line["segments_kept"]
+            masks = line.pop("masks", None)
+            segs = []
+            for row in self.segments[start:start + count].tolist():
+                _, cls_id, tiles, conf, area_pix, area_frac = row
+                seg = {"class_id": cls_id, "class_name": self.classes.get(cls_id, str(cls_id)), "conf": conf,
+                       "area_pixels": area_pix, "area_frac": area_frac}
+                if tiles >= 0:
+                    seg["tiles"] = tiles
+                if masks and masks[len(segs)] is not None:
+                    seg["mask"] = masks[len(segs)]
+                segs.append(seg)
+            line["segments_kept"] = segs
+            yield line
+
+def convert_json_dir(json_dir, store_dir, batch=1000):
+    """Append every <stem>.json of an analyzer json/ folder to a store; already stored images are skipped."""
+    added = 0
+    with ResultStoreWriter(store_dir, batch=batch) as w:
+        for jf in sorted(Path(json_dir).glob("*.json")):
+            with open(jf, "r", encoding="utf-8") as f:
+                rec = json.load(f)
+            if rec["image"] in w.done:
+                continue
+            w.add(rec)
+            added += 1
+    return added
+
+def export_json_dir(store_dir, json_dir):
+    json_dir = Path(json_dir)
+    json_dir.mkdir(parents=True, exist_ok=True)
+    n = 0
+    for rec in ResultStore(store_dir).records():
+        with open(json_dir / f"{Path(rec['image']).stem}.json", "w", encoding="utf-8") as f:
+            json.dump(rec, f, ensure_ascii=False, indent=2)
+        n += 1
+    return n
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert between analyzer json/ folders and a result store.")
+    ap.add_argument("--store", required=True, help="Result store folder")
+    ap.add_argument("--from-json", default=None, help="Append the JSON files of this folder to the store")
+    ap.add_argument("--export-json", default=None, help="Write the store back out as one JSON per image")
+    ap.add_argument("--batch", type=int, default=1000, help="Images per committed batch")
+    args = ap.parse_args()
+
+    if args.from_json:
+        if not Path(args.from_json).is_dir():
+            print(f"JSON folder not found: {args.from_json}")
+            sys.exit(2)
+        n = convert_json_dir(args.from_json, args.store, batch=args.batch)
+        print(f"Added {n} image(s) to {args.store}")
+    elif not is_store(args.store):
+        print(f"Result store not found: {args.store}")
+        sys.exit(2)
+    elif args.export_json:
+        n = export_json_dir(args.store, args.export_json)
+        print(f"Exported {n} image(s) to {args.export_json}")
+    else:
+        store = ResultStore(args.store)
+        print(f"{args.store}: {len(store)} image(s), {len(store.segments)} segment(s), {len(store.classes)} class(es)")
+
+if __name__ == "__main__":
+    main()
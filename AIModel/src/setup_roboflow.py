@@ -1,54 +1,265 @@
-import argparse, zipfile, shutil, sys
+import argparse, io, json, os, zipfile, shutil, sys, time, zlib
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from PIL import Image
+from result_cache import bytes_digest
 
 IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
-
-def count_images(p: Path) -> int:
-    return sum(1 for x in p.rglob("*") if x.suffix.lower() in IMG_EXTS)
+MANIFEST = "manifest.json"
+# Bump when the per-file entries change meaning; older manifests are then rebuilt from scratch.
+MANIFEST_VERSION = 1
+SPLIT_ALIASES = {"valid": "val"}
 
 def find_dataset_root(base: Path) -> Path:
-    candidates = [base] + [d for d in base.rglob("*") if d.is_dir()]
-    for d in candidates:
-        if (d / "images").exists() or (d / "labels").exists():
-            return d
+    """Shallowest folder holding images/, labels/ or data.yaml, searched level by level so it stops early."""
+    level = [base]
+    while level:
+        for d in level:
+            if (d / "images").exists() or (d / "labels").exists() or (d / "data.yaml").exists():
+                return d
+        level = [Path(e.path) for d in level for e in os.scandir(d) if e.is_dir()]
     return base
 
+def member_path(dest, m):
+    """Where zip member ``m`` goes under ``dest``; names reaching outside it are refused."""
+    p = (dest / m.filename).resolve()
+    if p != dest.resolve() and dest.resolve() not in p.parents:
+        raise ValueError(f"zip member outside the destination: {m.filename}")
+    return p
+
+def extract_parallel(zip_path, dest, workers):
+    """Extract with one ZipFile handle per thread (zlib inflates outside the GIL); returns (written, unchanged).
+
+    Every folder is created up front, one after the other: zipfile's own extract creates
+    missing parents without exist_ok, so threads sharing a folder would race on it.
+    Members already on disk with the same size and CRC are left alone, so their mtimes and
+    the manifest entries built from them stay valid on a re-run.
+    """
+    dest = Path(dest)
+    with zipfile.ZipFile(zip_path, "r") as zf:
+        infos = zf.infolist()
+    members = [m for m in infos if not m.is_dir()]
+    for d in sorted({member_path(dest, m) for m in infos if m.is_dir()} | {member_path(dest, m).parent for m in members}):
+        os.makedirs(d, exist_ok=True)
+    members.sort(key=lambda m: m.file_size, reverse=True)
+    shares = [members[i::workers] for i in range(workers)]
+
+    def unchanged(m):
+        p = member_path(dest, m)
+        if not p.is_file() or p.stat().st_size != m.file_size:
+            return False
+        crc = 0
+        with open(p, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                crc = zlib.crc32(block, crc)
+        return crc == m.CRC
+
+    def run(share):
+        written = 0
+        with zipfile.ZipFile(zip_path, "r") as zf:
+            for m in share:
+                if not unchanged(m):
+                    with zf.open(m) as src, open(member_path(dest, m), "wb") as dst:
+                        shutil.copyfileobj(src, dst, 1 << 20)
+                    written += 1
+        return written
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        written = sum(pool.map(run, shares))
+    return written, len(members) - written
+
+def scan_images(root: Path):
+    """Relative paths of every image under ``root``, from one os.scandir walk."""
+    found = []
+    stack = deque([root])
+    while stack:
+        for e in os.scandir(stack.pop()):
+            if e.is_dir():
+                stack.append(Path(e.path))
+            elif os.path.splitext(e.name)[1].lower() in IMG_EXTS:
+                found.append(Path(e.path).relative_to(root).as_posix())
+    return sorted(found)
+
+def label_for(rel):
+    """YOLO label path of an image (last images/ folder swapped for labels/) and the split it belongs to."""
+    parts = rel.split("/")
+    if "images" not in parts[:-1]:
+        return None, "all"
+    i = len(parts) - 2 - parts[:-1][::-1].index("images")
+    label = "/".join(parts[:i] + ["labels"] + parts[i + 1:])
+    label = os.path.splitext(label)[0] + ".txt"
+    split = parts[i + 1] if i + 1 < len(parts) - 1 else (parts[i - 1] if i > 0 else "all")
+    return label, SPLIT_ALIASES.get(split, split)
+
+def check_image(data, ext):
+    """(width, height, problem or None) without a full decode: header, PIL verify and the JPEG end marker."""
+    try:
+        im = Image.open(io.BytesIO(data))
+        w, h = im.size
+        im.verify()
+    except Exception as e:
+        return None, None, f"unreadable: {e}"
+    if ext in (".jpg", ".jpeg") and not data.rstrip(b"\x00")[-2:] == b"\xff\xd9":
+        return w, h, "truncated JPEG"
+    return w, h, None
+
+def check_label(path):
+    """(status, {class id: instances}, problem or None) of a YOLO polygon / box label file."""
+    if not path.exists():
+        return "missing", {}, None
+    counts = Counter()
+    for n, line in enumerate(path.read_text(encoding="utf-8", errors="replace").splitlines(), 1):
+        vals = line.split()
+        if not vals:
+            continue
+        try:
+            cls, coords = int(vals[0]), [float(v) for v in vals[1:]]
+        except ValueError:
+            return "corrupt", dict(counts), f"line {n}: not numeric"
+        if len(coords) != 4 and (len(coords) < 6 or len(coords) % 2):
+            return "corrupt", dict(counts), f"line {n}: {len(coords)} coordinates"
+        if any(c < 0.0 or c > 1.0 for c in coords):
+            return "corrupt", dict(counts), f"line {n}: coordinates outside 0..1"
+        counts[cls] += 1
+    return ("ok" if counts else "empty"), {str(k): v for k, v in sorted(counts.items())}, None
+
+def index_file(root, rel, old):
+    """Manifest entry of one image and its label; ``old`` is reused when neither file changed."""
+    p = root / rel
+    label_rel, split = label_for(rel)
+    lp = root / label_rel if label_rel else None
+    st = p.stat()
+    lst = lp.stat() if lp is not None and lp.exists() else None
+    stamp = [st.st_size, st.st_mtime_ns, lst.st_size if lst else None, lst.st_mtime_ns if lst else None]
+    if old is not None and old.get("stamp") == stamp:
+        return old, False
+    data = p.read_bytes()
+    w, h, problem = check_image(data, p.suffix.lower())
+    status, counts, label_problem = check_label(lp) if lp is not None else ("missing", {}, None)
+    entry = {"split": split, "size": st.st_size, "width": w, "height": h, "sha256": bytes_digest(data),
+             "label": label_rel, "label_status": status, "labels": counts, "stamp": stamp}
+    if problem:
+        entry["problem"] = problem
+    if label_problem:
+        entry["label_problem"] = label_problem
+    return entry, True
+
+def build_manifest(root, workers, rebuild=False):
+    """Index every image under ``root`` into <root>/manifest.json; returns (manifest, rechecked files)."""
+    path = root / MANIFEST
+    old = {}
+    if path.exists() and not rebuild:
+        with open(path, "r", encoding="utf-8") as f:
+            prev = json.load(f)
+        if prev.get("version") == MANIFEST_VERSION:
+            old = prev["files"]
+    rels = scan_images(root)
+    with ThreadPoolExecutor(max_workers=workers) as pool:  # hashing and file reads release the GIL
+        results = list(pool.map(lambda rel: index_file(root, rel, old.get(rel)), rels))
+    files = {rel: entry for rel, (entry, _) in zip(rels, results)}
+    manifest = {"version": MANIFEST_VERSION, "created": time.strftime("%Y-%m-%d %H:%M:%S"), "files": files,
+                "summary": summarize(files)}
+    tmp = root / f".{MANIFEST}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+    return manifest, sum(changed for _, changed in results)
+
+def summarize(files):
+    splits = {}
+    for rel, e in files.items():
+        s = splits.setdefault(e["split"], {"images": 0, "bytes": 0, "corrupt": [], "label_missing": 0, "label_empty": 0,
+                                           "label_corrupt": [], "instances": Counter(), "images_with": Counter(), "sizes": Counter()})
+        s["images"] += 1
+        s["bytes"] += e["size"]
+        if e.get("problem"):
+            s["corrupt"].append(rel)
+        if e["label_status"] == "missing":
+            s["label_missing"] += 1
+        elif e["label_status"] == "empty":
+            s["label_empty"] += 1
+        elif e["label_status"] == "corrupt":
+            s["label_corrupt"].append(e["label"])
+        for cls, n in e["labels"].items():
+            s["instances"][cls] += n
+            s["images_with"][cls] += 1
+        if e["width"]:
+            s["sizes"][f"{e['width']}x{e['height']}"] += 1
+    for s in splits.values():
+        for key in ("instances", "images_with"):
+            s[key] = dict(sorted(s[key].items(), key=lambda kv: int(kv[0])))
+        s["sizes"] = dict(s["sizes"].most_common())
+    return dict(sorted(splits.items()))
+
+def class_names(root):
+    try:
+        import yaml
+        with open(root / "data.yaml", "r", encoding="utf-8") as f:
+            names = yaml.safe_load(f).get("names", [])
+        return {str(k): v for k, v in (names.items() if isinstance(names, dict) else enumerate(names))}
+    except Exception:
+        return {}
+
+def print_summary(summary, names):
+    for split, s in summary.items():
+        print(f"{split}: {s['images']} image(s), {s['bytes'] / 1048576:.1f} MB, {len(s['corrupt'])} corrupt, "
+              f"{s['label_missing']} without label file, {s['label_empty']} with empty labels, {len(s['label_corrupt'])} bad label file(s)")
+        for rel in (s["corrupt"] + s["label_corrupt"])[:10]:
+            print(f"  ! {rel}")
+        for cls, n in s["instances"].items():
+            print(f"  class {cls} {names.get(cls, '')}: {n} instance(s) in {s['images_with'][cls]} image(s)")
+        sizes = list(s["sizes"].items())
+        print(f"  sizes: " + ", ".join(f"{k} x{n}" for k, n in sizes[:5]) + (f" (+{len(sizes) - 5} more)" if len(sizes) > 5 else ""))
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("zip_path", nargs="?", help="Path to dataset zip (positional fallback)")
     ap.add_argument("--zip", dest="zip_opt", help="Path to dataset zip")
     ap.add_argument("--outdir", default=".", help="Extraction directory")
     ap.add_argument("--force", action="store_true", help="Remove destination if it exists")
+    ap.add_argument("--index", default=None, metavar="DIR", help="Only (re)index an already extracted dataset folder")
+    ap.add_argument("--reindex", action="store_true", help="Ignore the existing manifest and check every file again")
+    ap.add_argument("--workers", type=int, default=min(os.cpu_count() or 1, 16), help="Threads for extraction and indexing")
     args = ap.parse_args()
 
-    zip_arg = args.zip_opt or args.zip_path
-    if not zip_arg:
-        print("Missing ZIP path. Use: python setup_roboflow.py ZIP or --zip ZIP")
-        sys.exit(2)
-
-    zip_path = Path(zip_arg)
-    outdir = Path(args.outdir)
-    if not zip_path.exists():
-        print(f"Zip not found: {zip_path}")
-        sys.exit(1)
-
-    outdir.mkdir(parents=True, exist_ok=True)
-    extract_root = outdir / zip_path.stem
-    if extract_root.exists() and args.force:
-        print(f"Removing existing: {extract_root}")
-        shutil.rmtree(extract_root)
-    elif extract_root.exists():
-        print(f"Destination exists: {extract_root}")
-    print(f"Extracting to: {extract_root}")
-    with zipfile.ZipFile(zip_path, "r") as zf:
-        zf.extractall(extract_root)
+    workers = max(args.workers, 1)
+    if args.index:
+        extract_root = Path(args.index)
+        if not extract_root.is_dir():
+            print(f"Folder not found: {extract_root}")
+            sys.exit(1)
+    else:
+        zip_arg = args.zip_opt or args.zip_path
+        if not zip_arg:
+            print("Missing ZIP path. Use: python setup_roboflow.py ZIP or --zip ZIP")
+            sys.exit(2)
+
+        zip_path = Path(zip_arg)
+        outdir = Path(args.outdir)
+        if not zip_path.exists():
+            print(f"Zip not found: {zip_path}")
+            sys.exit(1)
+
+        outdir.mkdir(parents=True, exist_ok=True)
+        extract_root = outdir / zip_path.stem
+        if extract_root.exists() and args.force:
+            print(f"Removing existing: {extract_root}")
+            shutil.rmtree(extract_root)
+        elif extract_root.exists():
+            print(f"Destination exists: {extract_root}")
+        print(f"Extracting to: {extract_root}")
+        t0 = time.perf_counter()
+        written, unchanged = extract_parallel(zip_path, extract_root, workers)
+        print(f"Extracted {written} file(s), {unchanged} unchanged, in {time.perf_counter() - t0:.1f}s ({workers} thread(s))")
 
     ds_root = find_dataset_root(extract_root)
     print(f"Dataset root: {ds_root}")
-    for split in ["train", "val", "test"]:
-        img_dir = ds_root / "images" / split
-        if img_dir.exists():
-            print(f"{split} images: {count_images(img_dir)} at {img_dir}")
+    t0 = time.perf_counter()
+    manifest, rechecked = build_manifest(ds_root, workers, args.reindex)
+    print(f"Manifest: {ds_root / MANIFEST} ({len(manifest['files'])} image(s), {rechecked} checked, "
+          f"{len(manifest['files']) - rechecked} unchanged, {time.perf_counter() - t0:.1f}s)")
+    print_summary(manifest["summary"], class_names(ds_root))
     print("Done")
 
 if __name__ == "__main__":
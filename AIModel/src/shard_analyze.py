@@ -0,0 +1,236 @@
+import contextlib, copy, glob, json, multiprocessing, os, shutil, socket, sys, threading, time, traceback, uuid, zlib
+from pathlib import Path
+
+import analyze_masks
+from infer_seg import expand_sources
+
+# Layout under <outdir>/shards: plan.json, and per shard NNNN a list file (NNNN.txt), an output
+# folder (NNNN/, a normal analyze_masks --outdir), a log, and while it runs a lock file whose
+# mtime is the owner's heartbeat. NNNN.done / NNNN.failed mark finished shards; NNNN.attempts
+# counts how often it was started. Every node works off the same folder on shared storage.
+PLAN = "plan.json"
+
+def shard_of(unit, shards):
+    """Stable shard index of a source path (same on every node and every run)."""
+    return zlib.crc32(unit.encode("utf-8")) % shards
+
+def list_units(source):
+    """What analyze_masks would process for ``source``: its packed containers if it has any, else its images."""
+    sources = sorted(glob.glob(source)) if "*" in source else [source]
+    packs = []
+    images = expand_sources(sources, packs)
+    return sorted(str(Path(p).resolve()) for p in (packs or images))
+
+def make_plan(root, source, shards):
+    """Write the shard lists once; later runs and other nodes reuse them. Returns the plan."""
+    root.mkdir(parents=True, exist_ok=True)
+    plan_path = root / PLAN
+    if not plan_path.exists():
+        units = list_units(source)
+        lists = [[] for _ in range(shards)]
+        for u in units:
+            lists[shard_of(u, shards)].append(u)
+        for i, items in enumerate(lists):
+            (root / f"{i:04d}.txt").write_text("".join(f"{u}\n" for u in items), encoding="utf-8")
+        plan = {"source": source, "shards": shards, "units": len(units), "sizes": [len(x) for x in lists],
+                "created": time.strftime("%Y-%m-%d %H:%M:%S"), "host": socket.gethostname()}
+        tmp = root / f".{PLAN}.{uuid.uuid4().hex}"
+        tmp.write_text(json.dumps(plan, indent=2), encoding="utf-8")
+        try:
+            os.link(tmp, plan_path)  # fails if another node got there first
+        except FileExistsError:
+            pass
+        finally:
+            tmp.unlink(missing_ok=True)
+    with open(plan_path, "r", encoding="utf-8") as f:
+        plan = json.load(f)
+    # More shards than items leaves some lists empty; analyze_masks rejects those, so they start out done.
+    for i, size in enumerate(plan["sizes"]):
+        if not size and not finished(root, i):
+            (root / f"{i:04d}.done").write_text(json.dumps({"images": 0, "seconds": 0.0, "empty": True}), encoding="utf-8")
+    return plan
+
+def try_claim(lock, stale_after):
+    """Create ``lock`` exclusively; a lock whose heartbeat stopped ``stale_after`` seconds ago is taken over."""
+    try:
+        fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            if time.time() - lock.stat().st_mtime < stale_after:
+                return False
+            stale = lock.with_name(f"{lock.name}.{uuid.uuid4().hex}")
+            os.rename(lock, stale)
+        except FileNotFoundError:  # released or taken over meanwhile
+            return False
+        if time.time() - stale.stat().st_mtime < stale_after:
+            os.rename(stale, lock)  # lost a race: that was a fresh claim, put it back
+            return False
+        stale.unlink(missing_ok=True)
+        return try_claim(lock, stale_after)
+    with os.fdopen(fd, "w") as f:
+        json.dump({"host": socket.gethostname(), "pid": os.getpid(), "claimed": time.time()}, f)
+    return True
+
+def heartbeat(lock, every, stop):
+    while not stop.wait(every):
+        try:
+            os.utime(lock)
+        except FileNotFoundError:
+            return
+
+def finished(root, i):
+    return (root / f"{i:04d}.done").exists() or (root / f"{i:04d}.failed").exists()
+
+def run_shard(root, i, args, model, retries, stale_after):
+    """Run one claimed shard; the lock is released whatever happens."""
+    lock = root / f"{i:04d}.lock"
+    attempts_path = root / f"{i:04d}.attempts"
+    attempts = int(attempts_path.read_text() or 0) + 1 if attempts_path.exists() else 1
+    attempts_path.write_text(str(attempts))
+    if attempts > retries + 1:
+        (root / f"{i:04d}.failed").write_text(json.dumps({"attempts": attempts - 1}), encoding="utf-8")
+        lock.unlink(missing_ok=True)
+        print(f"[{socket.gethostname()}:{os.getpid()}] shard {i:04d} gave up after {attempts - 1} attempt(s)", flush=True)
+        return
+    shard_args = copy.copy(args)
+    shard_args.source = str(root / f"{i:04d}.txt")
+    shard_args.outdir = str(root / f"{i:04d}")
+    if args.metrics_dir:
+        shard_args.metrics_dir = str(Path(args.metrics_dir) / f"{i:04d}")
+    stop = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(lock, max(stale_after / 5, 1), stop), daemon=True)
+    beat.start()
+    t0 = time.perf_counter()
+    log = open(root / f"{i:04d}.log", "a", encoding="utf-8")
+    try:
+        with contextlib.redirect_stdout(log):
+            images = analyze_masks.run(shard_args, model=model)
+        (root / f"{i:04d}.done").write_text(json.dumps({"images": images, "seconds": time.perf_counter() - t0,
+                                                        "host": socket.gethostname(), "attempts": attempts}), encoding="utf-8")
+        print(f"[{socket.gethostname()}:{os.getpid()}] shard {i:04d} done: {images} image(s) in {time.perf_counter() - t0:.1f}s", flush=True)
+    except (Exception, SystemExit) as e:
+        traceback.print_exc(file=log)
+        print(f"[{socket.gethostname()}:{os.getpid()}] shard {i:04d} attempt {attempts} failed: {e!r}", flush=True)
+    finally:
+        log.close()
+        stop.set()
+        beat.join()
+        lock.unlink(missing_ok=True)
+
+def worker(slot, root, args, shards, threads, retries, stale_after, poll):
+    """One process: load the model once, then claim and run shards until none are left anywhere."""
+    if all(finished(root, i) for i in range(shards)):
+        return
+    import torch
+    torch.set_num_threads(threads)
+    from export_seg import load_model
+    model = load_model(args.weights, args.backend)
+    while True:
+        pending = [i for i in range(shards) if not finished(root, i)]
+        if not pending:
+            return
+        # Start at a different shard per worker to keep lock contention low.
+        order = sorted(pending, key=lambda i: (i - slot * shards // max(args.procs, 1)) % shards)
+        for i in order:
+            if not finished(root, i) and try_claim(root / f"{i:04d}.lock", stale_after):
+                if finished(root, i):  # completed between the check and the claim
+                    (root / f"{i:04d}.lock").unlink(missing_ok=True)
+                    continue
+                run_shard(root, i, args, model, retries, stale_after)
+                break
+        else:
+            time.sleep(poll)  # the rest is running elsewhere; take over if an owner goes quiet
+
+def link_or_copy(src, dst):
+    dst.unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def merge_shards(root, outdir, shards, sink):
+    """Gather every shard's output into one analyze_masks output folder; returns the merged image count."""
+    n = 0
+    if sink == "store":
+        from result_store import ResultStore, ResultStoreWriter, is_store
+        with ResultStoreWriter(outdir / "store") as w:
+            for i in range(shards):
+                if is_store(root / f"{i:04d}" / "store"):
+                    for rec in ResultStore(root / f"{i:04d}" / "store").records():
+                        if rec["image"] not in w.done:
+                            w.add(rec)
+                            n += 1
+        return n
+    json_dir = outdir / "json"
+    json_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(shards):
+        for jf in sorted((root / f"{i:04d}" / "json").glob("*.json")):
+            link_or_copy(jf, json_dir / jf.name)
+            n += 1
+    return n
+
+def main():
+    ap = analyze_masks.build_parser()
+    ap.description = "analyze_masks.py split into shards, run by several processes and nodes sharing --outdir."
+    ap.add_argument("--shards", type=int, default=64, help="Number of shards (fixed once the plan exists)")
+    ap.add_argument("--procs", type=int, default=None, help="Worker processes on this node (default: cores / --threads)")
+    ap.add_argument("--threads", type=int, default=1, help="torch threads per worker process")
+    ap.add_argument("--retries", type=int, default=2, help="Restarts of a shard that failed or whose owner died")
+    ap.add_argument("--stale-after", type=float, default=300.0, help="Seconds without a heartbeat before a claimed shard is retried")
+    ap.add_argument("--poll", type=float, default=10.0, help="Seconds between checks while other nodes hold the remaining shards")
+    ap.add_argument("--retry-failed", action="store_true", help="Give shards that used up their retries another round")
+    ap.add_argument("--no-merge", action="store_true", help="Leave merging to another node or a later --merge-only run")
+    ap.add_argument("--merge-only", action="store_true", help="Only merge finished shards")
+    args = ap.parse_args()
+
+    if not args.outdir:
+        print("Sharded runs need a fixed --outdir on the shared storage")
+        sys.exit(2)
+    outdir = Path(args.outdir)
+    root = outdir / "shards"
+    plan = make_plan(root, args.source, args.shards)
+    shards = plan["shards"]
+    if shards != args.shards:
+        print(f"Using the existing plan in {root}: {shards} shard(s)")
+    if args.retry_failed:
+        for i in range(shards):
+            if (root / f"{i:04d}.failed").exists():
+                (root / f"{i:04d}.attempts").unlink(missing_ok=True)
+                (root / f"{i:04d}.failed").unlink(missing_ok=True)
+    args.procs = args.procs or max((os.cpu_count() or 1) // max(args.threads, 1), 1)
+
+    if not args.merge_only:
+        print(f"Sharded analysis: {plan['units']} item(s) in {shards} shard(s), {args.procs} process(es) x {args.threads} thread(s) on {socket.gethostname()}")
+        ctx = multiprocessing.get_context("spawn")
+        procs = [ctx.Process(target=worker, args=(slot, root, args, shards, args.threads, args.retries, args.stale_after, args.poll))
+                 for slot in range(args.procs)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+
+    done = [i for i in range(shards) if (root / f"{i:04d}.done").exists()]
+    failed = [i for i in range(shards) if (root / f"{i:04d}.failed").exists()]
+    print(f"Shards: {len(done)} done, {len(failed)} failed, {shards - len(done) - len(failed)} unfinished")
+    for i in failed:
+        print(f"- shard {i:04d} failed; see {root / f'{i:04d}.log'}")
+    if args.no_merge or len(done) + len(failed) < shards:
+        return
+    try:
+        fd = os.open(root / "merge.lock", os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        print(f"Another node is merging into {outdir} (a leftover {root / 'merge.lock'} from a crash can be deleted)")
+        return
+    os.close(fd)
+    try:
+        n = merge_shards(root, outdir, shards, args.sink)
+    finally:
+        (root / "merge.lock").unlink(missing_ok=True)
+    result_dir = outdir / ("store" if args.sink == "store" else "json")
+    print(f"Merged {n} image(s) into {result_dir}")
+    print(f"Next: python .\\src\\generate_report.py --indir {result_dir}")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
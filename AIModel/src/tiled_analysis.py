@@ -0,0 +1,182 @@
+import sys
+from pathlib import Path
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "CreatingImages"))
+from CreatingPatches import WindowReader, tile_positions
+
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, a):
+        self.parent.setdefault(a, a)
+        while self.parent[a] != a:
+            self.parent[a] = self.parent[self.parent[a]]
+            a = self.parent[a]
+        return a
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+def _tile_instances(res, conf_thr, box):
+    """Confident instances of one tile as (class_id, conf, mask) with masks cropped to the unpadded tile.
+
+    The area filter waits for the stitched instance: a fragment cut by a tile border can be small on its own.
+    """
+    left, top, right, bottom = box
+    if res.masks is None or res.boxes is None:
+        return []
+    masks = res.masks.data.cpu().numpy() > 0.5
+    masks = masks[:, :bottom - top, :right - left]
+    confs = res.boxes.conf.cpu().numpy()
+    clss = res.boxes.cls.cpu().numpy().astype(int)
+    areas = masks.reshape(len(masks), -1).sum(axis=1)
+    keep = (confs >= conf_thr) & (areas > 0)
+    return [(int(clss[i]), float(confs[i]), masks[i]) for i in np.flatnonzero(keep)]
+
+def _overlap(a, b):
+    l, t = max(a[0], b[0]), max(a[1], b[1])
+    r, btm = min(a[2], b[2]), min(a[3], b[3])
+    return (l, t, r, btm) if l < r and t < btm else None
+
+def _owned_ranges(positions, size, length):
+    # Split every overlap at its midpoint so each pixel is counted by exactly one tile.
+    starts = [0] + [(p + min(prev + size, length)) // 2 for prev, p in zip(positions, positions[1:])]
+    return list(zip(starts, starts[1:] + [length]))
+
+def analyze_tiled(model, image_path, names, tile_size, stride=None, conf=0.5, min_area_frac=0.01, imgsz=1280,
+                  merge_iou=0.5, max_memory_mb=None):
+    """Tile one large image in memory, run the model per tile row and stitch the results.
+
+    Same-class instances from neighbouring tiles are merged when their masks agree
+    (IoU >= merge_iou) inside the shared overlap; this needs a non-zero overlap.
+    ``min_area_frac`` applies to the merged instance's area over the whole image.
+    Coverage is accumulated in a rolling band of one tile row holding, per pixel and
+    class, the set of instances covering it; a pixel counts once any of them survives
+    the area filter. Memory scales with image width rather than area.
+    """
+    tw, th = tile_size
+    sx, sy = stride or tile_size
+    if min(sx, sy) <= 0:
+        raise ValueError(f"invalid tile stride {sx}x{sy}: the overlap must be smaller than the tile")
+    reader = WindowReader(Path(image_path), max_memory_mb=max_memory_mb)
+    iw, ih = reader.size
+    lefts = list(tile_positions(iw, tw, sx))
+    tops = list(tile_positions(ih, th, sy))
+    owned_x = _owned_ranges(lefts, tw, iw)
+    owned_y = _owned_ranges(tops, th, ih)
+    # One band per class seen so far, covering the current tile row: each pixel holds the id
+    # of the set of instances covering it (-1 = none), interned in cover_sets.
+    bands = {}
+    band_top = 0
+    cover_sets, cover_ids = [], {}
+    pixels = {}  # cover set id -> band pixels flushed with that set
+
+    def cover_id(members):
+        if members not in cover_ids:
+            cover_ids[members] = len(cover_sets)
+            cover_sets.append(members)
+        return cover_ids[members]
+
+    def flush(upto):
+        for band in bands.values():
+            ids, counts = np.unique(band[:upto - band_top], return_counts=True)
+            for i, n in zip(ids.tolist(), counts.tolist()):
+                if i >= 0:
+                    pixels[i] = pixels.get(i, 0) + n
+
+    uf = UnionFind()
+    instances = []
+    prev_row = []
+    ntiles = 0
+    for row, top in enumerate(tops):
+        bottom = min(top + th, ih)
+        if top > band_top:
+            flush(top)
+            shift = min(top - band_top, th)
+            for band in bands.values():
+                band[:th - shift] = band[shift:]
+                band[th - shift:] = -1
+            band_top = top
+        strip = reader.read((0, top, iw, bottom))
+        tiles = []
+        for left in lefts:
+            tile = strip.crop((left, 0, min(left + tw, iw), bottom - top))
+            if tile.size != (tw, th):
+                padded = Image.new("RGB", (tw, th))
+                padded.paste(tile, (0, 0))
+                tile = padded
+            tiles.append(tile)
+        cur_row = []
+        oy0, oy1 = owned_y[row]
+        for col, (left, res) in enumerate(zip(lefts, model(tiles, conf=conf, imgsz=imgsz, retina_masks=True, stream=True, verbose=False))):
+            box = (left, top, min(left + tw, iw), bottom)
+            ox0, ox1 = owned_x[col]
+            kept = []
+            for cls_id, score, mask in _tile_instances(res, conf, box):
+                key = len(instances)
+                owned = mask[oy0 - top:oy1 - top, ox0 - left:ox1 - left]
+                instances.append({"class_id": cls_id, "conf": score, "area": int(np.count_nonzero(owned))})
+                if cls_id not in bands:
+                    bands[cls_id] = np.full((th, iw), -1, dtype=np.int32)
+                region = bands[cls_id][top - band_top:bottom - band_top, box[0]:box[2]]
+                ids, inverse = np.unique(region[mask], return_inverse=True)
+                grown = [cover_id((cover_sets[i] if i >= 0 else frozenset()) | {key}) for i in ids.tolist()]
+                region[mask] = np.asarray(grown, dtype=np.int32)[inverse]
+                kept.append((key, cls_id, mask))
+            ntiles += 1
+            neighbours = ([cur_row[-1]] if cur_row else []) + [t for t in prev_row if _overlap(t[0], box)]
+            for nbox, nkept in neighbours:
+                ov = _overlap(nbox, box)
+                if ov is None:
+                    continue
+                l, t, r, b = ov
+                for key, cls_id, mask in kept:
+                    a = mask[t - box[1]:b - box[1], l - box[0]:r - box[0]]
+                    for nkey, ncls_id, nmask in nkept:
+                        if ncls_id != cls_id:
+                            continue
+                        o = nmask[t - nbox[1]:b - nbox[1], l - nbox[0]:r - nbox[0]]
+                        inter = int(np.count_nonzero(a & o))
+                        union = int(np.count_nonzero(a | o))
+                        if inter and inter / union >= merge_iou:
+                            uf.union(key, nkey)
+            cur_row.append((box, kept))
+        # Only the previous tile row can still overlap upcoming tiles; older masks are dropped.
+        prev_row = cur_row
+    flush(ih)
+    reader.close()
+
+    groups = {}
+    for key, inst in enumerate(instances):
+        g = groups.setdefault(uf.find(key), {"class_id": inst["class_id"], "conf": 0.0, "area": 0, "tiles": 0})
+        g["conf"] = max(g["conf"], inst["conf"])
+        g["area"] += inst["area"]
+        g["tiles"] += 1
+    img_area = float(iw * ih)
+    kept_groups = {root for root, g in groups.items() if g["area"] / img_area >= min_area_frac}
+    covered = {}
+    for i, n in pixels.items():
+        if any(uf.find(key) in kept_groups for key in cover_sets[i]):
+            c = instances[next(iter(cover_sets[i]))]["class_id"]
+            covered[c] = covered.get(c, 0) + n
+    segments = [{
+        "class_id": g["class_id"],
+        "class_name": names.get(g["class_id"], str(g["class_id"])),
+        "conf": g["conf"],
+        "area_pixels": g["area"],
+        "area_frac": g["area"] / img_area,
+        "tiles": g["tiles"]
+    } for root, g in groups.items() if root in kept_groups and g["area"]]  # unmerged copies lying wholly in a neighbour's share are dropped
+    coverage = {names.get(c, str(c)): covered[c] / img_area for c in sorted(covered) if covered[c]}
+    return {
+        "height": ih,
+        "width": iw,
+        "segments_kept": segments,
+        "coverage": coverage,
+        "tiling": {"tile_width": tw, "tile_height": th, "stride_x": sx, "stride_y": sy, "tiles": ntiles}
+    }
@@ -0,0 +1,234 @@
+import argparse, hashlib, math, os, pickle, shutil, sys, tempfile, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import cv2
+import numpy as np
+from ultralytics.data.dataset import YOLODataset
+from result_cache import file_digest
+
+# Bump when the image layout or the stored label format changes.
+CACHE_VERSION = 1
+INDEX = "index.pkl"
+
+def split_dir(cache_dir, img_path, imgsz):
+    """Cache folder of one split (the image path from the data YAML) at one imgsz."""
+    return Path(cache_dir) / f"{hashlib.sha256(str(img_path).encode('utf-8')).hexdigest()[:12]}_{imgsz}"
+
+def read_index(path):
+    p = Path(path) / INDEX
+    if not p.exists():
+        return None
+    with open(p, "rb") as f:
+        index = pickle.load(f)
+    return index if index.get("version") == CACHE_VERSION else None
+
+def resize_long_side(im, imgsz):
+    """What ultralytics' BaseDataset.load_image does before augmentation: long side to imgsz, aspect kept."""
+    h0, w0 = im.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz)
+        im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+    return im
+
+def build_split(data, split, imgsz, cache_dir, workers=4):
+    """Decode one split once into <cache folder>/images_<token>.npy and write its index; returns (folder, built, reused).
+
+    Every image sits in the top-left corner of a zero-padded imgsz x imgsz slot of one uint8
+    memmap; the index holds the per-slot shapes and the labels ultralytics parsed from the
+    polygon files. Slots are keyed on the image and label file contents, so a rebuild only
+    decodes new or changed images and copies the rest from the previous cache.
+    """
+    from ultralytics.data.utils import img2label_paths
+    from ultralytics.utils.patches import imread
+    img_path = data[split]
+    out = split_dir(cache_dir, img_path, imgsz)
+    out.mkdir(parents=True, exist_ok=True)
+    # Lists the images and verifies / parses their labels (ultralytics keeps its own labels.cache for that).
+    labels = YOLODataset(img_path=img_path, imgsz=imgsz, augment=False, data=data, task="segment").labels
+    files = [lb["im_file"] for lb in labels]
+    label_files = img2label_paths(files)
+
+    def digest(i):
+        lf = Path(label_files[i])
+        return f"{file_digest(files[i])}:{file_digest(lf) if lf.exists() else ''}"
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        digests = list(pool.map(digest, range(len(files))))
+    old = read_index(out)
+    if old is not None and old["imgsz"] == imgsz and old["digests"] == digests and (out / old["images"]).exists():
+        return out, 0, len(files)
+
+    name = f"images_{uuid.uuid4().hex[:8]}.npy"
+    ims = np.lib.format.open_memmap(out / f"{name}.tmp", mode="w+", dtype=np.uint8, shape=(len(files), imgsz, imgsz, 3))
+    hw0 = np.zeros((len(files), 2), np.int32)
+    hw = np.zeros((len(files), 2), np.int32)
+    previous = {}
+    if old is not None and old["imgsz"] == imgsz and (out / old["images"]).exists():
+        old_ims = np.load(out / old["images"], mmap_mode="r")
+        previous = {d: i for i, d in enumerate(old["digests"])}
+
+    def fill(i):
+        j = previous.get(digests[i])
+        if j is not None:
+            ims[i] = old_ims[j]
+            hw0[i], hw[i] = old["hw0"][j], old["hw"][j]
+            return False
+        im = imread(files[i], flags=cv2.IMREAD_COLOR)
+        if im is None:
+            raise FileNotFoundError(f"Image Not Found {files[i]}")
+        hw0[i] = im.shape[:2]
+        im = resize_long_side(im, imgsz)
+        hw[i] = im.shape[:2]
+        ims[i, :im.shape[0], :im.shape[1]] = im
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:  # cv2 decode and resize release the GIL
+        decoded = sum(pool.map(fill, range(len(files))))
+    ims.flush()
+    del ims
+    os.replace(out / f"{name}.tmp", out / name)
+    index = {"version": CACHE_VERSION, "imgsz": imgsz, "img_path": str(img_path), "images": name,
+             "files": files, "digests": digests, "hw0": hw0, "hw": hw, "labels": labels}
+    tmp = out / f".{INDEX}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, out / INDEX)  # the index names the images file, so readers never see a half-written pair
+    if old is not None and old["images"] != name:
+        (out / old["images"]).unlink(missing_ok=True)
+    return out, decoded, len(files) - decoded
+
+def build_cache(data_yaml, imgsz, cache_dir, workers=4, splits=("train", "val")):
+    """Build or refresh the cache of every split; returns {image path from the YAML: cache folder}."""
+    from ultralytics.data.utils import check_det_dataset
+    data = check_det_dataset(str(data_yaml))
+    folders = {}
+    for split in splits:
+        if not data.get(split):
+            continue
+        t0 = time.perf_counter()
+        out, decoded, reused = build_split(data, split, imgsz, cache_dir, workers)
+        size = sum(p.stat().st_size for p in out.glob("*") if p.is_file())
+        print(f"- cache {split}: {out} ({decoded} decoded, {reused} reused, {size / 1048576:.1f} MB, {time.perf_counter() - t0:.1f}s)")
+        folders[str(data[split])] = out
+    return folders
+
+class CachedSegDataset(YOLODataset):
+    """YOLODataset reading pre-decoded images and pre-parsed labels from a build_split cache."""
+
+    def __init__(self, *args, cache_path, **kwargs):
+        self.cache_path = Path(cache_path)
+        self.index = read_index(self.cache_path)
+        self._ims = None
+        super().__init__(*args, **kwargs)
+
+    def __getstate__(self):  # dataloader workers open their own memmap instead of receiving a copy
+        state = self.__dict__.copy()
+        state["_ims"] = None
+        return state
+
+    @property
+    def cached_images(self):
+        if self._ims is None:
+            self._ims = np.load(self.cache_path / self.index["images"], mmap_mode="r")
+        return self._ims
+
+    def get_labels(self):
+        self.im_files = list(self.index["files"])
+        return [dict(lb) for lb in self.index["labels"]]
+
+    def load_image(self, i, rect_mode=True, resize_short=False):
+        if not rect_mode or resize_short:
+            return super().load_image(i, rect_mode, resize_short)
+        h, w = (int(v) for v in self.index["hw"][i])
+        im = np.array(self.cached_images[i, :h, :w])  # augmentations write into it
+        # Mosaic draws its partners from this buffer. Uncached datasets only add an image when it is
+        # decoded, i.e. not already held, so a buffered index is not appended again.
+        if self.augment and i not in self.buffer:
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                self.buffer.pop(0)
+        return im, tuple(int(v) for v in self.index["hw0"][i]), (h, w)
+
+def cached_trainer(folders, imgsz):
+    """SegmentationTrainer that reads the splits in ``folders`` from their caches; other splits load as usual."""
+    from ultralytics.models.yolo.segment import SegmentationTrainer
+    from ultralytics.utils import colorstr
+    from ultralytics.utils.torch_utils import unwrap_model
+
+    class CachedSegmentationTrainer(SegmentationTrainer):
+        def build_dataset(self, img_path, mode="train", batch=None):
+            folder = folders.get(str(img_path))
+            if folder is None or self.args.imgsz != imgsz:
+                return super().build_dataset(img_path, mode, batch)
+            gs = max(int(unwrap_model(self.model).stride.max()), 32)
+            return CachedSegDataset(cache_path=folder, img_path=img_path, imgsz=self.args.imgsz, batch_size=batch,
+                                    augment=mode == "train", hyp=self.args, rect=self.args.rect or mode == "val", cache=None,
+                                    single_cls=self.args.single_cls or False, stride=gs, pad=0.0 if mode == "train" else 0.5,
+                                    prefix=colorstr(f"{mode}: "), task="segment", classes=self.args.classes, data=self.data)
+
+    return CachedSegmentationTrainer
+
+class EpochTimer:
+    """Wall time of each epoch's training loop (validation excluded), via ultralytics callbacks."""
+
+    def __init__(self, model):
+        self.times = []
+        self._t0 = None
+        model.add_callback("on_train_epoch_start", self.start)
+        model.add_callback("on_train_epoch_end", self.end)
+
+    def start(self, trainer):
+        self._t0 = time.perf_counter()
+
+    def end(self, trainer):
+        if self._t0 is not None:
+            self.times.append(time.perf_counter() - self._t0)
+
+    def summary(self):
+        if not self.times:
+            return "no epochs"
+        steady = self.times[1:] or self.times  # the first epoch also pays for warm-up
+        return f"{np.mean(steady):.1f}s mean ({len(self.times)} epoch(s), first {self.times[0]:.1f}s)"
+
+def bench(args, folders):
+    """Train --bench-epochs epochs from the JPEGs and from the cache and compare epoch times."""
+    from ultralytics import YOLO
+    rows = []
+    with tempfile.TemporaryDirectory() as project:
+        for label, trainer in (("decode", None), ("cache", cached_trainer(folders, args.imgsz))):
+            model = YOLO(args.model)
+            timer = EpochTimer(model)
+            model.train(data=str(args.data), epochs=args.bench_epochs, imgsz=args.imgsz, batch=args.batch, device=args.device,
+                        workers=args.workers, project=project, name=label, val=False, plots=False, trainer=trainer, verbose=False)
+            rows.append((label, timer))
+    base = np.mean(rows[0][1].times[1:] or rows[0][1].times)
+    print("| Dataset | Epoch time | Speedup |\n|---|---|---:|")
+    for label, timer in rows:
+        mean = np.mean(timer.times[1:] or timer.times)
+        print(f"| {label} | {timer.summary()} | {base / mean if mean else 0.0:.2f}x |")
+
+def main():
+    ap = argparse.ArgumentParser(description="Decode a segmentation dataset once into a memory-mapped cache for train_seg.py --cache.")
+    ap.add_argument("--data", required=True)
+    ap.add_argument("--imgsz", type=int, default=640, help="Must match train_seg.py --imgsz")
+    ap.add_argument("--cache-dir", default="cache/train_seg")
+    ap.add_argument("--workers", type=int, default=4, help="Threads decoding images (and dataloader workers in --bench-epochs)")
+    ap.add_argument("--clear", action="store_true", help="Delete the cache folder first")
+    ap.add_argument("--bench-epochs", type=int, default=0, help="Then train this many epochs with and without the cache and compare epoch times")
+    ap.add_argument("--model", default="yolov8n-seg.pt", help="Model for --bench-epochs")
+    ap.add_argument("--batch", type=int, default=8)
+    ap.add_argument("--device", default="")
+    args = ap.parse_args()
+
+    if not Path(args.data).exists():
+        print(f"Data YAML not found: {args.data}")
+        sys.exit(2)
+    if args.clear:
+        shutil.rmtree(args.cache_dir, ignore_errors=True)
+    folders = build_cache(args.data, args.imgsz, args.cache_dir, args.workers)
+    if args.bench_epochs:
+        bench(args, folders)
+
+if __name__ == "__main__":
+    main()
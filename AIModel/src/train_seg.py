@@ -1,6 +1,8 @@
 import argparse, sys
 from pathlib import Path
 from ultralytics import YOLO
+from export_seg import BACKENDS, export_weights
+from train_cache import EpochTimer, build_cache, cached_trainer
 
 def main():
     ap = argparse.ArgumentParser()
@@ -13,6 +15,12 @@ def main():
     ap.add_argument("--project", default="runs")
     ap.add_argument("--name", default=None)
     ap.add_argument("--patience", type=int, default=50)
+    ap.add_argument("--export", nargs="+", default=[], choices=[b for b in BACKENDS if b != "torch"],
+                    help="Export best.pt for these CPU backends after training (INT8 is calibrated on the val split)")
+    ap.add_argument("--cached", action="store_true",
+                    help="Decode the dataset once into --cache-dir (refreshed when files change) and train from that memmap")
+    ap.add_argument("--cache-dir", default="cache/train_seg")
+    ap.add_argument("--cache-workers", type=int, default=4, help="Threads decoding images into the cache")
     args = ap.parse_args()
 
     data_yaml = Path(args.data)
@@ -40,6 +48,10 @@ def main():
     print(f"- device: {args.device}")
     print(f"- out:    {args.project} / {args.name or '(auto)'}")
     print(f"- patience: {args.patience}")
+    trainer = None
+    if args.cached:
+        print(f"- cache:  {args.cache_dir}")
+        trainer = cached_trainer(build_cache(data_yaml, args.imgsz, args.cache_dir, args.cache_workers), args.imgsz)
 
     try:
         model = YOLO(model_arg)
@@ -51,6 +63,7 @@ def main():
             except Exception as de:
                 print(f"Cleanup failed: {de}")
         raise
+    timer = EpochTimer(model)
 
     r = model.train(
         data=str(data_yaml),
@@ -60,7 +73,8 @@ def main():
         device=args.device,
         project=args.project,
         name=args.name,
-        patience=args.patience
+        patience=args.patience,
+        trainer=trainer
     )
 
     save_dir = Path(r.save_dir)
@@ -69,6 +83,10 @@ def main():
     print("Training done")
     print(f"- best: {best if best.exists() else '(missing)'}")
     print(f"- last: {last if last.exists() else '(missing)'}")
+    print(f"- epoch time: {timer.summary()}{' (cached dataset)' if args.cached else ''}")
+    if args.export and best.exists():
+        for backend in args.export:
+            print(f"- {backend}: {export_weights(best, backend, args.imgsz, data_yaml)}")
 
 if __name__ == "__main__":
     main()
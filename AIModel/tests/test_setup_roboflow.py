@@ -0,0 +1,37 @@
+import sys, zipfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+import setup_roboflow
+
+def make_zip(path, folders=40, files=5):
+    with zipfile.ZipFile(path, "w") as zf:
+        for d in range(folders):
+            for f in range(files):
+                zf.writestr(f"ds/split_{d % 3}/images/sub_{d}/img_{f}.txt", f"{d}-{f}\n" * (f + 1))
+        zf.writestr("ds/data.yaml", "names: [bare-soil, building, grass, tree, water]\n")
+        zf.writestr("ds/empty_dir/", "")
+    return path
+
+def test_extract_into_empty_dir(tmp_path):
+    zip_path = make_zip(tmp_path / "ds.zip")
+    for run in range(5):  # the folder race only showed on some runs
+        dest = tmp_path / f"out_{run}"
+        written, unchanged = setup_roboflow.extract_parallel(zip_path, dest, 16)
+        assert (written, unchanged) == (201, 0)
+        assert (dest / "ds" / "empty_dir").is_dir()
+        with zipfile.ZipFile(zip_path) as zf:
+            for m in zf.infolist():
+                if not m.is_dir():
+                    assert (dest / m.filename).read_bytes() == zf.read(m)
+    # A re-run leaves every file alone.
+    assert setup_roboflow.extract_parallel(zip_path, dest, 16) == (0, 201)
+
+def test_member_outside_dest_is_refused(tmp_path):
+    with zipfile.ZipFile(tmp_path / "bad.zip", "w") as zf:
+        zf.writestr("../escape.txt", "x")
+    with pytest.raises(ValueError):
+        setup_roboflow.extract_parallel(tmp_path / "bad.zip", tmp_path / "out", 2)
+    assert not (tmp_path / "escape.txt").exists()
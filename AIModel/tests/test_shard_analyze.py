@@ -0,0 +1,41 @@
+import json, sys
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+import shard_analyze
+
+def make_images(folder, n):
+    folder.mkdir(parents=True)
+    for i in range(n):
+        Image.new("RGB", (64, 48), (40 * i, 120, 60)).save(folder / f"img_{i}.png")
+
+def test_empty_shards_are_done_at_planning(tmp_path):
+    make_images(tmp_path / "images", 3)
+    root = tmp_path / "out" / "shards"
+    plan = shard_analyze.make_plan(root, str(tmp_path / "images"), 8)
+    assert plan["units"] == 3 and sum(plan["sizes"]) == 3
+    for i, size in enumerate(plan["sizes"]):
+        listed = (root / f"{i:04d}.txt").read_text(encoding="utf-8").split()
+        assert len(listed) == size
+        assert shard_analyze.finished(root, i) == (size == 0)
+        if not size:
+            assert json.loads((root / f"{i:04d}.done").read_text(encoding="utf-8"))["images"] == 0
+    # A second node reading the existing plan leaves the markers as they are.
+    assert shard_analyze.make_plan(root, str(tmp_path / "images"), 8) == plan
+
+def test_more_shards_than_images(tmp_path, monkeypatch):
+    YOLO = pytest.importorskip("ultralytics").YOLO
+    monkeypatch.setenv("YOLO_CONFIG_DIR", str(tmp_path / "ultralytics"))
+    weights = tmp_path / "rand.pt"
+    YOLO("yolov8n-seg.yaml").save(weights)  # untrained, only the sharding is under test
+    make_images(tmp_path / "images", 3)
+    outdir = tmp_path / "out"
+    monkeypatch.setattr(sys, "argv", ["shard_analyze.py", "--weights", str(weights), "--source", str(tmp_path / "images"),
+                                      "--outdir", str(outdir), "--imgsz", "64", "--shards", "8", "--procs", "1", "--poll", "0.1"])
+    shard_analyze.main()  # exits with 1 if any shard failed
+    root = outdir / "shards"
+    assert not list(root.glob("*.failed"))
+    assert sorted(p.name for p in (outdir / "json").glob("*.json")) == ["img_0.json", "img_1.json", "img_2.json"]
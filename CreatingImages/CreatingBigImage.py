@@ -1,10 +1,90 @@
 from PIL import Image
-import argparse, sys, re
+import argparse, json, struct, sys, re
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
 from pathlib import Path
+import numpy as np
+from PatchPack import PACK_EXT, PatchPack
+from MaskCodec import label_raster, palette
 
 IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
 
-def merge_patches(patch_dir: Path, output_path: Path, patch_size=None, prefix="patch"):
+class StripTiffWriter:
+    """Writes an uncompressed RGB TIFF row by row; switches to BigTIFF past 4 GB."""
+
+    def __init__(self, path: Path, width, height, rows_per_strip=16):
+        self.path = Path(path)
+        self.width, self.height = width, height
+        self.rows_per_strip = rows_per_strip
+        self.big = width * height * 3 > 0xFFFF0000
+        self.f = open(self.path, "wb")
+        self.f.write(b"II+\x00" + struct.pack("<HHQ", 8, 0, 0) if self.big else b"II*\x00" + struct.pack("<I", 0))
+        self.offsets, self.counts = [], []
+        self.pending = []
+        self.rows = 0
+
+    def write_rows(self, rows):
+        self.pending.append(np.ascontiguousarray(rows, dtype=np.uint8))
+        self.rows += len(rows)
+        buffered = sum(len(r) for r in self.pending)
+        if buffered >= self.rows_per_strip:
+            data = np.concatenate(self.pending)
+            n = buffered - buffered % self.rows_per_strip
+            for i in range(0, n, self.rows_per_strip):
+                self._strip(data[i:i + self.rows_per_strip])
+            self.pending = [data[n:]] if n < buffered else []
+
+    def _strip(self, rows):
+        self.offsets.append(self.f.tell())
+        self.counts.append(rows.nbytes)
+        self.f.write(rows.tobytes())
+
+    def close(self):
+        if self.pending:
+            self._strip(np.concatenate(self.pending))
+        if self.rows != self.height:
+            raise ValueError(f"{self.path}: wrote {self.rows} rows, expected {self.height}")
+        long_t = 16 if self.big else 4
+        entries = [(256, 4, [self.width]), (257, 4, [self.height]), (258, 3, [8, 8, 8]), (259, 3, [1]),
+                   (262, 3, [2]), (273, long_t, self.offsets), (277, 3, [3]), (278, 4, [self.rows_per_strip]),
+                   (279, long_t, self.counts), (284, 3, [1])]
+        fmt = {3: "H", 4: "I", 16: "Q"}
+        cnt, ent, off, inline = ("Q", "<HHQ", "Q", 8) if self.big else ("H", "<HHI", "I", 4)
+        ifd_at = self.f.tell()
+        ifd_size = struct.calcsize("<" + cnt) + len(entries) * (struct.calcsize(ent) + inline) + inline
+        extra_at = ifd_at + ifd_size + (ifd_size & 1)
+        table, extra = b"", b""
+        for tag, typ, values in entries:
+            payload = struct.pack(f"<{len(values)}{fmt[typ]}", *values)
+            table += struct.pack(ent, tag, typ, len(values))
+            if len(payload) <= inline:
+                table += payload.ljust(inline, b"\x00")
+            else:
+                table += struct.pack("<" + off, extra_at + len(extra))
+                extra += payload + b"\x00" * (len(payload) & 1)
+        self.f.write(struct.pack("<" + cnt, len(entries)) + table + struct.pack("<" + off, 0))
+        self.f.write(b"\x00" * (ifd_size & 1) + extra)
+        self.f.seek(8 if self.big else 4)
+        self.f.write(struct.pack("<" + off, ifd_at))
+        self.f.close()
+
+def _ramp(length, lead, trail):
+    # Linear feather over the overlap on each side that has a neighbour; 1 elsewhere.
+    x = np.arange(length, dtype=np.float32) + 0.5
+    w = np.ones(length, dtype=np.float32)
+    if lead:
+        w = np.minimum(w, x / lead)
+    if trail:
+        w = np.minimum(w, (length - x) / trail)
+    return w
+
+def _patch_source(patch_dir: Path, prefix="patch"):
+    """Return (coords, open_patch, meta) for a folder of patch files or a packed container."""
+    if patch_dir.is_file() and patch_dir.suffix.lower() == PACK_EXT:
+        pack = PatchPack(patch_dir)
+        coords = [(int(e["top"]), int(e["left"]), i) for i, e in enumerate(pack.index)]
+        return coords, pack.open, pack.meta
+
     files = [p for p in patch_dir.iterdir() if p.is_file() and p.suffix.lower() in IMG_EXTS]
     if not files:
         print("No patch files found in the given directory.")
@@ -24,9 +104,171 @@ def merge_patches(patch_dir: Path, output_path: Path, patch_size=None, prefix="p
         print("No valid patch filenames found (expected 'patch_<id>_<top>_<left>.<ext>').")
         sys.exit(1)
 
+    meta = {}
+    layout = patch_dir / f"{prefix}_layout.json"
+    if layout.exists():
+        with open(layout, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    return coords, Image.open, meta
+
+def _load_patch(open_patch, key):
+    with open_patch(key) as im:
+        return np.asarray(im.convert("RGB"))
+
+def merge_patches_streaming(patch_dir: Path, output_path: Path, patch_size=None, prefix="patch", size=None, workers=None, blend=True):
+    """Assemble patches into a strip TIFF one patch row at a time.
+
+    Memory holds one band of patch-row height across the mosaic width. Overlapping
+    patches are feathered together, and the output is cropped to the source size taken
+    from ``size`` or the ``<prefix>_layout.json`` written by CreatingPatches.
+    """
+    coords, open_patch, meta = _patch_source(patch_dir, prefix)
+    coords.sort(key=lambda c: (c[0], c[1]))
+
+    if patch_size is None:
+        with open_patch(coords[0][2]) as im0:
+            pw, ph = im0.size
+    else:
+        pw, ph = patch_size
+    if size is None and "width" in meta:
+        size = (meta["width"], meta["height"])
+    out_w = min(size[0], max(c[1] for c in coords) + pw) if size else max(c[1] for c in coords) + pw
+    out_h = min(size[1], max(c[0] for c in coords) + ph) if size else max(c[0] for c in coords) + ph
+
+    rows = [(top, list(grp)) for top, grp in groupby(coords, key=lambda c: c[0])]
+    lefts = sorted({c[1] for c in coords})
+    ov_x = max([0] + [pw - (b - a) for a, b in zip(lefts, lefts[1:])]) if blend else 0
+    ov_y = max([0] + [ph - (b[0] - a[0]) for a, b in zip(rows, rows[1:])]) if blend else 0
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    writer = StripTiffWriter(output_path, out_w, out_h)
+    acc = np.zeros((ph, out_w, 3), dtype=np.float32)
+    wsum = np.zeros((ph, out_w), dtype=np.float32)
+    band_top = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        nxt = [pool.submit(_load_patch, open_patch, fp) for _, _, fp in rows[0][1]]
+        for r, (top, row) in enumerate(rows):
+            cur, nxt = nxt, ([pool.submit(_load_patch, open_patch, fp) for _, _, fp in rows[r + 1][1]] if r + 1 < len(rows) else [])
+            if top > band_top:
+                # Rows above this patch row are final; emit them and slide the band down.
+                done = min(top, out_h) - band_top
+                if done > 0:
+                    writer.write_rows(np.rint(acc[:done] / np.maximum(wsum[:done], 1e-6)[..., None]).astype(np.uint8))
+                shift = min(top - band_top, ph)
+                acc[:ph - shift], wsum[:ph - shift] = acc[shift:], wsum[shift:]
+                acc[ph - shift:], wsum[ph - shift:] = 0, 0
+                band_top = top
+            if top >= out_h:
+                continue
+            wy = _ramp(ph, ov_y if r > 0 else 0, ov_y if r + 1 < len(rows) else 0)
+            for (_, left, fp), fut in zip(row, cur):
+                if left >= out_w:
+                    continue
+                patch = fut.result()[:, :, :3]
+                h, w = min(patch.shape[0], out_h - top), min(patch.shape[1], out_w - left)
+                first, last = left == lefts[0], left == lefts[-1]
+                wt = (wy[:, None] * _ramp(patch.shape[1], 0 if first else ov_x, 0 if last else ov_x)[None, :])[:h, :w]
+                if blend:
+                    acc[:h, left:left + w] += patch[:h, :w] * wt[..., None]
+                    wsum[:h, left:left + w] += wt
+                else:
+                    acc[:h, left:left + w] = patch[:h, :w]
+                    wsum[:h, left:left + w] = 1
+        done = out_h - band_top
+        writer.write_rows(np.rint(acc[:done] / np.maximum(wsum[:done], 1e-6)[..., None]).astype(np.uint8))
+    writer.close()
+    print(f"Reconstructed image saved: {output_path} (size {out_w}x{out_h}, from {len(coords)} patches, streamed)")
+
+def _coverage_source(results: Path, prefix="patch"):
+    """(top, left, load record) of every patch in an analyze_masks json/ folder or result store."""
+    if (results / "manifest.json").is_file():
+        sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "AIModel" / "src"))
+        from result_store import ResultStore
+        items = [(rec["image"], lambda rec=rec: rec) for rec in ResultStore(results).records()]
+    else:
+        items = [(jf.name, lambda jf=jf: json.loads(jf.read_text(encoding="utf-8"))) for jf in results.glob("*.json")]
+    pattern = re.compile(rf"{re.escape(prefix)}_\d+_(\d+)_(\d+)", re.IGNORECASE)
+    coords = []
+    for name, load in items:
+        m = pattern.search(Path(name).stem)
+        if m:
+            coords.append((int(m.group(1)), int(m.group(2)), load))
+    if not coords:
+        print(f"No results for patches named '{prefix}_<id>_<top>_<left>' in {results}")
+        sys.exit(1)
+    return coords
+
+def merge_coverage_streaming(results: Path, output_path: Path, prefix="patch", size=None, workers=None):
+    """Mosaic the coverage of every patch from the masks stored by analyze_masks --store-masks.
+
+    Each patch record is rasterized at its full resolution and painted at its (top, left);
+    in overlaps any class beats background and lower class ids beat higher ones. The TIFF
+    is streamed one patch row at a time like merge_patches_streaming. Returns the covered
+    pixels per class id.
+    """
+    coords = _coverage_source(results, prefix)
+    coords.sort(key=lambda c: (c[0], c[1]))
+    rows = [(top, list(grp)) for top, grp in groupby(coords, key=lambda c: c[0])]
+
+    def render(item):
+        top, left, load = item
+        rec = load()
+        return rec, label_raster(rec)
+
+    pal = palette()
+    counts = np.zeros(256, dtype=np.int64)
+    writer = None
+    band = band_top = None
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        nxt = [pool.submit(render, c) for c in rows[0][1]]
+        for r, (top, row) in enumerate(rows):
+            cur, nxt = nxt, ([pool.submit(render, c) for c in rows[r + 1][1]] if r + 1 < len(rows) else [])
+            patches = [f.result() for f in cur]
+            if writer is None:
+                # Patch sizes come from the records, so the mosaic size is known once the first row is in.
+                ph = max(rec["height"] for rec, _ in patches)
+                pw = max(rec["width"] for rec, _ in patches)
+                out_w = max(c[1] for c in coords) + pw
+                out_h = max(c[0] for c in coords) + ph
+                if size:
+                    out_w, out_h = min(size[0], out_w), min(size[1], out_h)
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+                writer = StripTiffWriter(output_path, out_w, out_h)
+                band = np.zeros((ph, out_w), dtype=np.uint8)
+                band_top = 0
+            if top > band_top:
+                done = min(top, out_h) - band_top
+                if done > 0:
+                    counts += np.bincount(band[:done].ravel(), minlength=256)
+                    writer.write_rows(pal[band[:done]])
+                shift = min(top - band_top, ph)
+                band[:ph - shift] = band[shift:]
+                band[ph - shift:] = 0
+                band_top = top
+            if top >= out_h:
+                continue
+            for (_, left, _), (_, lab) in zip(row, patches):
+                if left >= out_w:
+                    continue
+                lab = lab[:min(lab.shape[0], ph, out_h - top), :out_w - left]
+                dst = band[:lab.shape[0], left:left + lab.shape[1]]
+                np.copyto(dst, lab, where=(lab > 0) & ((dst == 0) | (lab < dst)))
+        done = out_h - band_top
+        counts += np.bincount(band[:done].ravel(), minlength=256)
+        writer.write_rows(pal[band[:done]])
+    writer.close()
+    print(f"Coverage mosaic saved: {output_path} (size {out_w}x{out_h}, from {len(coords)} patch results)")
+    covered = {cid - 1: int(n) for cid, n in enumerate(counts) if cid and n}
+    for cid, n in covered.items():
+        print(f"- class {cid}: {n} px ({100.0 * n / (out_w * out_h):.2f}%)")
+    return covered
+
+def merge_patches(patch_dir: Path, output_path: Path, patch_size=None, prefix="patch"):
+    coords, open_patch, _ = _patch_source(patch_dir, prefix)
+
     # Determine patch size: provided or infer from the first patch
     if patch_size is None:
-        with Image.open(coords[0][2]) as im0:
+        with open_patch(coords[0][2]) as im0:
             pw, ph = im0.size
     else:
         pw, ph = patch_size
@@ -36,7 +278,7 @@ def merge_patches(patch_dir: Path, output_path: Path, patch_size=None, prefix="p
 
     canvas = Image.new("RGB", (max_right, max_bottom))
     for top, left, fp in coords:
-        with Image.open(fp) as patch:
+        with open_patch(fp) as patch:
             canvas.paste(patch.convert("RGB"), (left, top))
 
     output_path.parent.mkdir(parents=True, exist_ok=True)
@@ -45,20 +287,59 @@ def merge_patches(patch_dir: Path, output_path: Path, patch_size=None, prefix="p
 
 def main():
     ap = argparse.ArgumentParser(description="Reconstruct an image from patches named 'patch_<id>_<top>_<left>.<ext>'.")
-    ap.add_argument("--patch-dir", required=True, help="Folder containing patches.")
+    ap.add_argument("--patch-dir", default=None, help=f"Folder containing patches, or a packed {PACK_EXT} container.")
+    ap.add_argument("--coverage-from", default=None,
+                    help="Instead of the patches, mosaic the coverage stored in an analyze_masks json/ or store/ folder (needs --store-masks; TIFF output).")
     ap.add_argument("--output", default="reconstructed.png", help="Output image path.")
     ap.add_argument("--patch-width", type=int, default=None, help="Patch width (optional). If omitted, inferred from the first patch.")
     ap.add_argument("--patch-height", type=int, default=None, help="Patch height (optional). If omitted, inferred from the first patch.")
     ap.add_argument("--prefix", default="patch", help="Filename prefix used when splitting.")
+    ap.add_argument("--streaming", action="store_true", help="Write the output strip by strip (TIFF only); memory scales with mosaic width.")
+    ap.add_argument("--width", type=int, default=None, help="Original image width for cropping edge padding (streaming and coverage; default from <prefix>_layout.json).")
+    ap.add_argument("--height", type=int, default=None, help="Original image height for cropping edge padding (streaming).")
+    ap.add_argument("--workers", type=int, default=None, help="Threads decoding patches in streaming mode.")
+    ap.add_argument("--no-blend", action="store_true", help="Streaming: later patches overwrite overlaps instead of feathering.")
     args = ap.parse_args()
 
+    if args.coverage_from:
+        results = Path(args.coverage_from)
+        out = Path(args.output)
+        if not results.is_dir():
+            print(f"Results folder not found: {results}")
+            sys.exit(2)
+        if out.suffix.lower() not in {".tif", ".tiff"}:
+            print(f"Coverage mosaics are written as TIFF; got '{out.suffix}'. Use an output path ending in .tif")
+            sys.exit(2)
+        size = (args.width, args.height) if (args.width and args.height) else None
+        if size is None and args.patch_dir:
+            meta = _patch_source(Path(args.patch_dir), args.prefix)[2]
+            size = (meta["width"], meta["height"]) if "width" in meta else None
+        try:
+            merge_coverage_streaming(results, out, prefix=args.prefix, size=size, workers=args.workers)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        return
+    if not args.patch_dir:
+        print("Give --patch-dir (or --coverage-from)")
+        sys.exit(2)
+
     pdir = Path(args.patch_dir)
-    if not pdir.exists() or not pdir.is_dir():
+    if not pdir.exists() or not (pdir.is_dir() or pdir.suffix.lower() == PACK_EXT):
         print(f"Patch directory not found: {pdir}")
         sys.exit(2)
 
     psize = (args.patch_width, args.patch_height) if (args.patch_width and args.patch_height) else None
-    merge_patches(pdir, output_path=Path(args.output), patch_size=psize, prefix=args.prefix)
+    if args.streaming:
+        out = Path(args.output)
+        if out.suffix.lower() not in {".tif", ".tiff"}:
+            print(f"Streaming mode writes TIFF; got '{out.suffix}'. Use an output path ending in .tif")
+            sys.exit(2)
+        size = (args.width, args.height) if (args.width and args.height) else None
+        merge_patches_streaming(pdir, output_path=out, patch_size=psize, prefix=args.prefix, size=size,
+                                workers=args.workers, blend=not args.no_blend)
+    else:
+        merge_patches(pdir, output_path=Path(args.output), patch_size=psize, prefix=args.prefix)
 
 if __name__ == "__main__":
     main()
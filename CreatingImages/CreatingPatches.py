@@ -1,33 +1,311 @@
 from PIL import Image
-import argparse, sys
+import argparse, io, json, os, sys, time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
+try:
+    import numpy as np
+    import rasterio
+    from rasterio.windows import Window
+except ImportError:
+    rasterio = None
+
+from PatchPack import PACK_EXT, PatchPackWriter
+
 IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
 
-def split_image_into_patches(image_path: Path, patch_size=(1920, 1080), output_dir: Path = Path("patches"), prefix="patch", ext="png"):
+# Rasters are decoded window by window, so the decompression-bomb guard would only
+# reject exactly the inputs the streaming tiler exists for.
+Image.MAX_IMAGE_PIXELS = None
+
+# Bits per pixel for raw layouts whose row stride PIL leaves implicit (stride 0).
+RAW_BITS = {"1": 1, "L": 8, "P": 8, "LA": 16, "I;16": 16, "I;16B": 16, "RGB": 24, "BGR": 24,
+            "RGBA": 32, "RGBX": 32, "BGRX": 32, "CMYK": 32}
+
+def tile_positions(length, size, step):
+    """Window origins along one axis; the last window is the first one reaching the edge."""
+    pos = 0
+    while True:
+        yield pos
+        if pos + size >= length:
+            return
+        pos += step
+
+def _raw_layout(tile):
+    # (box, offset, rawmode, stride, ystep) of an uncompressed tile, or None if its row stride is unknown.
+    name, box, offset, args = tile
+    if name != "raw":
+        return None
+    args = (args,) if isinstance(args, str) else tuple(args)
+    rawmode = args[0]
+    stride = args[1] if len(args) > 1 else 0
+    ystep = args[2] if len(args) > 2 else 1
+    if not stride:
+        if rawmode not in RAW_BITS:
+            return None
+        stride = ((box[2] - box[0]) * RAW_BITS[rawmode] + 7) // 8
+    return tuple(box), offset, rawmode, stride, ystep
+
+class WindowReader:
+    """Decodes rectangular windows of a raster, touching only the bytes the window needs.
+
+    Uncompressed strip/tiled layouts (raw TIFF, BMP, PPM) are windowed by reading the rows
+    PIL's tile descriptors point at and decoding them with Image.frombytes; other 8-bit
+    formats go through rasterio when it is installed. Anything else falls back to one full
+    decode, which ``max_memory_mb`` may refuse.
+    """
+
+    def __init__(self, image_path: Path, max_memory_mb=None):
+        self.path = Path(image_path)
+        self.max_bytes = None if max_memory_mb is None else int(max_memory_mb * 1024 * 1024)
+        self._ds = None
+        self._full = None
+        with Image.open(self.path) as im:
+            self.size = im.size
+            self.mode = im.mode
+            self._palette = im.getpalette() if im.mode in ("P", "PA") else None
+            layouts = [_raw_layout(t) for t in im.tile]
+            self._tiles = layouts if layouts and all(layouts) else None
+        if self._tiles is None and rasterio is not None:
+            try:
+                ds = rasterio.open(self.path)
+                if ds.dtypes[0] == "uint8":
+                    self._ds = ds
+                else:
+                    ds.close()
+            except Exception:
+                self._ds = None
+
+    @property
+    def windowed(self):
+        return self._tiles is not None or self._ds is not None
+
+    def fits(self, width, height):
+        return self.max_bytes is None or width * height * 3 <= self.max_bytes
+
+    def read(self, box):
+        left, top, right, bottom = box
+        if self._ds is not None:
+            return self._read_rasterio(box)
+        if self._tiles is None:
+            return self._read_full().crop(box)
+        parts = []
+        for (tx0, ty0, tx1, ty1), offset, rawmode, stride, ystep in self._tiles:
+            if tx0 < right and tx1 > left and ty0 < bottom and ty1 > top:
+                bits = RAW_BITS.get(rawmode, 0)
+                # Whole-byte pixels can also be cut to the window's columns (strips span the full width).
+                cx0, cx1 = (max(tx0, left), min(tx1, right)) if bits and bits % 8 == 0 else (tx0, tx1)
+                parts.append(((tx0, ty0, tx1, ty1), (cx0, max(ty0, top), cx1, min(ty1, bottom)), offset, rawmode, stride, ystep, bits // 8))
+        x0, y0 = min(p[1][0] for p in parts), min(p[1][1] for p in parts)
+        x1, y1 = max(p[1][2] for p in parts), max(p[1][3] for p in parts)
+        if not self.fits(x1 - x0, y1 - y0):
+            raise MemoryError(f"{self.path.name}: window {x1 - x0}x{y1 - y0} exceeds the memory ceiling")
+        window = Image.new(self.mode, (x1 - x0, y1 - y0))
+        if self._palette is not None:
+            window.putpalette(self._palette)
+        with open(self.path, "rb") as f:
+            for (tx0, ty0, tx1, ty1), (cx0, a, cx1, b), offset, rawmode, stride, ystep, bpp in parts:
+                if (cx0, cx1) == (tx0, tx1):
+                    # Whole rows in one read; bottom-up layouts (ystep -1) store them in reverse.
+                    f.seek(offset + ((a - ty0) if ystep >= 0 else (ty1 - b)) * stride)
+                    part = Image.frombytes(self.mode, (tx1 - tx0, b - a), f.read((b - a) * stride), "raw", rawmode, stride, ystep)
+                else:
+                    rows = []
+                    for y in range(a, b):
+                        f.seek(offset + ((y - ty0) if ystep >= 0 else (ty1 - 1 - y)) * stride + (cx0 - tx0) * bpp)
+                        rows.append(f.read((cx1 - cx0) * bpp))
+                    part = Image.frombytes(self.mode, (cx1 - cx0, b - a), b"".join(rows), "raw", rawmode, (cx1 - cx0) * bpp, 1)
+                window.paste(part, (cx0 - x0, a - y0))
+        return window.convert("RGB").crop((left - x0, top - y0, right - x0, bottom - y0))
+
+    def _read_rasterio(self, box):
+        left, top, right, bottom = box
+        if not self.fits(right - left, bottom - top):
+            raise MemoryError(f"{self.path.name}: window {right - left}x{bottom - top} exceeds the memory ceiling")
+        arr = self._ds.read(window=Window(left, top, right - left, bottom - top))
+        if arr.shape[0] in (1, 2):  # gray, or gray + alpha: drop the alpha and spread gray over RGB
+            arr = np.repeat(arr[:1], 3, axis=0)
+        else:  # RGB, or RGBA / extra bands: keep the colour bands
+            arr = arr[:3]
+        return Image.fromarray(np.ascontiguousarray(np.moveaxis(arr, 0, -1)), "RGB")
+
+    def _read_full(self):
+        if self._full is None:
+            if not self.fits(*self.size):
+                raise MemoryError(f"{self.path.name}: format cannot be windowed and {self.size[0]}x{self.size[1]} "
+                                  f"exceeds the memory ceiling (store it as an uncompressed TIFF or install rasterio)")
+            self._full = Image.open(self.path).convert("RGB")
+        return self._full
+
+    def close(self):
+        if self._ds is not None:
+            self._ds.close()
+        self._full = None
+
+def layout_meta(image_path: Path, size, patch_size, stride):
     pw, ph = patch_size
-    image = Image.open(image_path).convert("RGB")
-    iw, ih = image.size
-    output_dir.mkdir(parents=True, exist_ok=True)
+    sx, sy = stride or patch_size
+    return {"image": image_path.name, "width": size[0], "height": size[1],
+            "patch_width": pw, "patch_height": ph, "stride_x": sx, "stride_y": sy}
+
+def write_layout(image_path: Path, size, output_dir: Path, prefix, patch_size, stride):
+    """Record the source size next to the patches so the merger can crop the edge padding."""
+    with open(output_dir / f"{prefix}_layout.json", "w", encoding="utf-8") as f:
+        json.dump(layout_meta(image_path, size, patch_size, stride), f, indent=2)
+
+def _iter_patches(reader, rows, patch_size, stride):
+    """Yield (patch_id, top, left, patch) for patch rows [rows[0], rows[1]) of an open reader.
 
-    patch_id = 0
-    for top in range(0, ih, ph):
-        for left in range(0, iw, pw):
+    Patch ids are derived from the row index, so any partition of the rows across
+    workers reproduces the serial numbering and filenames exactly.
+    """
+    pw, ph = patch_size
+    sx, sy = stride or patch_size
+    iw, ih = reader.size
+    lefts = list(tile_positions(iw, pw, sx))
+    tops = list(tile_positions(ih, ph, sy))
+    row_start, row_stop = rows if rows is not None else (0, len(tops))
+
+    patch_id = row_start * len(lefts)
+    for top in tops[row_start:row_stop]:
+        bottom = min(top + ph, ih)
+        # Hold one row of patches at a time; fall back to per-patch windows if even that is too big.
+        strip = reader.read((0, top, iw, bottom)) if reader.fits(iw, bottom - top) else None
+        for left in lefts:
             right = min(left + pw, iw)
-            bottom = min(top + ph, ih)
 
-            patch = image.crop((left, top, right, bottom))
+            if strip is not None:
+                patch = strip.crop((left, 0, right, bottom - top))
+            else:
+                patch = reader.read((left, top, right, bottom))
 
             if patch.size != (pw, ph):
                 padded = Image.new("RGB", (pw, ph))
                 padded.paste(patch, (0, 0))
                 patch = padded
 
+            yield patch_id, top, left, patch
+            patch_id += 1
+
+def _encode(patch, ext):
+    buf = io.BytesIO()
+    patch.save(buf, format="JPEG" if ext in ("jpg", "jpeg") else ext.upper())
+    return buf.getvalue()
+
+def _split_rows(image_path: Path, rows, patch_size, output_dir: Path, prefix, ext, stride, max_memory_mb, packed=False):
+    """Write the patches of the given rows as files and return how many were saved.
+
+    With ``packed`` the encoded patches are returned instead, as pack index entries.
+    """
+    reader = WindowReader(image_path, max_memory_mb=max_memory_mb)
+    saved, entries = 0, []
+    for patch_id, top, left, patch in _iter_patches(reader, rows, patch_size, stride):
+        if packed:
+            entries.append((patch_id, top, left, patch.size, _encode(patch, ext)))
+        else:
             out_path = output_dir / f"{prefix}_{patch_id}_{top}_{left}.{ext}"
             patch.save(out_path)
-            patch_id += 1
+        saved += 1
+    reader.close()
+    return entries if packed else saved
+
+def split_image_into_patches(image_path: Path, patch_size=(1920, 1080), output_dir: Path = Path("patches"), prefix="patch", ext="png",
+                             stride=None, max_memory_mb=None, pack=False):
+    pw, ph = patch_size
+    sx, sy = stride or patch_size
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if pack:
+        reader = WindowReader(image_path, max_memory_mb=max_memory_mb)
+        dest = output_dir / f"{image_path.stem}{PACK_EXT}"
+        meta = {**layout_meta(image_path, reader.size, patch_size, stride), "prefix": prefix, "ext": ext}
+        with PatchPackWriter(dest, meta) as w:
+            for patch_id, top, left, patch in _iter_patches(reader, None, patch_size, stride):
+                w.add(patch_id, top, left, patch.size, _encode(patch, ext))
+        reader.close()
+        saved = len(w.entries)
+        print(f"{image_path.name}: packed {saved} patches into '{dest}' ({pw}x{ph}, stride {sx}x{sy}).")
+        return saved
+    saved = _split_rows(image_path, None, patch_size, output_dir, prefix, ext, stride, max_memory_mb)
+    with Image.open(image_path) as im:
+        write_layout(image_path, im.size, output_dir, prefix, patch_size, stride)
+    print(f"{image_path.name}: saved {saved} patches to '{output_dir}' ({pw}x{ph}, stride {sx}x{sy}).")
+    return saved
+
+def _commit_staged(stage: Path, outdir: Path):
+    """Move a staged image's files into its output folder, replacing what earlier images left there."""
+    for f in sorted(stage.iterdir()):
+        os.replace(f, outdir / f.name)
+    stage.rmdir()
+
+def split_images_parallel(jobs, patch_size=(1920, 1080), prefix="patch", ext="png", stride=None, max_memory_mb=None, workers=None,
+                          pack=False):
+    """Split several (image_path, output_dir) jobs on a process pool, one task per patch row.
+
+    All images run at once. Images sharing an output folder would overwrite each other's
+    patches in the serial run, so every image after the first in a folder is written to a
+    hidden staging folder and moved in, in serial order, once it and the images before it
+    are done. With ``pack`` the workers return encoded patches and this process appends
+    them to one container per image.
+    """
+    pw, ph = patch_size
+    sx, sy = stride or patch_size
+    by_dir = defaultdict(list)
+    for k, (_, outdir) in enumerate(jobs):
+        by_dir[outdir].append(k)
 
-    print(f"{image_path.name}: saved {patch_id} patches to '{output_dir}' ({pw}x{ph}).")
+    saved, pending, done, writers, stages = defaultdict(int), defaultdict(int), set(), {}, {}
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        futures = {}
+        for k, (image_path, outdir) in enumerate(jobs):
+            outdir.mkdir(parents=True, exist_ok=True)
+            dest = outdir
+            if by_dir[outdir][0] != k:
+                dest = stages[k] = outdir / f".{prefix}_staging_{k}"
+                dest.mkdir(exist_ok=True)
+            reader = WindowReader(image_path, max_memory_mb=max_memory_mb)
+            nrows = len(list(tile_positions(reader.size[1], ph, sy)))
+            if pack:
+                meta = {**layout_meta(image_path, reader.size, patch_size, stride), "prefix": prefix, "ext": ext}
+                writers[k] = PatchPackWriter(dest / f"{image_path.stem}{PACK_EXT}", meta)
+            else:
+                write_layout(image_path, reader.size, dest, prefix, patch_size, stride)
+            # Non-windowable formats are decoded in full, so keep them to one task per image.
+            step = 1 if reader.windowed else nrows
+            reader.close()
+            for row in range(0, nrows, step):
+                fut = ex.submit(_split_rows, image_path, (row, min(row + step, nrows)), patch_size, dest,
+                                prefix, ext, stride, max_memory_mb, pack)
+                futures[fut] = k
+                pending[k] += 1
+
+        # Packs are appended in row order so the container is byte-identical to a serial run.
+        for fut in (list(futures) if pack else as_completed(futures)):
+            k = futures[fut]
+            image_path, outdir = jobs[k]
+            result = fut.result()
+            if pack:
+                for entry in result:
+                    writers[k].add(*entry)
+                result = len(result)
+            saved[k] += result
+            pending[k] -= 1
+            if pending[k]:
+                continue
+            done.add(k)
+            if pack:
+                writers.pop(k).close()
+                print(f"{image_path.name}: packed {saved[k]} patches into "
+                      f"'{outdir / (image_path.stem + PACK_EXT)}' ({pw}x{ph}, stride {sx}x{sy}).")
+            else:
+                print(f"{image_path.name}: saved {saved[k]} patches to '{outdir}' ({pw}x{ph}, stride {sx}x{sy}).")
+            # Move in every finished image of this folder whose predecessors are all in place.
+            order = by_dir[outdir]
+            while order and order[0] in done:
+                first = order.pop(0)
+                if first in stages:
+                    _commit_staged(stages.pop(first), outdir)
+    return sum(saved.values())
 
 def main():
     ap = argparse.ArgumentParser(description="Split a single image or all images under a folder into fixed-size patches.")
@@ -38,6 +316,12 @@ def main():
     ap.add_argument("--prefix", default="patch", help="Filename prefix for patches.")
     ap.add_argument("--ext", default="png", choices=["png", "jpg", "jpeg"], help="Output image format.")
     ap.add_argument("--per-image-subfolders", action="store_true", help="If input is a folder, create a subfolder per image.")
+    ap.add_argument("--overlap", type=int, default=0, help="Pixels shared by neighbouring patches on both axes.")
+    ap.add_argument("--stride-x", type=int, default=None, help="Horizontal step between patches (overrides --overlap).")
+    ap.add_argument("--stride-y", type=int, default=None, help="Vertical step between patches (overrides --overlap).")
+    ap.add_argument("--workers", type=int, default=1, help="Worker processes spread over images and patch rows (0 = all cores).")
+    ap.add_argument("--pack", action="store_true", help=f"Write one <image>{PACK_EXT} container per image instead of loose patch files.")
+    ap.add_argument("--max-memory-mb", type=float, default=None, help="Ceiling for decoded pixels held at once; refuse inputs that cannot stay under it.")
     args = ap.parse_args()
 
     inp = Path(args.input)
@@ -46,21 +330,36 @@ def main():
         sys.exit(2)
 
     patch_size = (args.patch_width, args.patch_height)
+    stride = (args.stride_x or args.patch_width - args.overlap, args.stride_y or args.patch_height - args.overlap)
+    if min(stride) <= 0:
+        print(f"Invalid stride {stride[0]}x{stride[1]}: overlap must be smaller than the patch size.")
+        sys.exit(2)
     out_root = Path(args.output_dir)
 
     if inp.is_file():
-        split_image_into_patches(inp, patch_size=patch_size, output_dir=out_root, prefix=args.prefix, ext=args.ext)
+        jobs = [(inp, out_root)]
     elif inp.is_dir():
         imgs = sorted([p for p in inp.rglob("*") if p.suffix.lower() in IMG_EXTS])
         if not imgs:
             print("No images found in the input folder.")
             sys.exit(1)
-        for img in imgs:
-            outdir = out_root / img.stem if args.per_image_subfolders else out_root
-            split_image_into_patches(img, patch_size=patch_size, output_dir=outdir, prefix=args.prefix, ext=args.ext)
+        jobs = [(img, out_root / img.stem if args.per_image_subfolders else out_root) for img in imgs]
     else:
         print(f"Unsupported input path: {inp}")
         sys.exit(2)
 
+    workers = args.workers or os.cpu_count() or 1
+    t0 = time.perf_counter()
+    if workers == 1:
+        total = sum(split_image_into_patches(img, patch_size=patch_size, output_dir=outdir, prefix=args.prefix, ext=args.ext,
+                                             stride=stride, max_memory_mb=args.max_memory_mb, pack=args.pack)
+                    for img, outdir in jobs)
+    else:
+        total = split_images_parallel(jobs, patch_size=patch_size, prefix=args.prefix, ext=args.ext,
+                                      stride=stride, max_memory_mb=args.max_memory_mb, workers=workers, pack=args.pack)
+    elapsed = max(time.perf_counter() - t0, 1e-9)
+    print(f"Done: {len(jobs)} image(s), {total} patches in {elapsed:.1f}s "
+          f"({total / elapsed:.1f} patches/s, {workers} worker{'s' if workers > 1 else ''}).")
+
 if __name__ == "__main__":
     main()
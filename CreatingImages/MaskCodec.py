@@ -0,0 +1,186 @@
+import base64
+import numpy as np
+
+# Stored instance masks, as analyze_masks.py --store-masks writes them into a segment's "mask":
+#   {"rle": <base64>, "size": [h, w]}  the instance on the model's mask grid with the letterbox
+#       padding cut off; row-major run lengths (first run is background) packed as LEB128 varints.
+#       Upsampled to the image like ultralytics' scale_masks, so unions reproduce --coverage-res orig.
+#   {"poly": [[x0, y0, x1, y1, ...], ...]}  simplified outer and hole rings in original image
+#       pixel coordinates (pixel edges, not centres), filled with the even-odd rule.
+
+# Default simplification tolerance of encode_polygons, in original image pixels.
+POLY_EPSILON = 1.0
+# Output rows upsampled per step; bounds the float32 temporaries on large images.
+ROWS_PER_STEP = 1024
+
+def _varint_encode(values):
+    """(LEB128 bytes of every value, bytes per value), all values at once."""
+    v = np.asarray(values, dtype=np.int64)
+    nbytes = np.ones(len(v), dtype=np.int64)
+    for k in range(1, 5):  # run lengths stay below 2**35
+        nbytes += v >= (1 << (7 * k))
+    rep = np.repeat(v, nbytes)
+    pos = np.arange(len(rep)) - np.repeat(np.cumsum(nbytes) - nbytes, nbytes)
+    out = ((rep >> (7 * pos)) & 0x7F).astype(np.uint8)
+    out[pos < np.repeat(nbytes - 1, nbytes)] |= 0x80
+    return out, nbytes
+
+def _varint_decode(data):
+    b = np.frombuffer(data, dtype=np.uint8).astype(np.int64)
+    if not len(b):
+        return b
+    ends = np.flatnonzero(b < 0x80)
+    starts = np.r_[0, ends[:-1] + 1]
+    pos = np.arange(len(b)) - np.repeat(starts, ends - starts + 1)
+    return np.add.reduceat((b & 0x7F) << (7 * pos), starts)
+
+def encode_rle(masks):
+    """RLE strings of a (n, h, w) bool stack, found with one pass over the whole stack."""
+    n = len(masks)
+    hw = masks[0].size
+    flat = np.ascontiguousarray(masks).reshape(-1)
+    # Changes along the whole stack as one flat array (a 1-D nonzero is several times faster than a 2-D one).
+    changes = np.empty(flat.shape, dtype=bool)
+    changes[0] = flat[0]
+    np.not_equal(flat[1:], flat[:-1], out=changes[1:])
+    changes[::hw] = flat[::hw]  # every mask starts after a virtual background pixel
+    p = np.flatnonzero(changes)
+    inst = p // hw
+    pos = p - inst * hw
+    per = np.bincount(inst, minlength=n)
+    # Each instance's boundaries are its change positions followed by the end of the mask.
+    ends = np.cumsum(per)
+    bounds = np.insert(pos, ends, hw)
+    first = np.cumsum(per + 1) - (per + 1)
+    prev = np.r_[0, bounds[:-1]]
+    prev[first] = 0
+    data, nbytes = _varint_encode(bounds - prev)
+    split = np.cumsum(np.add.reduceat(nbytes, first))[:-1]
+    return [base64.b64encode(b.tobytes()).decode("ascii") for b in np.split(data, split)]
+
+def decode_rle(rle, size):
+    counts = _varint_decode(base64.b64decode(rle))
+    values = np.zeros(len(counts), dtype=bool)
+    values[1::2] = True
+    return np.repeat(values, counts).reshape(size)
+
+def rle_area(rle):
+    """Foreground pixels of an RLE mask on its grid, without decoding it."""
+    return int(_varint_decode(base64.b64decode(rle))[1::2].sum())
+
+def encode_polygons(masks, shape, epsilon=POLY_EPSILON):
+    """Simplified rings of each (n, h, w) bool grid mask, scaled to an image of ``shape`` (h, w)."""
+    import cv2
+    gh, gw = masks.shape[1:]
+    sy, sx = shape[0] / gh, shape[1] / gw
+    # Contours of the pixel-corner grid (a corner is set when any pixel touching it is) run
+    # along the pixel edges, so the rings cover the whole mask and not just its pixel centres.
+    p = np.pad(masks, ((0, 0), (1, 1), (1, 1)))
+    corners = (p[:, :-1, :-1] | p[:, :-1, 1:] | p[:, 1:, :-1] | p[:, 1:, 1:]).view(np.uint8)
+    eps = epsilon / max(sx, sy)
+    out = []
+    for c in corners:
+        contours, _ = cv2.findContours(c, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+        rings = []
+        for ring in contours:
+            ring = cv2.approxPolyDP(ring, eps, True)[:, 0].astype(np.float64)
+            if len(ring) >= 3:
+                rings.append(np.round(ring * (sx, sy), 1).ravel().tolist())
+        out.append(rings)
+    return out
+
+def fill_polygons(rings, shape):
+    """Even-odd fill of flat [x0, y0, x1, y1, ...] rings, sampled at pixel centres."""
+    h, w = shape
+    if not rings:
+        return np.zeros(shape, dtype=bool)
+    pts = [np.asarray(r, dtype=np.float64).reshape(-1, 2) for r in rings]
+    a = np.concatenate(pts)
+    b = np.concatenate([np.roll(p, -1, axis=0) for p in pts])
+    x0, y0, x1, y1 = a[:, 0], a[:, 1], b[:, 0], b[:, 1]
+    # Row r crosses an edge when its centre r + 0.5 lies in [min y, max y); horizontal edges never do.
+    r0 = np.clip(np.ceil(np.minimum(y0, y1) - 0.5), 0, h).astype(np.int64)
+    r1 = np.clip(np.ceil(np.maximum(y0, y1) - 0.5), 0, h).astype(np.int64)
+    nrows = r1 - r0
+    edge = np.repeat(np.arange(len(a)), nrows)
+    rows = np.repeat(r0, nrows) + np.arange(nrows.sum()) - np.repeat(np.cumsum(nrows) - nrows, nrows)
+    x = x0[edge] + (rows + 0.5 - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+    order = np.lexsort((x, rows))
+    rows, cols = rows[order], np.clip(np.ceil(x[order] - 0.5), 0, w).astype(np.int64)
+    # Crossings pair up within each row; a pixel is inside from one crossing of a pair to the next.
+    diff = np.zeros((h, w + 1), dtype=np.int8)
+    np.add.at(diff, (rows[0::2], cols[0::2]), 1)
+    np.add.at(diff, (rows[1::2], cols[1::2]), -1)
+    return np.cumsum(diff, axis=1, dtype=np.int8)[:, :w] > 0
+
+def _linear_taps(n_in, n_out):
+    # torch's bilinear interpolation with align_corners=False: a float32 scale, source positions in double.
+    scale = np.float64(np.float32(n_in) / np.float32(n_out))
+    src = np.maximum(scale * (np.arange(n_out) + 0.5) - 0.5, 0.0).astype(np.float32)
+    i0 = src.astype(np.int64)
+    l1 = src - i0.astype(np.float32)
+    return i0, np.minimum(i0 + 1, n_in - 1), np.float32(1) - l1, l1
+
+def upsample(mask, shape):
+    """Bilinear resize of a bool grid mask to ``shape``, thresholded at 0.5 as analyze_masks does."""
+    h, w = shape
+    if mask.shape == (h, w):
+        return mask.astype(bool)
+    c0, c1, cw0, cw1 = _linear_taps(mask.shape[1], w)
+    r0, r1, rw0, rw1 = _linear_taps(mask.shape[0], h)
+    m = mask.astype(np.float32)
+    cols = m[:, c0] * cw0 + m[:, c1] * cw1
+    out = np.empty((h, w), dtype=bool)
+    for s in range(0, h, ROWS_PER_STEP):
+        e = min(s + ROWS_PER_STEP, h)
+        out[s:e] = (rw0[s:e, None] * cols[r0[s:e]] + rw1[s:e, None] * cols[r1[s:e]]) > 0.5
+    return out
+
+def union(masks, shape):
+    """Union of stored masks at image size ``shape``; RLE masks are merged on their grid before upsampling."""
+    out = np.zeros(shape, dtype=bool)
+    grids = {}
+    for m in masks:
+        if "rle" in m:
+            size = tuple(m["size"])
+            g = grids.setdefault(size, np.zeros(size, dtype=bool))
+            g |= decode_rle(m["rle"], size)
+        else:
+            out |= fill_polygons(m["poly"], shape)
+    for g in grids.values():
+        out |= upsample(g, shape)
+    return out
+
+def rasterize(mask, shape):
+    return union([mask], shape)
+
+def _grouped(rec, key):
+    groups = {}
+    for seg in rec["segments_kept"]:
+        if "mask" not in seg:
+            raise ValueError(f"{rec['image']}: segments carry no masks (analyze with --store-masks)")
+        groups.setdefault(seg[key], []).append(seg["mask"])
+    return groups
+
+def class_masks(rec):
+    """{class name: full-resolution union of its kept masks} of one analyzer record."""
+    shape = (rec["height"], rec["width"])
+    return {name: union(masks, shape) for name, masks in _grouped(rec, "class_name").items()}
+
+def label_raster(rec):
+    """uint8 (h, w) map of one record: 0 where nothing was kept, else 1 + class_id (lower ids win overlaps)."""
+    shape = (rec["height"], rec["width"])
+    out = np.zeros(shape, dtype=np.uint8)
+    groups = _grouped(rec, "class_id")
+    for cid in sorted(groups, reverse=True):
+        out[union(groups[cid], shape)] = cid + 1
+    return out
+
+# Label colours: background black, then one colour per class in order.
+PALETTE = [(0, 0, 0), (46, 160, 67), (255, 196, 0), (42, 127, 255), (220, 50, 47), (150, 80, 200),
+           (0, 190, 190), (255, 120, 0), (140, 140, 140)]
+
+def palette():
+    """(256, 3) uint8 colours of label_raster values; colours repeat past the table."""
+    cols = [PALETTE[0]] + [PALETTE[1 + i % (len(PALETTE) - 1)] for i in range(255)]
+    return np.array(cols, dtype=np.uint8)
@@ -0,0 +1,145 @@
+from PIL import Image
+import argparse, io, json, mmap, re, struct, sys
+from pathlib import Path
+import numpy as np
+
+PACK_EXT = ".ptpk"
+MAGIC = b"PTPK"
+VERSION = 1
+# magic, version, reserved, index offset, tile count, metadata length
+HEADER = struct.Struct("<4sHHQQI4x")
+INDEX_DTYPE = np.dtype([("id", "<u4"), ("top", "<u4"), ("left", "<u4"), ("width", "<u4"), ("height", "<u4"),
+                        ("offset", "<u8"), ("length", "<u8")])
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
+
+# Container layout: fixed header, JSON metadata (source size, patch size, stride, prefix, ext),
+# the encoded tiles back to back, then one INDEX_DTYPE record per tile sorted by patch id.
+
+class PatchPackWriter:
+    def __init__(self, path: Path, meta):
+        self.path = Path(path)
+        self.meta = dict(meta)
+        self.f = open(self.path, "wb")
+        blob = json.dumps(self.meta).encode("utf-8")
+        self.f.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0, len(blob)) + blob)
+        self.entries = []
+
+    def add(self, patch_id, top, left, size, data: bytes):
+        self.entries.append((patch_id, top, left, size[0], size[1], self.f.tell(), len(data)))
+        self.f.write(data)
+
+    def close(self):
+        index = np.array(sorted(self.entries), dtype=INDEX_DTYPE)
+        index_at = self.f.tell()
+        self.f.write(index.tobytes())
+        blob_len = len(json.dumps(self.meta).encode("utf-8"))
+        self.f.seek(0)
+        self.f.write(HEADER.pack(MAGIC, VERSION, 0, index_at, len(index), blob_len))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class PatchPack:
+    """Memory-mapped read access to a packed patch container."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._f = open(self.path, "rb")
+        self.mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, index_at, count, meta_len = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path}: not a patch pack (magic={magic!r}, version={version})")
+        self.meta = json.loads(self.mm[HEADER.size:HEADER.size + meta_len].decode("utf-8"))
+        self.index = np.frombuffer(self.mm, dtype=INDEX_DTYPE, count=count, offset=index_at)
+        self.prefix = self.meta.get("prefix", "patch")
+        self.ext = self.meta.get("ext", "png")
+
+    def __len__(self):
+        return len(self.index)
+
+    def name(self, i):
+        e = self.index[i]
+        return f"{self.prefix}_{e['id']}_{e['top']}_{e['left']}.{self.ext}"
+
+    def read_bytes(self, i):
+        e = self.index[i]
+        return self.mm[int(e["offset"]):int(e["offset"]) + int(e["length"])]
+
+    def open(self, i):
+        return Image.open(io.BytesIO(self.read_bytes(i)))
+
+    def close(self):
+        # Drop the numpy view first; an exported buffer keeps the mmap from closing.
+        self.index = None
+        self.mm.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def export_loose(pack_path: Path, output_dir: Path):
+    """Write every tile back out as patch_<id>_<top>_<left>.<ext> plus the layout sidecar."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with PatchPack(pack_path) as pack:
+        for i in range(len(pack)):
+            (output_dir / pack.name(i)).write_bytes(pack.read_bytes(i))
+        with open(output_dir / f"{pack.prefix}_layout.json", "w", encoding="utf-8") as f:
+            json.dump({k: v for k, v in pack.meta.items() if k not in ("prefix", "ext")}, f, indent=2)
+        return len(pack)
+
+def pack_loose(patch_dir: Path, pack_path: Path, prefix="patch"):
+    """Pack an existing folder of patch_<id>_<top>_<left>.<ext> files without re-encoding."""
+    pattern = re.compile(rf"{re.escape(prefix)}_(\d+)_(\d+)_(\d+)", re.IGNORECASE)
+    files = []
+    for fp in patch_dir.iterdir():
+        m = pattern.fullmatch(fp.stem) if fp.suffix.lower() in IMG_EXTS else None
+        if m:
+            files.append((int(m.group(1)), int(m.group(2)), int(m.group(3)), fp))
+    if not files:
+        print("No valid patch filenames found (expected 'patch_<id>_<top>_<left>.<ext>').")
+        sys.exit(1)
+    files.sort()
+    meta = {}
+    layout = patch_dir / f"{prefix}_layout.json"
+    if layout.exists():
+        with open(layout, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    meta.update(prefix=prefix, ext=files[0][3].suffix.lstrip(".").lower())
+    with PatchPackWriter(pack_path, meta) as w:
+        for patch_id, top, left, fp in files:
+            with Image.open(fp) as im:
+                size = im.size
+            w.add(patch_id, top, left, size, fp.read_bytes())
+    return len(files)
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert between a packed patch container and loose patch files.")
+    ap.add_argument("--pack", required=True, help=f"Container path ({PACK_EXT}).")
+    ap.add_argument("--export-dir", default=None, help="Unpack the container into this folder.")
+    ap.add_argument("--from-dir", default=None, help="Build the container from this folder of loose patches.")
+    ap.add_argument("--prefix", default="patch", help="Filename prefix of the loose patches (with --from-dir).")
+    args = ap.parse_args()
+
+    pack_path = Path(args.pack)
+    if args.from_dir:
+        n = pack_loose(Path(args.from_dir), pack_path, prefix=args.prefix)
+        print(f"Packed {n} patches into {pack_path}")
+    elif args.export_dir:
+        if not pack_path.exists():
+            print(f"Pack not found: {pack_path}")
+            sys.exit(2)
+        n = export_loose(pack_path, Path(args.export_dir))
+        print(f"Exported {n} patches to {args.export_dir}")
+    else:
+        with PatchPack(pack_path) as pack:
+            print(f"{pack_path}: {len(pack)} patches, {json.dumps(pack.meta)}")
+
+if __name__ == "__main__":
+    main()
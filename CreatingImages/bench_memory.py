@@ -0,0 +1,77 @@
+import argparse, multiprocessing, shutil, sys, tempfile, time
+from pathlib import Path
+import numpy as np
+from CreatingBigImage import StripTiffWriter
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def write_synthetic(path, side, band=256):
+    """Uncompressed strip TIFF of side x side pixels, written band by band so this process stays small too."""
+    w = StripTiffWriter(path, side, side)
+    x = np.arange(side, dtype=np.uint32)
+    for top in range(0, side, band):
+        y = np.arange(top, min(top + band, side), dtype=np.uint32)[:, None]
+        w.write_rows(np.stack([(x + y) % 251, (x * 3 + y) % 253, (x ^ y) % 255], axis=-1).astype(np.uint8))
+    w.close()
+
+def peak_rss_mb():
+    """Peak RSS of this process in MB (None where it cannot be read); bench_pipeline.py uses it too."""
+    # VmHWM is this process's own high-water mark; Linux carries ru_maxrss over from the parent across exec.
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is KiB on Linux, bytes on macOS.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1048576 if sys.platform == "darwin" else 1024)
+
+def _split(path, outdir, patch, max_memory_mb, queue):
+    from CreatingPatches import split_image_into_patches
+    t0 = time.perf_counter()
+    saved = split_image_into_patches(Path(path), patch_size=(patch, patch), output_dir=Path(outdir), ext="jpg",
+                                     max_memory_mb=max_memory_mb)
+    queue.put((saved, peak_rss_mb(), time.perf_counter() - t0))
+
+def main():
+    ap = argparse.ArgumentParser(description="Peak RSS of CreatingPatches on growing synthetic images; fails if it does not stay flat.")
+    ap.add_argument("--sides", type=int, nargs="+", default=[2048, 4096, 8192], help="Square image sides to split")
+    ap.add_argument("--patch", type=int, default=512)
+    ap.add_argument("--max-memory-mb", type=float, default=4, help="Passed to the tiler; below one patch row, so patches are read as single windows")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="Allowed growth of peak RSS from the smallest to the largest image")
+    ap.add_argument("--workdir", default=None, help="Where to write the synthetic images (default: a temp folder)")
+    args = ap.parse_args()
+
+    root = Path(args.workdir or tempfile.mkdtemp(prefix="bench_memory_"))
+    ctx = multiprocessing.get_context("spawn")  # a fresh process per size, so the peak is that split's own
+    peaks = []
+    print("| Image | Pixels | Patches | Peak RSS (MB) | Time (s) |\n|---|---:|---:|---:|---:|")
+    try:
+        for side in args.sides:
+            src = root / f"synthetic_{side}.tif"
+            write_synthetic(src, side)
+            queue = ctx.Queue()
+            p = ctx.Process(target=_split, args=(str(src), str(root / f"patches_{side}"), args.patch, args.max_memory_mb, queue))
+            p.start()
+            saved, peak, secs = queue.get()
+            p.join()
+            peaks.append(peak)
+            print(f"| {side}x{side} | {side * side / 1e6:.1f}M | {saved} | {peak:.1f} | {secs:.1f} |")
+            src.unlink()
+            shutil.rmtree(root / f"patches_{side}", ignore_errors=True)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+    growth = peaks[-1] / peaks[0] - 1.0
+    print(f"Peak RSS growth: {growth * 100.0:+.1f}% for {args.sides[-1] ** 2 / args.sides[0] ** 2:.0f}x the pixels "
+          f"({'flat' if growth <= args.tolerance else 'NOT flat'}, tolerance {args.tolerance * 100.0:.0f}%)")
+    sys.exit(0 if growth <= args.tolerance else 1)
+
+if __name__ == "__main__":
+    main()